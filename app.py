@@ -9,20 +9,41 @@
 
 import streamlit as st
 import pandas as pd
+import base64
+import hashlib
+import importlib
 import json
+import math
 import os
+import random
+import re
 import smtplib
+import socket
+import sqlite3
+import sys
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email import encoders
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APIStatusError, InternalServerError, RateLimitError
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
+from PIL import Image
 import io
-from datetime import datetime
+import queue
+import threading
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import accumulate
+from types import SimpleNamespace
+from urllib.parse import urlparse
 
 # ============================================
 # 설정값
@@ -33,6 +54,17 @@ ADMIN_PW = "1113"
 
 DATA_DIR = "data"
 SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
+CACHE_FILE = os.path.join(DATA_DIR, "content_cache.db")
+JOBS_DIR = os.path.join(DATA_DIR, "jobs")
+QUEUE_FILE = os.path.join(DATA_DIR, "job_queue.db")
+OUTPUT_DIR = os.path.join(DATA_DIR, "output")
+OUTBOX_FILE = os.path.join(DATA_DIR, "outbox.db")
+BATCH_RUNS_FILE = os.path.join(DATA_DIR, "batch_runs.db")
+BATCH_DIR = os.path.join(DATA_DIR, "batches")
+CUSTOMER_INDEX_FILE = os.path.join(DATA_DIR, "customers.db")
+
+FONT_NAME = "NanumGothic"
+FONT_PATH = "/usr/share/fonts/truetype/nanum/NanumGothic.ttf"
 
 COVER_IMAGE = "cover_bg.jpg"
 PAGE_IMAGE = "page_bg.jpg"
@@ -43,8 +75,149 @@ SERVICE_TYPES = ["사주", "연애", "타로"]
 PDF_FONT_SIZE = 17  # 폰트 크기
 PDF_LINE_HEIGHT = 24  # 행간
 PDF_MARGIN = 65  # 여백
+PDF_MARGIN_TOP = 75  # 본문 위 여백
+PDF_MARGIN_BOTTOM = 75  # 본문 아래 여백 (이보다 내려가면 다음 쪽)
+PDF_TITLE_GAP = 45  # 챕터 제목 아래 간격
+PDF_BLANK_GAP = 12  # 빈 줄(문단 사이) 간격
+PDF_SUBHEADING_GAP = (10, 5)  # 소제목 위/아래 추가 간격
 CHARS_PER_PAGE = 800  # 페이지당 예상 글자 수
 
+# 분량 계획 (챕터별 호출 수 / max_tokens)
+MAX_CHARS_PER_CALL = 2500  # GPT 호출 1번으로 안정적으로 받을 수 있는 글자 수
+TOKENS_PER_HANGUL = {  # 한글 1글자당 토큰 수 (o200k / cl100k 기준 보수적으로)
+    "gpt-4o-mini": 0.8,
+    "gpt-4o": 0.8,
+    "gpt-4-turbo": 1.3
+}
+MODEL_MAX_OUTPUT_TOKENS = {
+    "gpt-4o-mini": 16384,
+    "gpt-4o": 16384,
+    "gpt-4-turbo": 4096
+}
+MAX_TOKENS_HEADROOM = 2.0  # 목표 글자 수 대비 max_tokens 여유 (응답이 잘리지 않도록)
+TOPUP_TOLERANCE = 0.1  # 챕터가 목표보다 10% 넘게 짧으면 보충 호출
+TOPUP_MIN_CHARS = 600  # 보충 호출 1번의 최소 목표 글자 수
+MAX_TOPUP_PARTS = 2  # 챕터당 최대 보충 호출 수
+PART_TEMPERATURE = 0.75  # 본문 생성 temperature
+
+# 앞 내용 요약 이어 쓰기 (선택, 파트끼리 같은 내용 반복 방지)
+CONTEXT_SUMMARY_TOKENS = 400  # 요약 최대 토큰 수 (호출마다 늘어나는 프롬프트 크기 상한)
+CONTEXT_CHAPTER_SHARE = 0.6  # 앞 챕터가 있을 때 현재 챕터 앞 파트 요약에 주는 몫
+CONTEXT_SENTENCE_CHARS = 80  # 요약에 넣는 문장 1개의 최대 글자 수
+
+# 챕터 템플릿 (settings.json의 chapter_templates: 서비스별 템플릿 챕터 + 버킷 컬럼)
+TEMPLATE_FILE = os.path.join(DATA_DIR, "templates.db")
+TEMPLATE_PERSONAL_SHARE = 0.15  # 파트 분량 중 고객 맞춤 도입부 몫
+TEMPLATE_PERSONAL_MIN_CHARS = 150
+TEMPLATE_PERSONAL_MAX_CHARS = 400
+TEMPLATE_DIGEST_CHARS = 300  # 맞춤 도입부 호출에 넘기는 공통 본문 요약 길이
+
+# 모델별 가격 (100만 토큰당 USD, cached_input은 프롬프트 캐시 적중분)
+# settings.json의 model_prices로 모델별 덮어쓰기 가능
+MODEL_PRICES = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4-turbo": {"input": 10.00, "output": 30.00}
+}
+
+# 사용량 장부 / 지출 한도 (한도는 settings.json의 job_spend_cap_usd / daily_spend_cap_usd, 0이면 제한 없음)
+USAGE_FILE = os.path.join(DATA_DIR, "usage.db")
+ESTIMATE_HISTORY_CALLS = 500  # 예상 비용 보정에 쓰는 최근 호출 수
+ESTIMATE_MIN_CALLS = 20  # 이보다 기록이 적으면 보정하지 않음
+
+# 배경 이미지 설정 (원본은 A4 300dpi라 PDF 용량이 큼)
+BG_IMAGE_DPI = 150  # A4 기준 축소 해상도
+BG_JPEG_QUALITY = 80  # 재압축 JPEG 품질 (1~95)
+
+# 이메일 첨부 스트리밍 (57바이트 = base64 한 줄 76자, 그 배수로 읽음)
+EMAIL_CHUNK_BYTES = 57 * 1024
+
+# 메일 서버 / 발송 큐 설정
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 587
+EMAIL_DAILY_QUOTA = 450  # 하루 발송 한도 (Gmail 일반 계정 500통보다 여유 있게)
+EMAIL_MAX_ATTEMPTS = 5  # 메일 1통당 최대 시도 횟수
+EMAIL_RETRY_BASE_DELAY = 60.0  # 첫 재시도 대기 (초), 이후 2배씩 증가
+EMAIL_RETRY_MAX_DELAY = 3600.0  # 재시도 대기 상한 (초)
+SMTP_IDLE_SECONDS = 60  # 이 시간 넘게 쉰 연결은 NOOP으로 확인 후 재사용
+SMTP_MESSAGES_PER_CONNECTION = 100  # 연결 1개로 보낼 최대 메일 수 (넘으면 새로 연결)
+EMAIL_SENDING_STALE_SECONDS = 600  # 발송 중 상태로 이 시간이 지나면 다시 대기열로
+
+# 출력 PDF 보관 (OUTPUT_DIR)
+OUTPUT_RETENTION_DAYS = 30  # 이보다 오래된 PDF는 정리 (0이면 지우지 않음)
+OUTPUT_SWEEP_SECONDS = 3600  # 워커가 쉬는 동안 정리하는 간격
+
+# OpenAI Batch API 설정 (야간 대량 처리)
+BATCH_MAX_REQUESTS = 50000  # 배치 파일 1개 최대 요청 수 (OpenAI 한도)
+BATCH_MAX_FILE_MB = 190  # 배치 파일 1개 최대 크기 (한도 200MB보다 여유 있게)
+BATCH_MAX_ROUNDS = 3  # 본문 → 보충 파트 → 실패분 재요청
+BATCH_POLL_SECONDS = 300  # 워커가 배치 상태를 확인하는 간격 (초)
+BATCH_LEASE_SECONDS = 1800  # 한 워커가 결과를 처리하는 동안 다른 워커가 못 잡게 하는 시간
+BATCH_PRICE_RATIO = 0.5  # 동기 호출 대비 Batch API 가격
+
+# PDF 렌더링 프로세스 수 (0이면 Streamlit 프로세스 안에서 바로 렌더링)
+RENDER_PROCESSES = 0
+
+# GPT 동시 호출 설정
+DEFAULT_MAX_WORKERS = 4  # 고객 1명당 동시 GPT 호출 수
+MAX_WORKERS_LIMIT = 16  # 설정 가능한 최대값
+
+# 모델별 분당 요청 수(RPM) / 분당 토큰 수(TPM) 기본 한도
+MODEL_RATE_LIMITS = {
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "gpt-4-turbo": {"rpm": 500, "tpm": 30000}
+}
+
+# GPT 호출 재시도 설정
+RETRY_MAX_ATTEMPTS = 6  # 파트당 최대 시도 횟수
+RETRY_BASE_DELAY = 1.0  # 첫 재시도 대기 (초), 이후 2배씩 증가
+RETRY_MAX_DELAY = 60.0  # 재시도 대기 상한 (초)
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# 백그라운드 워커 설정 (python app.py worker)
+WORKER_POLL_SECONDS = 2.0  # 대기 작업 확인 간격
+WORKER_STALE_SECONDS = 300  # 이 시간 동안 진행 보고가 없으면 다른 워커가 이어받음
+WORKER_HEARTBEAT_SECONDS = 30  # 작업 중인 워커가 살아 있음을 알리는 간격 (WORKER_STALE_SECONDS보다 충분히 짧게)
+
+# LLM 백엔드 설정 (settings.json의 llm_backend: openai / fake)
+MOCK_LLM_PORT = 8100  # python app.py mock-llm 기본 포트
+LOCAL_LLM_HOSTS = ("127.0.0.1", "localhost", "0.0.0.0", "::1")  # 여기로 가는 호출은 요금 장부에서 제외
+FAKE_STREAM_CHUNK_CHARS = 20  # 가짜 백엔드 스트리밍 조각 크기
+FAKE_LLM_DEFAULTS = {
+    "latency_dist": "lognormal",  # fixed / uniform / lognormal
+    "latency_median": 0.8,  # 응답 시작까지 중앙값 (초)
+    "latency_p95": 2.5,  # 응답 시작까지 95퍼센타일 (초, lognormal)
+    "tokens_per_second": 70,  # 출력 속도 (0이면 바로)
+    "error_rate": 0.01,  # 500 오류 확률
+    "rate_limit_rate": 0.01,  # 429 오류 확률
+    "output_ratio": 0.9,  # 요청 글자 수 대비 평균 출력 비율
+    "output_jitter": 0.15,  # 출력 비율 표준편차
+    "time_scale": 1.0,  # 모든 대기 시간 배율 (0.01이면 100배 빠르게)
+    "seed": 0
+}
+
+# 성능 기록 설정 (단계별 소요 시간, 📈 성능 탭)
+TRACE_FILE = os.path.join(DATA_DIR, "traces.jsonl")
+TRACE_MAX_MB = 20  # 넘으면 traces.jsonl.1로 넘기고 새로 기록 (이전 .1은 삭제)
+TRACE_STAGES = {
+    "prompt": "프롬프트 구성",
+    "generate": "GPT 호출",
+    "layout": "레이아웃",
+    "render": "PDF 렌더링",
+    "smtp": "메일 발송"
+}
+TRACE_WINDOWS = {"최근 1시간": 3600, "최근 24시간": 86400, "최근 7일": 7 * 86400, "전체": None}
+
+# 고객 명단 업로드 설정 (수만 행 엑셀/CSV)
+SHEET_CHUNK_ROWS = 5000  # 한 번에 DataFrame으로 만드는 행 수
+PREVIEW_PAGE_ROWS = 50  # 미리보기 한 쪽의 행 수
+SELECT_OPTIONS_LIMIT = 2000  # 고객 선택 목록에 한 번에 보여주는 최대 행 수 (넘으면 검색으로 좁히기)
+
+# GPT 응답 캐시 설정 (같은 프롬프트 재호출 방지)
+CACHE_TTL_DAYS = 30  # 캐시 보관 기간
+CACHE_MAX_MB = 200  # 캐시 최대 크기 (초과 시 오래 안 쓴 것부터 삭제)
+
 # ============================================
 # 데이터 저장/불러오기
 # ============================================
@@ -188,6 +361,31 @@ def load_settings():
         "model": "gpt-4o-mini",
         "gmail_address": "",
         "gmail_app_password": "",
+        "smtp_host": SMTP_HOST,
+        "smtp_port": SMTP_PORT,
+        "smtp_starttls": True,
+        "email_daily_quota": EMAIL_DAILY_QUOTA,
+        "email_max_attempts": EMAIL_MAX_ATTEMPTS,
+        "max_workers": DEFAULT_MAX_WORKERS,
+        "rate_limits": MODEL_RATE_LIMITS,
+        "max_retries": RETRY_MAX_ATTEMPTS,
+        "context_summary_tokens": CONTEXT_SUMMARY_TOKENS,
+        "cache_ttl_days": CACHE_TTL_DAYS,
+        "cache_max_mb": CACHE_MAX_MB,
+        "bg_image_dpi": BG_IMAGE_DPI,
+        "bg_jpeg_quality": BG_JPEG_QUALITY,
+        "render_processes": RENDER_PROCESSES,
+        "file_output": True,
+        "output_retention_days": OUTPUT_RETENTION_DAYS,
+        "batch_endpoint": "openai",
+        "llm_backend": "openai",
+        "llm_base_url": "",
+        "fake_llm": dict(FAKE_LLM_DEFAULTS),
+        "trace_enabled": True,
+        "job_spend_cap_usd": 0.0,
+        "daily_spend_cap_usd": 0.0,
+        "model_prices": {},
+        "chapter_templates": {},
         "guides": get_default_guides()
     }
     
@@ -219,287 +417,4918 @@ def save_settings(settings):
 # 이메일 발송
 # ============================================
 
-def send_email_with_attachment(to_email, subject, body, attachment_buffer, filename, gmail_address, gmail_password):
+def smtp_config(settings):
+    """설정에서 메일 서버 접속 정보만 뽑음"""
+    return {
+        "host": settings.get("smtp_host") or SMTP_HOST,
+        "port": int(settings.get("smtp_port") or SMTP_PORT),
+        "username": settings.get("gmail_address", ""),
+        "password": settings.get("gmail_app_password", ""),
+        "starttls": bool(settings.get("smtp_starttls", True))
+    }
+
+def email_configured(settings):
+    """발송 가능한 설정인지 (인증 없는 로컬/사내 메일 서버는 비밀번호 없이 허용)"""
+    config = smtp_config(settings)
+    return bool(config["username"]) and (bool(config["password"]) or config["host"] != SMTP_HOST)
+
+def open_smtp(host=SMTP_HOST, port=SMTP_PORT, username="", password="", starttls=True, timeout=60):
+    """SMTP 연결 + STARTTLS + 로그인 (비밀번호가 없으면 로그인 생략)"""
+    server = smtplib.SMTP(host, port, timeout=timeout)
     try:
-        msg = MIMEMultipart()
-        msg['From'] = gmail_address
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        msg.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        attachment = MIMEBase('application', 'octet-stream')
-        attachment.set_payload(attachment_buffer.getvalue())
-        encoders.encode_base64(attachment)
-        attachment.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-        msg.attach(attachment)
-        
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(gmail_address, gmail_password)
+        if starttls:
+            server.starttls()
+        if password:
+            server.login(username, password)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+def deliver_message(server, from_addr, to_email, subject, body, attachment, filename):
+    """열려 있는 SMTP 연결로 메일 1통 전송
+    
+    attachment: PDF 버퍼(BytesIO) 또는 디스크의 PDF 경로.
+    경로면 파일을 통째로 읽지 않고 조각씩 base64로 인코딩하며 바로 전송
+    """
+    msg = MIMEMultipart()
+    msg['From'] = from_addr
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    
+    if isinstance(attachment, str):
+        send_message_with_file_attachment(server, from_addr, to_email, msg, attachment, filename)
+    else:
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(attachment.getvalue())
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+        msg.attach(part)
         server.send_message(msg)
-        server.quit()
+
+def attachment_size(attachment):
+    """첨부(경로 또는 BytesIO)의 바이트 수"""
+    if isinstance(attachment, str):
+        return os.path.getsize(attachment) if os.path.exists(attachment) else 0
+    return attachment.getbuffer().nbytes
+
+def send_email_with_attachment(to_email, subject, body, attachment, filename, gmail_address, gmail_password, smtp_host=SMTP_HOST, smtp_port=SMTP_PORT, smtp_starttls=True):
+    """메일 1통을 새 연결로 바로 발송 (대량 발송은 EmailOutbox + MailSender 사용)"""
+    try:
+        with tracer.span("smtp", bytes=attachment_size(attachment), reused=False):
+            server = open_smtp(smtp_host, smtp_port, gmail_address, gmail_password, smtp_starttls)
+            deliver_message(server, gmail_address, to_email, subject, body, attachment, filename)
+            server.quit()
         
         return True, "발송 성공"
     except Exception as e:
         return False, str(e)
 
+def send_message_with_file_attachment(server, from_addr, to_addr, msg, path, filename):
+    """msg(본문까지 구성된 MIMEMultipart) 뒤에 파일 첨부를 붙여 SMTP DATA로 흘려보냄
+    
+    메모리에는 EMAIL_CHUNK_BYTES 크기 조각만 올라감 (getvalue + base64 전체 복사 없음)
+    """
+    boundary = f"===============_{uuid.uuid4().hex}"
+    msg.set_boundary(boundary)
+    
+    # 본문 부분까지 (마지막 닫는 경계는 빼고 첨부 뒤에 다시 붙임)
+    head = msg.as_string().rsplit(f"--{boundary}--", 1)[0]
+    
+    part = MIMEBase('application', 'octet-stream')
+    part.add_header('Content-Transfer-Encoding', 'base64')
+    part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+    head += f"--{boundary}\n" + part.as_string()
+    
+    server.ehlo_or_helo_if_needed()
+    code, response = server.mail(from_addr)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, response, from_addr)
+    code, response = server.rcpt(to_addr)
+    if code not in (250, 251):
+        raise smtplib.SMTPRecipientsRefused({to_addr: (code, response)})
+    code, response = server.docmd("data")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, response)
+    
+    server.send(smtplib.quotedata(head).encode("utf-8"))
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(EMAIL_CHUNK_BYTES)
+            if not chunk:
+                break
+            # base64 줄은 '.'으로 시작하지 않으므로 dot-stuffing 불필요
+            server.send(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+    server.send(f"--{boundary}--\r\n.\r\n".encode("ascii"))
+    
+    code, response = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+
+def read_file_bytes(path):
+    """다운로드 버튼용 (클릭했을 때만 읽음)"""
+    with open(path, "rb") as f:
+        return f.read()
+
+def make_output_path(prefix, filename):
+    """OUTPUT_DIR/<prefix>_<filename>"""
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+    return os.path.join(OUTPUT_DIR, f"{prefix}_{filename}")
+
+def sweep_output_dir(retention_days, outbox=None, now=None):
+    """OUTPUT_DIR에서 retention_days일이 지난 PDF 삭제 → (지운 파일 수, 바이트)
+    
+    발송 대기/발송 중인 메일의 첨부는 남김. 발송이 끝났거나(sent/failed)
+    메일로 보내지 않은 파일만 지움. retention_days가 0이면 아무것도 지우지 않음
+    """
+    if retention_days <= 0 or not os.path.isdir(OUTPUT_DIR):
+        return 0, 0
+    cutoff = (now or time.time()) - retention_days * 86400
+    outbox = outbox or get_email_outbox()
+    keep = {os.path.abspath(path) for path in outbox.pending_attachments()}
+    
+    removed = 0
+    freed = 0
+    for entry in os.scandir(OUTPUT_DIR):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        if stat.st_mtime >= cutoff or os.path.abspath(entry.path) in keep:
+            continue
+        try:
+            os.remove(entry.path)
+        except OSError:
+            # 다른 프로세스가 먼저 지웠거나 읽는 중
+            continue
+        removed += 1
+        freed += stat.st_size
+    return removed, freed
+
+def make_pdf_filename(customer_name, service_type, customer_name2=None):
+    if service_type == "연애" and customer_name2:
+        return f"{customer_name}_{customer_name2}_{service_type}_{datetime.now().strftime('%Y%m%d')}.pdf"
+    return f"{customer_name}_{service_type}_{datetime.now().strftime('%Y%m%d')}.pdf"
+
+def make_email_content(customer_name, service_type):
+    """(제목, 본문)"""
+    email_subject = f"[{service_type}] {customer_name}님의 감정서가 도착했습니다"
+    email_body = f"""안녕하세요, {customer_name}님!
+
+요청하신 {service_type} 감정서를 보내드립니다.
+첨부된 PDF 파일을 확인해주세요.
+
+감사합니다.
+"""
+    return email_subject, email_body
+
 # ============================================
-# GPT API 호출 (목차별 + 파트별 분할)
+# 이메일 발송 큐 (연결 재사용 + 재시도 + 하루 한도)
 # ============================================
 
-def generate_chapter_part(client, model, customer_data, chapter_title, part_num, total_parts, target_chars, guide, service_type):
-    """챕터의 각 파트 생성"""
+def classify_smtp_error(error):
+    """retry: 일시적 오류 / fail: 이 메일만 실패 / stop: 설정·한도 문제라 발송 중단"""
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return "stop"
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return "retry" if codes and all(400 <= code < 500 for code in codes) else "fail"
+    if isinstance(error, smtplib.SMTPResponseException):
+        text = str(error.smtp_error)
+        # Gmail 하루 발송 한도 초과 (550 5.4.5)
+        if "5.4.5" in text or "sending limit" in text.lower():
+            return "stop"
+        return "retry" if 400 <= error.smtp_code < 500 else "fail"
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return "retry"
+    if isinstance(error, smtplib.SMTPException):
+        # STARTTLS/AUTH 미지원 등 서버 설정 문제
+        return "stop"
+    if isinstance(error, OSError):
+        # 연결 거부/타임아웃 등 네트워크 오류 (SMTPException도 OSError라 위에서 먼저 거름)
+        return "retry"
+    return "fail"
+
+def get_email_retry_delay(attempts):
+    """메일 재시도 대기 (초): 지수 증가 + 절반 범위 jitter (바로 다시 시도하지 않도록)"""
+    delay = min(EMAIL_RETRY_MAX_DELAY, EMAIL_RETRY_BASE_DELAY * (2 ** max(0, attempts - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class SmtpConnection:
+    """인증된 SMTP 연결 1개를 여러 메일에 재사용
     
-    customer_info = "\n".join([f"- {key}: {value}" for key, value in customer_data.items() if pd.notna(value) and str(value).strip()])
+    - 처음 보낼 때 연결, 오래 쉬었으면 NOOP으로 확인 후 필요하면 다시 연결
+    - SMTP_MESSAGES_PER_CONNECTION통마다 새로 연결
+    - 재사용하던 연결이 서버 쪽에서 끊겨 있으면 한 번 다시 연결해서 보냄
+    """
     
-    if total_parts == 1:
-        part_instruction = f"이 챕터를 약 {target_chars}자 분량으로 상세하게 작성해주세요."
-    else:
-        part_instruction = f"""이 챕터는 총 {total_parts}개 파트로 나뉩니다.
-현재는 파트 {part_num}/{total_parts}을 작성해주세요.
-이 파트를 약 {target_chars}자 분량으로 상세하게 작성해주세요.
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, username="", password="", starttls=True):
+        self.config = (host, port, username, password, starttls)
+        self.server = None
+        self.sent_on_connection = 0
+        self.last_used = 0.0
+        self.connects = 0
+    
+    def _connect(self):
+        host, port, username, password, starttls = self.config
+        self.server = open_smtp(host, port, username, password, starttls)
+        self.sent_on_connection = 0
+        self.last_used = time.time()
+        self.connects += 1
+    
+    def _usable(self):
+        if self.server is None or self.sent_on_connection >= SMTP_MESSAGES_PER_CONNECTION:
+            return False
+        if time.time() - self.last_used < SMTP_IDLE_SECONDS:
+            return True
+        try:
+            return self.server.noop()[0] == 250
+        except Exception:
+            return False
+    
+    def send(self, from_addr, to_email, subject, body, attachment, filename):
+        with tracer.span("smtp", bytes=attachment_size(attachment)) as span:
+            self._send(from_addr, to_email, subject, body, attachment, filename, span)
+    
+    def _send(self, from_addr, to_email, subject, body, attachment, filename, span):
+        reused = self._usable()
+        span.set(reused=reused)
+        if not reused:
+            self.close()
+            self._connect()
+        
+        try:
+            deliver_message(self.server, from_addr, to_email, subject, body, attachment, filename)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            if not reused:
+                raise
+            self._connect()
+            try:
+                deliver_message(self.server, from_addr, to_email, subject, body, attachment, filename)
+            except Exception:
+                self.close()
+                raise
+        except (smtplib.SMTPSenderRefused, smtplib.SMTPRecipientsRefused):
+            # DATA 전에 거절된 경우라 RSET 후 연결은 계속 사용
+            self._reset()
+            raise
+        except Exception:
+            # 응답 도중 실패하면 연결 상태를 알 수 없으므로 다음 메일은 새 연결로
+            self.close()
+            raise
+        
+        self.sent_on_connection += 1
+        self.last_used = time.time()
+    
+    def _reset(self):
+        try:
+            self.server.rset()
+            self.last_used = time.time()
+        except Exception:
+            self.close()
+    
+    def close_if_idle(self, idle_seconds=SMTP_IDLE_SECONDS):
+        if self.server is not None and time.time() - self.last_used > idle_seconds:
+            self.close()
+    
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+        self.server = None
 
-파트 {part_num} 작성 시:
-- 파트 1이면: 챕터 도입부와 전반부 내용
-- 중간 파트면: 핵심 내용과 상세 분석
-- 마지막 파트면: 심화 내용과 마무리"""
+class EmailOutbox:
+    """발송할 메일을 SQLite(OUTBOX_FILE)에 쌓아 두는 대기열 (앱과 워커가 같이 사용)
+    
+    status: queued → sending → sent / failed
+    재시도 대기는 queued + next_attempt_at (그 시각 전에는 꺼내지 않음)
+    """
+    
+    def __init__(self, path=OUTBOX_FILE):
+        ensure_data_dir()
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch_id TEXT,
+                customer_name TEXT,
+                to_email TEXT,
+                subject TEXT,
+                body TEXT,
+                attachment_path TEXT,
+                filename TEXT,
+                dedupe_key TEXT,
+                status TEXT DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL DEFAULT 0,
+                last_error TEXT DEFAULT '',
+                created_at REAL,
+                updated_at REAL,
+                sent_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, next_attempt_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox(sent_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_dedupe ON outbox(dedupe_key)")
+        # 날짜별 발송 수 (발송 완료 목록을 지워도 하루 한도가 다시 차지 않도록 따로 셈)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS daily_sends (day TEXT PRIMARY KEY, count INTEGER DEFAULT 0)")
+        # 이 표가 생기기 전에 오늘 보낸 메일
+        self.conn.execute(
+            "INSERT OR IGNORE INTO daily_sends (day, count) SELECT ?, COUNT(*) FROM outbox WHERE sent_at >= ?",
+            (datetime.now().strftime('%Y-%m-%d'), datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+        )
+    
+    def enqueue(self, customer_name, to_email, subject, body, attachment_path, filename, batch_id="", dedupe_key=None):
+        """메일 1통 등록 후 id 반환
+        
+        같은 dedupe_key의 메일이 아직 대기 중이면 새로 넣지 않고 내용만 갱신
+        (같은 고객을 다시 돌려도 두 번 발송되지 않도록)
+        """
+        now = time.time()
+        with self.lock:
+            if dedupe_key:
+                row = self.conn.execute(
+                    "SELECT id FROM outbox WHERE dedupe_key = ? AND status = 'queued' ORDER BY id DESC LIMIT 1",
+                    (dedupe_key,)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE outbox SET to_email = ?, subject = ?, body = ?, attachment_path = ?, filename = ?, updated_at = ? WHERE id = ?",
+                        (to_email, subject, body, attachment_path, filename, now, row["id"])
+                    )
+                    return row["id"]
+            cursor = self.conn.execute(
+                "INSERT INTO outbox (batch_id, customer_name, to_email, subject, body, attachment_path, filename, dedupe_key, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (batch_id, customer_name, to_email, subject, body, attachment_path, filename, dedupe_key, now, now, now)
+            )
+            return cursor.lastrowid
+    
+    def claim_due(self, limit):
+        """지금 보낼 차례인 메일을 최대 limit통 가져와 sending으로 표시"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 발송 도중 프로세스가 죽은 메일은 다시 대기열로
+                self.conn.execute(
+                    "UPDATE outbox SET status = 'queued' WHERE status = 'sending' AND updated_at < ?",
+                    (now - EMAIL_SENDING_STALE_SECONDS,)
+                )
+                rows = self.conn.execute(
+                    "SELECT * FROM outbox WHERE status = 'queued' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                    (now, limit)
+                ).fetchall()
+                self.conn.executemany(
+                    "UPDATE outbox SET status = 'sending', updated_at = ? WHERE id = ?",
+                    [(now, row["id"]) for row in rows]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return [dict(row) for row in rows]
+    
+    def mark_sent(self, message_id):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "UPDATE outbox SET status = 'sent', attempts = attempts + 1, last_error = '', sent_at = ?, updated_at = ? WHERE id = ?",
+                    (now, now, message_id)
+                )
+                self.conn.execute(
+                    "INSERT INTO daily_sends (day, count) VALUES (?, 1) ON CONFLICT(day) DO UPDATE SET count = count + 1",
+                    (datetime.fromtimestamp(now).strftime('%Y-%m-%d'),)
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+    
+    def mark_retry(self, message_id, error, delay, max_attempts=EMAIL_MAX_ATTEMPTS):
+        """시도 횟수를 올리고 delay초 뒤 재시도. 횟수를 다 쓰면 failed (True 반환)"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT attempts FROM outbox WHERE id = ?", (message_id,)).fetchone()
+            attempts = (row["attempts"] if row else 0) + 1
+            exhausted = attempts >= max_attempts
+            self.conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                ("failed" if exhausted else "queued", attempts, error, now + delay, now, message_id)
+            )
+        return exhausted
+    
+    def mark_failed(self, message_id, error):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ?, updated_at = ? WHERE id = ?",
+                (error, now, message_id)
+            )
+    
+    def release(self, message_ids, error=""):
+        """시도 횟수는 그대로 두고 대기열로 되돌림 (인증 실패/한도 초과로 중단한 경우)"""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'queued', last_error = ?, updated_at = ? WHERE id = ?",
+                [(error, now, message_id) for message_id in message_ids]
+            )
+    
+    def get(self, message_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM outbox WHERE id = ?", (message_id,)).fetchone()
+        return dict(row) if row else None
+    
+    def sent_today(self):
+        """오늘(로컬 날짜) 발송한 메일 수 (발송 완료 목록 정리와 무관)"""
+        with self.lock:
+            row = self.conn.execute("SELECT count FROM daily_sends WHERE day = ?", (datetime.now().strftime('%Y-%m-%d'),)).fetchone()
+        return row["count"] if row else 0
+    
+    def due_count(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status = 'queued' AND next_attempt_at <= ?",
+                (time.time(),)
+            ).fetchone()[0]
+    
+    def retry_failed(self):
+        with self.lock:
+            self.conn.execute("UPDATE outbox SET status = 'queued', attempts = 0, next_attempt_at = 0, last_error = '' WHERE status = 'failed'")
+    
+    def clear_sent(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM outbox WHERE status = 'sent'")
+    
+    def pending_attachments(self):
+        """아직 발송 전(대기/발송 중)인 메일의 첨부 파일 경로"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT attachment_path FROM outbox WHERE status IN ('queued', 'sending') AND attachment_path IS NOT NULL"
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def list_messages(self, limit=500):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, batch_id, customer_name, to_email, filename, status, attempts, next_attempt_at, last_error, created_at, sent_at FROM outbox ORDER BY id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def counts(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
 
-    prompt = f"""당신은 {service_type} 분야 최고 전문가입니다.
+def get_email_outbox():
+    return EmailOutbox(OUTBOX_FILE)
 
-[고객 정보]
-{customer_info}
+class MailSender:
+    """발송 큐를 비우는 쪽: SMTP 연결 1개를 재사용하며 하루 한도 안에서 발송
+    
+    - 일시적 오류(연결 끊김, 4xx)는 지수 백오프 후 재시도, 횟수를 다 쓰면 실패
+    - 영구 오류(5xx, 첨부 파일 없음)는 바로 실패
+    - 인증 실패/한도 초과면 이번 발송을 멈추고 남은 메일은 대기열에 그대로 둠
+    """
+    
+    def __init__(self, outbox, settings):
+        self.outbox = outbox
+        self.connection = None
+        self.configure(settings)
+    
+    def configure(self, settings):
+        """설정 반영 (메일 서버/계정이 바뀐 경우에만 연결을 새로 만듦)"""
+        config = smtp_config(settings)
+        self.from_addr = config["username"]
+        self.daily_quota = int(settings.get("email_daily_quota", EMAIL_DAILY_QUOTA))
+        self.max_attempts = int(settings.get("email_max_attempts", EMAIL_MAX_ATTEMPTS))
+        
+        connection = SmtpConnection(**config)
+        if self.connection is None or self.connection.config != connection.config:
+            if self.connection is not None:
+                self.connection.close()
+            self.connection = connection
+    
+    def quota_left(self):
+        return max(0, self.daily_quota - self.outbox.sent_today())
+    
+    def deliver_pending(self, max_messages=None):
+        """지금 보낼 수 있는 메일을 모두 발송하고 결과 요약을 반환"""
+        result = {"sent": 0, "retry": 0, "failed": 0, "stopped": ""}
+        processed = 0
+        while max_messages is None or processed < max_messages:
+            left = self.quota_left()
+            if left <= 0:
+                if self.outbox.due_count():
+                    result["stopped"] = f"오늘 발송 한도({self.daily_quota}통)에 도달해 남은 메일은 내일 발송합니다"
+                break
+            
+            limit = min(left, 20) if max_messages is None else min(left, 20, max_messages - processed)
+            messages = self.outbox.claim_due(limit)
+            if not messages:
+                break
+            
+            for i, message in enumerate(messages):
+                status, error = self._send_one(message)
+                if status == "stop":
+                    self.outbox.release([m["id"] for m in messages[i:]], error)
+                    result["stopped"] = error
+                    return result
+                result[status] += 1
+                processed += 1
+        
+        return result
+    
+    def _send_one(self, message):
+        """메일 1통 발송 → (sent/retry/failed/stop, 오류 메시지)"""
+        path = message["attachment_path"]
+        if path and not os.path.exists(path):
+            error = f"첨부 파일 없음: {path}"
+            self.outbox.mark_failed(message["id"], error)
+            return "failed", error
+        
+        try:
+            # 저널 기반 발송은 dedupe_key가 "작업 ID:이메일"
+            job_id = (message["dedupe_key"] or "").split(":")[0]
+            with tracer.context(job=job_id or None, customer=message["customer_name"]):
+                self.connection.send(
+                    self.from_addr, message["to_email"],
+                    message["subject"], message["body"],
+                    path, message["filename"]
+                )
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            kind = classify_smtp_error(e)
+            if kind == "stop":
+                return "stop", error
+            if kind == "retry":
+                delay = get_email_retry_delay(message["attempts"] + 1)
+                exhausted = self.outbox.mark_retry(message["id"], error, delay, self.max_attempts)
+                return ("failed" if exhausted else "retry"), error
+            self.outbox.mark_failed(message["id"], error)
+            return "failed", error
+        
+        self.outbox.mark_sent(message["id"])
+        return "sent", ""
+    
+    def close_if_idle(self):
+        self.connection.close_if_idle()
+    
+    def close(self):
+        self.connection.close()
 
-[서비스 유형]
-{service_type}
+def describe_delivery(message):
+    """outbox 행 → 고객별 발송 상태 문구"""
+    if message is None:
+        return "발송 정보 없음"
+    if message["status"] == "sent":
+        return f"{message['to_email']} 발송 완료"
+    if message["status"] == "failed":
+        return f"발송 실패: {message['last_error']}"
+    if message["attempts"]:
+        wait = max(0, message["next_attempt_at"] - time.time())
+        return f"발송 재시도 대기 ({message['attempts']}회 실패, {wait / 60:.0f}분 후): {message['last_error']}"
+    if message["last_error"]:
+        return f"발송 대기: {message['last_error']}"
+    return "발송 대기 중"
 
-[작성 지침]
-{guide}
+# ============================================
+# GPT 호출 재시도 + 동시 호출 수 자동 조절
+# ============================================
 
-[현재 작성할 챕터]
-{chapter_title}
+class EmptyCompletionError(Exception):
+    """GPT가 빈 응답을 돌려준 경우 (재시도 대상)"""
 
-[분량 지시]
-{part_instruction}
+class PartGenerationError(Exception):
+    """재시도를 모두 소진했거나 재시도할 수 없는 오류로 파트 생성 실패"""
+    
+    def __init__(self, chapter_title, part_num, error, attempts):
+        self.chapter_title = chapter_title
+        self.part_num = part_num
+        self.error = error
+        self.attempts = attempts
+        super().__init__(f"'{chapter_title}' 파트 {part_num} 생성 실패 ({attempts}회 시도): {error}")
+    
+    def to_dict(self):
+        return {
+            "챕터": self.chapter_title,
+            "파트": self.part_num,
+            "오류 유형": type(self.error).__name__,
+            "시도 횟수": self.attempts,
+            "메시지": str(self.error)
+        }
 
-[중요 규칙]
-1. 반드시 {target_chars}자 이상 작성하세요.
-2. 내용을 풍부하게, 예시를 많이 들어주세요.
-3. 일반적인 내용이 아닌, 고객 맞춤형 내용으로 작성하세요.
-4. 절대 분량을 줄이지 마세요. 요청한 글자 수를 꼭 채우세요.
-5. 문단을 나누어 읽기 쉽게 작성하세요.
-"""
+class ContentGenerationError(Exception):
+    """고객 1명의 콘텐츠 중 실패한 파트가 있음 (failures: PartGenerationError 목록)"""
+    
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(f"{len(failures)}개 파트 생성 실패")
+
+def is_rate_limit_error(error):
+    return isinstance(error, RateLimitError) or getattr(error, "status_code", None) == 429
+
+def is_retryable_error(error):
+    """일시적 오류(429/5xx/연결 끊김/빈 응답)만 재시도"""
+    if isinstance(error, (APIConnectionError, EmptyCompletionError)):
+        return True
+    if isinstance(error, APIStatusError):
+        # 크레딧 소진은 429로 오지만 기다려도 풀리지 않음
+        if getattr(error, "code", None) == "insufficient_quota":
+            return False
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+def get_retry_after(error):
+    """응답 헤더의 Retry-After (초). 없으면 None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": f"당신은 {service_type} 분야 30년 경력 전문가입니다. 요청받은 분량을 반드시 채워서 상세하게 작성합니다. 절대 짧게 쓰지 않습니다."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=4000,
-            temperature=0.75
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"[오류 발생: {str(e)}]"
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms:
+            return float(retry_after_ms) / 1000
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            return float(retry_after)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def get_backoff_delay(attempt, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """지수 백오프 + 풀 지터 (attempt는 1부터)"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
 
-def generate_full_content(client, model, customer_data, chapters, total_pages, guide, service_type, progress_callback=None):
-    """전체 콘텐츠 생성 (목차별 + 파트별 분할)"""
+class AdaptiveConcurrency:
+    """AIMD 방식 동시 호출 수 조절기
     
-    # 목표 글자 수 계산
-    total_chars_needed = total_pages * CHARS_PER_PAGE
-    chars_per_chapter = total_chars_needed // len(chapters)
+    - 성공이 현재 한도만큼 쌓이면 한도 +1 (가산 증가)
+    - 429(rate limit)를 받으면 한도 × decrease_factor (곱셈 감소)
+    - 같은 폭주로 여러 번 줄어들지 않도록 감소 사이에 cooldown 적용
+    """
     
-    # 한 번 GPT 호출로 약 2500자 생성 가능
-    chars_per_call = 2500
-    parts_per_chapter = max(1, chars_per_chapter // chars_per_call)
+    def __init__(self, max_limit, min_limit=1, decrease_factor=0.5, cooldown=5.0):
+        self.cond = threading.Condition()
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self.success_streak = 0
+        self.last_decrease = 0.0
+        
+        self.successes = 0
+        self.retries = 0
+        self.rate_limited = 0
     
-    full_content = []
-    total_calls = len(chapters) * parts_per_chapter
-    current_call = 0
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+    
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+    
+    def on_success(self):
+        with self.cond:
+            self.successes += 1
+            self.success_streak += 1
+            if self.success_streak >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self.success_streak = 0
+                self.cond.notify_all()
+    
+    def on_retry(self, error):
+        with self.cond:
+            self.retries += 1
+            if not is_rate_limit_error(error):
+                return
+            
+            self.rate_limited += 1
+            self.success_streak = 0
+            now = time.monotonic()
+            if now - self.last_decrease >= self.cooldown:
+                self.last_decrease = now
+                self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+
+def call_with_retry(func, max_attempts=RETRY_MAX_ATTEMPTS, concurrency=None):
+    """func()를 재시도하며 호출. (결과, 시도 횟수) 반환
     
-    for chapter in chapters:
-        chapter_content_parts = []
+    재시도할 수 없는 오류이거나 max_attempts를 모두 쓰면 마지막 오류를
+    (error, attempts) 속성을 붙여 다시 발생시킴
+    """
+    attempt = 0
+    while True:
+        attempt += 1
         
-        for part in range(1, parts_per_chapter + 1):
-            current_call += 1
+        if concurrency:
+            concurrency.acquire()
+        try:
+            result = func()
+        except Exception as e:
+            error = e
+        else:
+            if concurrency:
+                concurrency.on_success()
+            return result, attempt
+        finally:
+            if concurrency:
+                concurrency.release()
+        
+        if attempt >= max_attempts or not is_retryable_error(error):
+            error.attempts = attempt
+            raise error
+        
+        if concurrency:
+            concurrency.on_retry(error)
+        
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            delay = min(retry_after, RETRY_MAX_DELAY) + random.uniform(0, RETRY_BASE_DELAY)
+        else:
+            delay = get_backoff_delay(attempt)
+        time.sleep(delay)
+
+# ============================================
+# GPT 응답 캐시 (SQLite, DATA_DIR 아래)
+# ============================================
+
+class ContentCache:
+    """(모델, system, prompt, temperature, max_tokens) 해시 → 생성 결과
+    
+    - ttl_seconds가 지난 항목은 조회 시 삭제
+    - 전체 크기가 max_bytes를 넘으면 마지막 사용 시각이 오래된 것부터 삭제 (LRU)
+    """
+    
+    def __init__(self, path=CACHE_FILE, ttl_seconds=CACHE_TTL_DAYS * 86400, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        ensure_data_dir()
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                content TEXT,
+                size INTEGER,
+                created_at REAL,
+                last_access REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+        self.conn.commit()
+    
+    @staticmethod
+    def make_key(model, system_message, prompt, temperature, max_tokens):
+        raw = json.dumps([model, system_message, prompt, temperature, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT content, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
             
-            if progress_callback:
-                progress = current_call / total_calls
-                progress_callback(progress, f"'{chapter}' 파트 {part}/{parts_per_chapter} 작성 중... ({current_call}/{total_calls})")
+            content, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.conn.commit()
+                self.misses += 1
+                return None
             
-            part_content = generate_chapter_part(
-                client, model, customer_data,
-                chapter, part, parts_per_chapter,
-                chars_per_call, guide, service_type
+            self.conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return content
+    
+    def set(self, key, model, content):
+        now = time.time()
+        size = len(content.encode("utf-8"))
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, model, content, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, content, size, now, now)
             )
-            chapter_content_parts.append(part_content)
+            self._evict()
+            self.conn.commit()
+    
+    def _evict(self):
+        if self.ttl_seconds:
+            self.conn.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl_seconds,))
         
-        # 파트들을 합쳐서 하나의 챕터로
-        full_chapter_content = "\n\n".join(chapter_content_parts)
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
         
-        full_content.append({
-            "title": chapter,
-            "content": full_chapter_content
-        })
+        # 오래 안 쓴 것부터 한도 아래로 내려갈 때까지 삭제
+        excess = total - self.max_bytes
+        freed = 0
+        stale_keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC"):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", stale_keys)
     
-    return full_content
+    def purge(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+    
+    def stats(self):
+        with self.lock:
+            count, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": count, "bytes": total, "hits": self.hits, "misses": self.misses}
+
+_content_cache = None
+_content_cache_lock = threading.Lock()
+
+def get_content_cache(settings=None):
+    """프로세스 전역 ContentCache (설정의 TTL/최대 크기 반영)"""
+    global _content_cache
+    settings = settings or {}
+    ttl_seconds = float(settings.get("cache_ttl_days", CACHE_TTL_DAYS)) * 86400
+    max_bytes = int(float(settings.get("cache_max_mb", CACHE_MAX_MB)) * 1024 * 1024)
+    
+    with _content_cache_lock:
+        if _content_cache is None:
+            _content_cache = ContentCache(CACHE_FILE, ttl_seconds, max_bytes)
+        else:
+            _content_cache.ttl_seconds = ttl_seconds
+            _content_cache.max_bytes = max_bytes
+        return _content_cache
 
 # ============================================
-# PDF 생성 (표지 → 목차 → 본문)
+# 작업 저널 (중단된 작업 이어서 생성)
 # ============================================
 
-def create_pdf_with_toc(chapters_content, customer_name, service_type, customer_name2=None):
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
+def normalize_customer_data(customer_data):
+    """빈 값을 빼고 문자열로 맞춘 고객 정보 (작업 ID 계산용)"""
+    return {str(key): str(value).strip() for key, value in customer_data.items() if pd.notna(value) and str(value).strip()}
+
+def make_job_id(model, service_type, customer_data, chapters, guide, total_pages):
+    """같은 입력이면 같은 작업 ID → 재실행 시 이어서 생성"""
+    raw = json.dumps(
+        [model, service_type, normalize_customer_data(customer_data), chapters, guide, total_pages],
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:20]
+
+class JobJournal:
+    """고객 1명 작업의 추가 전용(append-only) 기록 파일 (JOBS_DIR/<job_id>.jsonl)
+    
+    - {"type": "start", ...}: 작업 시작 정보
+    - {"type": "part", "chapter": i, "part": p, "content": ...}: 완료된 파트 (도착 즉시 기록)
+    - {"type": "done", ...}: PDF 생성/발송까지 끝남 → 다음 배치에서 건너뜀
+    
+    마지막 줄이 쓰다 만 상태(프로세스 중단)여도 나머지 기록은 그대로 읽음
+    """
+    
+    def __init__(self, job_id, jobs_dir=JOBS_DIR):
+        if not os.path.exists(jobs_dir):
+            os.makedirs(jobs_dir)
+        self.job_id = job_id
+        self.path = os.path.join(jobs_dir, f"{job_id}.jsonl")
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def for_customer(cls, model, service_type, customer_data, chapters, guide, total_pages, jobs_dir=JOBS_DIR):
+        return cls(make_job_id(model, service_type, customer_data, chapters, guide, total_pages), jobs_dir)
+    
+    def _append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            # 이전 실행이 줄 중간에서 끊겼으면 새 줄에서 시작
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = "\n" + line
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def records(self):
+        if not os.path.exists(self.path):
+            return []
+        
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 중단되면서 잘린 줄은 무시
+                    continue
+        return records
+    
+    def start(self, **info):
+        if not os.path.exists(self.path):
+            self._append({"type": "start", "time": time.time(), **info})
+    
+    def record_part(self, ch_idx, part_num, content):
+        self._append({"type": "part", "chapter": ch_idx, "part": part_num, "content": content, "time": time.time()})
+    
+    def mark_done(self, **info):
+        self._append({"type": "done", "time": time.time(), **info})
+    
+    def completed_parts(self):
+        """{(챕터 번호, 파트 번호): 내용}"""
+        return {
+            (record["chapter"], record["part"]): record["content"]
+            for record in self.records()
+            if record.get("type") == "part"
+        }
+    
+    def is_done(self):
+        return any(record.get("type") == "done" for record in self.records())
+    
+    def reset(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+# ============================================
+# 고객 작업 색인 (같은 명단을 다시 올려도 발송 완료 고객은 건너뜀)
+# ============================================
+
+def normalize_cell(value):
+    """색인용 칸 값: 정수인 실수는 정수로, 자정 날짜는 날짜만, 공백은 한 칸으로
+    (같은 명단이 빈 칸 유무나 파일 형식에 따라 123 / 123.0처럼 달라지지 않게)"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, datetime) and (value.hour, value.minute, value.second, value.microsecond) == (0, 0, 0, 0):
+        value = value.strftime('%Y-%m-%d')
+    return " ".join(str(value).split())
+
+def guide_version(chapters, guide, total_pages):
+    """목차 + 지침 + 쪽수 버전 (바뀌면 모든 고객을 다시 생성)"""
+    raw = json.dumps([chapters, guide, total_pages], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+def customer_fingerprint(service_type, customer_data, version):
+    """고객 행 내용 + 서비스 + 지침 버전 → 이 값이 같으면 같은 결과물"""
+    normalized = {
+        str(key).strip(): normalize_cell(value)
+        for key, value in customer_data.items()
+        if pd.notna(value) and normalize_cell(value)
+    }
+    raw = json.dumps([service_type, normalized, version], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+def customer_identity(service_type, name, email=None):
+    """내용과 상관없이 같은 고객인지 (서비스 + 이름 + 이메일) → '내용 바뀜' 구분용"""
+    parts = [normalize_cell(value) if value is not None and pd.notna(value) else "" for value in (name, email)]
+    raw = json.dumps([service_type] + parts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def customer_row_keys(file_hash, service_type, version, name_col, email_col, _df):
+    """업로드한 명단의 행 순서대로 (fingerprint, 고객 키). 파일 해시 + 설정으로 캐시"""
+    return [
+        (customer_fingerprint(service_type, record, version), customer_identity(service_type, record.get(name_col), record.get(email_col)))
+        for record in _df.to_dict("records")
+    ]
+
+class CustomerIndex:
+    """발송 완료한 고객 작업 색인 (SQLite, CUSTOMER_INDEX_FILE)
+    
+    fingerprint가 기본 키라 기록이 수십만 건이어도 행마다 색인 조회 1번.
+    고객 키(서비스 + 이름 + 이메일) 색인으로 '예전에 받았지만 내용이 바뀐 고객'을 구분.
+    status: delivered(발송 완료 또는 메일 없음) / pending(메일이 발송 큐에서 대기·재시도 중,
+    message_id로 다음 확인 때 발송 결과를 다시 봄)
+    """
+    
+    LOOKUP_BATCH = 500  # IN (...) 한 번에 넣는 값 수 (SQLite 변수 개수 한도 안쪽)
+    
+    def __init__(self, path=CUSTOMER_INDEX_FILE):
+        ensure_data_dir()
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS deliveries (
+                fingerprint TEXT PRIMARY KEY,
+                customer_key TEXT,
+                job_id TEXT,
+                customer TEXT,
+                email TEXT,
+                service_type TEXT,
+                filename TEXT,
+                delivered_at REAL,
+                status TEXT DEFAULT 'delivered',
+                message_id INTEGER
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_customer ON deliveries(customer_key)")
+    
+    def mark_delivered(self, fingerprint, customer_key, job_id="", customer="", email=None, service_type="", filename="", status="delivered", message_id=None):
+        self.conn.execute(
+            """INSERT OR REPLACE INTO deliveries (fingerprint, customer_key, job_id, customer, email, service_type, filename, delivered_at, status, message_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (fingerprint, customer_key, job_id, customer, email, service_type, filename, time.time(), status, message_id)
+        )
+    
+    def _delivery_states(self, fingerprints, outbox=None):
+        """fingerprint → delivered / pending. 대기 중이던 메일은 발송 큐에서 결과를 확인해
+        보냈으면 delivered로 바꾸고, 실패했으면 기록을 지워 다시 생성/발송되게 함"""
+        states = {}
+        fingerprints = list(set(fingerprints))
+        for start in range(0, len(fingerprints), self.LOOKUP_BATCH):
+            chunk = fingerprints[start:start + self.LOOKUP_BATCH]
+            rows = self.conn.execute(
+                f"SELECT fingerprint, status, message_id FROM deliveries WHERE fingerprint IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for row in rows:
+                states[row["fingerprint"]] = (row["status"], row["message_id"])
+        
+        pending = [(fingerprint, message_id) for fingerprint, (status, message_id) in states.items() if status == "pending"]
+        if pending:
+            outbox = outbox or get_email_outbox()
+        for fingerprint, message_id in pending:
+            message = outbox.get(message_id) if message_id else None
+            if message is not None and message["status"] == "sent":
+                self.conn.execute("UPDATE deliveries SET status = 'delivered', delivered_at = ? WHERE fingerprint = ?", (time.time(), fingerprint))
+                states[fingerprint] = ("delivered", message_id)
+            elif message is None or message["status"] == "failed":
+                self.conn.execute("DELETE FROM deliveries WHERE fingerprint = ?", (fingerprint,))
+                del states[fingerprint]
+        return {fingerprint: status for fingerprint, (status, _) in states.items()}
+    
+    def _existing(self, column, values):
+        found = set()
+        values = list(set(values))
+        for start in range(0, len(values), self.LOOKUP_BATCH):
+            chunk = values[start:start + self.LOOKUP_BATCH]
+            rows = self.conn.execute(
+                f"SELECT {column} FROM deliveries WHERE {column} IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+    
+    def classify(self, keys, outbox=None):
+        """[(fingerprint, 고객 키)] → 같은 순서로 상태 목록
+        
+        delivered(발송 완료) / pending(메일 발송 대기 중) / changed(내용 바뀜) / new
+        """
+        states = self._delivery_states([fingerprint for fingerprint, _ in keys], outbox)
+        known = self._existing("customer_key", [customer_key for fingerprint, customer_key in keys if fingerprint not in states])
+        return [
+            states[fingerprint] if fingerprint in states else "changed" if customer_key in known else "new"
+            for fingerprint, customer_key in keys
+        ]
+    
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+
+def get_customer_index():
+    return CustomerIndex(CUSTOMER_INDEX_FILE)
+
+def record_customer_delivery(journal, delivery, index_keys, customer_name, customer_email, service_type, filename, pdf_path=None, email_requested=False):
+    """PDF를 만든 고객 1명의 마무리 기록 (화면 / 큐 워커 / Batch API 공용). 상태 반환
+    
+    delivery는 발송 큐 행 (메일을 넣지 않았으면 None), index_keys는 (fingerprint, 고객 키)
+    - delivered: 메일 발송 완료 또는 메일 요청 없음 → 저널 완료 + 색인 기록 (다음 업로드에서 건너뜀)
+    - pending: 발송 대기/재시도 중 → 색인에 pending으로만 남기고 다음 확인 때 발송 결과로 판단
+    - failed: 발송 실패, 또는 메일을 요청했지만 보낼 수 없음 → 기록 없음 (다음 실행에서 다시 처리,
+      파트는 저널에서 복원)
+    """
+    if delivery is None:
+        state = "failed" if email_requested else "delivered"
+    elif delivery["status"] == "sent":
+        state = "delivered"
+    elif delivery["status"] == "failed":
+        state = "failed"
+    else:
+        state = "pending"
+    
+    if state == "delivered":
+        journal.mark_done(filename=filename, email=customer_email, pdf_path=pdf_path)
+    if index_keys and state != "failed":
+        get_customer_index().mark_delivered(
+            index_keys[0], index_keys[1], journal.job_id, customer_name, customer_email, service_type, filename,
+            status=state, message_id=delivery["id"] if delivery else None
+        )
+    return state
+
+# ============================================
+# 분량 계획 (토큰 예산 기준 호출 수 / max_tokens / 보충 호출)
+# ============================================
+
+def is_hangul(ch):
+    return '가' <= ch <= '힣' or 'ㄱ' <= ch <= 'ㆎ'
+
+def estimate_tokens(text, model=None):
+    """tiktoken 없이 토큰 수 추정 (한글은 모델별 비율, 영문/숫자는 4글자≈1토큰,
+    공백은 앞뒤 토큰에 붙고 줄바꿈/문장부호는 1토큰)"""
+    ratio = TOKENS_PER_HANGUL.get(model, 1.0)
+    hangul = 0
+    ascii_chars = 0
+    symbols = 0
+    for ch in text:
+        if is_hangul(ch):
+            hangul += 1
+        elif ch.isascii() and ch.isalnum():
+            ascii_chars += 1
+        elif ch == ' ':
+            continue
+        else:
+            symbols += 1
+    return int(math.ceil(hangul * ratio + ascii_chars / 4 + symbols))
+
+def chapter_target_chars(chapters, total_pages):
+    """챕터 1개의 목표 글자 수"""
+    return int(math.ceil(total_pages * CHARS_PER_PAGE / max(1, len(chapters))))
+
+def plan_chapter_parts(chapters, total_pages):
+    """챕터당 파트 수와 파트당 목표 글자 수
+    
+    예전 방식(목표 // 2500)은 4,900자가 필요한 챕터도 2,500자 1번만 호출해서
+    늘 분량이 모자랐음. 올림으로 호출 수를 정하고 목표를 파트에 고르게 나눔
+    (같은 설정이면 항상 같은 계획 → 캐시/저널 키가 바뀌지 않음)
+    """
+    target = chapter_target_chars(chapters, total_pages)
+    parts_per_chapter = max(1, int(math.ceil(target / MAX_CHARS_PER_CALL)))
+    # 100자 단위로 올림 (프롬프트에 들어가는 숫자)
+    chars_per_call = int(math.ceil(target / parts_per_chapter / 100)) * 100
+    return parts_per_chapter, chars_per_call
+
+def part_max_tokens(target_chars, model=None):
+    """목표 글자 수에 맞춘 max_tokens (여유를 두되 모델 출력 한도 이하)"""
+    ratio = TOKENS_PER_HANGUL.get(model, 1.0)
+    tokens = int(math.ceil(target_chars * ratio * MAX_TOKENS_HEADROOM))
+    return max(1000, min(tokens, MODEL_MAX_OUTPUT_TOKENS.get(model, 4096)))
+
+def plan_topup_parts(actual_chars, target_chars, chars_per_call, topups_done, yield_ratio=1.0):
+    """챕터가 목표보다 짧으면 보충 호출들의 요청 글자 수 목록 (충분하면 [])
+    
+    모델이 요청보다 짧게 쓰는 비율(yield_ratio)만큼 더 요청
+    """
+    shortfall = target_chars - actual_chars
+    calls_left = MAX_TOPUP_PARTS - topups_done
+    if calls_left <= 0 or shortfall <= target_chars * TOPUP_TOLERANCE:
+        return []
+    
+    ask = shortfall / max(0.3, min(1.0, yield_ratio))
+    calls = min(calls_left, int(math.ceil(ask / MAX_CHARS_PER_CALL)))
+    per_call = int(math.ceil(ask / calls / 100)) * 100
+    return [max(TOPUP_MIN_CHARS, min(per_call, MAX_CHARS_PER_CALL))] * calls
+
+class OutputYieldTracker:
+    """요청한 글자 수 대비 실제로 받은 글자 수 (모델별, 이 프로세스에서 측정)"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+    
+    def record(self, model, requested_chars, actual_chars):
+        with self.lock:
+            requested, actual, count = self.samples.get(model, (0, 0, 0))
+            self.samples[model] = (requested + requested_chars, actual + actual_chars, count + 1)
+    
+    def ratio(self, model, min_samples=3):
+        """측정값이 적으면 1.0 (요청한 만큼 받는다고 가정)"""
+        with self.lock:
+            requested, actual, count = self.samples.get(model, (0, 0, 0))
+        if count < min_samples or not requested:
+            return 1.0
+        return actual / requested
+
+output_yield = OutputYieldTracker()
+
+def estimate_generation(chapters, total_pages, model, guide="", service_type="", customers=1, context_tokens=0, calibration=None, prices=None):
+    """UI 표시용 고객 1명(또는 customers명) 기준 호출 수 / 토큰 / 비용 추정
+    
+    보충 호출은 지금까지 측정한 출력 비율로 예상.
+    context_tokens는 이어 쓰기 모드의 앞 내용 요약 상한 (호출마다 다 쓴다고 가정).
+    calibration(UsageLedger.calibration)을 주면 실제 비용/예상 비용 비율로 보정한
+    calibrated_cost도 계산 (없으면 None). prices는 price_table(settings) (없으면 MODEL_PRICES)
+    """
+    if not chapters:
+        return {"parts_per_chapter": 0, "calls": 0, "topup_calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0, "calibrated_cost": None, "yield": 1.0}
+    
+    parts_per_chapter, chars_per_call = plan_chapter_parts(chapters, total_pages)
+    target = chapter_target_chars(chapters, total_pages)
+    
+    yield_ratio = output_yield.ratio(model)
+    expected_chars = min(parts_per_chapter * chars_per_call * yield_ratio, target * 1.5)
+    topups = plan_topup_parts(expected_chars, target, chars_per_call, 0, yield_ratio)
+    if topups:
+        expected_chars += sum(topups) * yield_ratio
+    
+    # 실제 프롬프트와 같은 틀로 입력 토큰 계산 (고객 정보는 평균 200자로 가정)
+    system_message, prompt = build_part_messages({"고객 정보": "가" * 200}, chapters[0], 1, parts_per_chapter, chars_per_call, guide, service_type)
+    input_per_call = estimate_tokens(system_message + prompt, model) + context_tokens
+    
+    calls = len(chapters) * (parts_per_chapter + len(topups))
+    output_tokens = int(len(chapters) * expected_chars * TOKENS_PER_HANGUL.get(model, 1.0))
+    input_tokens = calls * input_per_call
+    cost = token_cost(model, input_tokens, output_tokens, prices=prices)
+    calibrated_cost = None
+    if calibration:
+        # 장부의 예상 비용은 호출 단위(출력 = 목표 글자 수)로 기록되므로 같은 기준에 비율을 곱함
+        per_call = token_cost(model, input_per_call, chars_per_call * TOKENS_PER_HANGUL.get(model, 1.0), prices=prices)
+        calibrated_cost = calls * per_call * calibration["ratio"] * customers
+    return {
+        "parts_per_chapter": parts_per_chapter,
+        "calls": calls * customers,
+        "topup_calls": len(chapters) * len(topups) * customers,
+        "input_tokens": input_tokens * customers,
+        "output_tokens": output_tokens * customers,
+        "cost": cost * customers,
+        "calibrated_cost": calibrated_cost,
+        "yield": yield_ratio
+    }
+
+# ============================================
+# 사용량 장부 / 지출 한도 (실제 usage 기준 비용)
+# ============================================
+
+def price_table(settings=None):
+    """MODEL_PRICES에 settings.json의 model_prices를 모델별로 덮어쓴 가격표"""
+    table = {model: dict(price) for model, price in MODEL_PRICES.items()}
+    for model, price in ((settings or {}).get("model_prices") or {}).items():
+        table[model] = {**table.get(model, {"input": 0.0, "output": 0.0}), **price}
+    return table
+
+def token_cost(model, input_tokens, output_tokens, cached_tokens=0, prices=None):
+    """가격표 기준 비용 (USD). 캐시 적중 입력은 cached_input 가격 (없으면 일반 입력 가격)"""
+    price = (prices or MODEL_PRICES).get(model) or {"input": 0.0, "output": 0.0}
+    cached_price = price.get("cached_input", price["input"])
+    return ((input_tokens - cached_tokens) * price["input"] + cached_tokens * cached_price + output_tokens * price["output"]) / 1_000_000
+
+def spend_limits(settings):
+    """{"job": 작업당 한도, "daily": 하루 한도} (USD, 0이면 제한 없음)"""
+    return {
+        "job": float(settings.get("job_spend_cap_usd", 0) or 0),
+        "daily": float(settings.get("daily_spend_cap_usd", 0) or 0)
+    }
+
+class SpendCapExceeded(Exception):
+    """작업/하루 지출 한도에 도달해서 호출하지 않음 (재시도 대상 아님)"""
+
+class UsageLedger:
+    """API 호출마다 response.usage를 쌓는 장부 (SQLite, USAGE_FILE)
+    
+    - calls: 호출 1건 = 1행 (모델/작업/고객/토큰/실제 비용/호출 전 예상 비용)
+    - jobs: 작업 1건 (쪽수, 다 끝난 시각) → 쪽당 비용
+    앱과 워커 프로세스가 같은 파일에 기록. 날짜(day)는 로컬 시각 기준
+    """
+    
+    def __init__(self, path=USAGE_FILE, prices=None):
+        ensure_data_dir()
+        self.path = path
+        self.prices = prices or price_table()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS calls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                time REAL,
+                day TEXT,
+                model TEXT,
+                job_id TEXT,
+                customer TEXT,
+                source TEXT,
+                prompt_tokens INTEGER,
+                cached_tokens INTEGER,
+                completion_tokens INTEGER,
+                cost REAL,
+                expected_cost REAL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                model TEXT,
+                customer TEXT,
+                total_pages INTEGER,
+                created_at REAL,
+                finished_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_calls_day ON calls(day)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_calls_job ON calls(job_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_calls_model ON calls(model, id)")
+    
+    def record(self, model, usage, job_id="", customer="", source="api", price_ratio=1.0, expected_tokens=None):
+        """호출 1건 기록 후 비용 반환
+        
+        price_ratio: Batch API 할인 등. expected_tokens: 호출 전 예상 (입력, 출력) 토큰
+        (estimate_generation과 같은 방식) → 예상 비용 보정에 사용.
+        source="fake"(가짜 백엔드 / 호환 서버)는 실제로 나간 돈이 아니므로 가격표 기준
+        비용만 계산해 돌려주고 장부에는 남기지 않음 (하루 한도, 보정, 사용량 표에서 빠짐)
+        """
+        prompt, cached, completion = usage_counts(usage)
+        cost = token_cost(model, prompt, completion, cached, self.prices) * price_ratio
+        if source == "fake":
+            return cost
+        expected_cost = token_cost(model, *expected_tokens, prices=self.prices) * price_ratio if expected_tokens else None
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                """INSERT INTO calls (time, day, model, job_id, customer, source, prompt_tokens, cached_tokens, completion_tokens, cost, expected_cost)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (now, datetime.fromtimestamp(now).strftime('%Y-%m-%d'), model, job_id or "", customer or "", source,
+                 prompt, cached, completion, cost, expected_cost)
+            )
+        return cost
+    
+    def start_job(self, job_id, model, customer, total_pages):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, model, customer, total_pages, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, model, customer, total_pages, time.time())
+            )
+    
+    def finish_job(self, job_id):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET finished_at = ? WHERE job_id = ?", (time.time(), job_id))
+    
+    def job_total(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT COALESCE(SUM(cost), 0) FROM calls WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0]
+    
+    def day_total(self, day=None):
+        day = day or datetime.now().strftime('%Y-%m-%d')
+        with self.lock:
+            row = self.conn.execute("SELECT COALESCE(SUM(cost), 0) FROM calls WHERE day = ?", (day,)).fetchone()
+        return row[0]
+    
+    def calibration(self, model, limit=ESTIMATE_HISTORY_CALLS):
+        """최근 호출들의 실제 비용 / 호출 전 예상 비용. 기록이 적으면 None"""
+        with self.lock:
+            row = self.conn.execute(
+                """SELECT COUNT(*), SUM(cost), SUM(expected_cost) FROM (
+                       SELECT cost, expected_cost FROM calls
+                       WHERE model = ? AND source IN ('api', 'template') AND expected_cost > 0
+                       ORDER BY id DESC LIMIT ?
+                   )""",
+                (model, limit)
+            ).fetchone()
+        count, actual, expected = row
+        if count < ESTIMATE_MIN_CALLS or not expected:
+            return None
+        return {"calls": count, "ratio": actual / expected}
+    
+    def cost_per_page(self, model=None):
+        """다 끝난 작업들의 실제 쪽당 비용 (작업 수, 쪽당 비용). 없으면 None"""
+        query = """SELECT COUNT(*), SUM(spent), SUM(total_pages) FROM (
+                       SELECT j.total_pages, SUM(c.cost) AS spent FROM jobs j JOIN calls c ON c.job_id = j.job_id
+                       WHERE j.finished_at IS NOT NULL {} GROUP BY j.job_id
+                   )"""
+        with self.lock:
+            if model:
+                row = self.conn.execute(query.format("AND j.model = ?"), (model,)).fetchone()
+            else:
+                row = self.conn.execute(query.format("")).fetchone()
+        jobs, spent, pages = row
+        if not jobs or not pages:
+            return None
+        return jobs, spent / pages
+    
+    def daily_rows(self, days=14):
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT day, COUNT(*), SUM(prompt_tokens), SUM(cached_tokens), SUM(completion_tokens), SUM(cost)
+                   FROM calls GROUP BY day ORDER BY day DESC LIMIT ?""",
+                (days,)
+            ).fetchall()
+        return [
+            {"날짜": day, "호출": calls, "입력 토큰": prompt, "캐시 적중": cached, "출력 토큰": completion, "비용 ($)": round(cost, 4)}
+            for day, calls, prompt, cached, completion, cost in rows
+        ]
+    
+    def model_rows(self, since_day=None):
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT model, COUNT(*), SUM(prompt_tokens), SUM(cached_tokens), SUM(completion_tokens), SUM(cost)
+                   FROM calls WHERE day >= ? GROUP BY model ORDER BY SUM(cost) DESC""",
+                (since_day or "",)
+            ).fetchall()
+        return [
+            {"모델": model, "호출": calls, "입력 토큰": prompt, "캐시 적중": cached, "출력 토큰": completion, "비용 ($)": round(cost, 4)}
+            for model, calls, prompt, cached, completion, cost in rows
+        ]
+    
+    def job_rows(self, limit=100):
+        """최근 작업별 사용량 (고객, 쪽수, 비용, 쪽당 비용)"""
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT c.job_id, MAX(c.customer), MAX(c.model), MIN(c.time), COUNT(*), SUM(c.prompt_tokens),
+                          SUM(c.completion_tokens), SUM(c.cost), j.total_pages, j.finished_at
+                   FROM calls c LEFT JOIN jobs j ON j.job_id = c.job_id
+                   WHERE c.job_id != '' GROUP BY c.job_id ORDER BY MIN(c.time) DESC LIMIT ?""",
+                (limit,)
+            ).fetchall()
+        return [
+            {
+                "작업": job_id,
+                "고객": customer,
+                "모델": model,
+                "시작": datetime.fromtimestamp(started).strftime('%m-%d %H:%M'),
+                "호출": calls,
+                "입력 토큰": prompt,
+                "출력 토큰": completion,
+                "비용 ($)": round(cost, 4),
+                "쪽수": pages,
+                "쪽당 비용 ($)": round(cost / pages, 5) if pages else None,
+                "완료": "✅" if finished else ""
+            }
+            for job_id, customer, model, started, calls, prompt, completion, cost, pages, finished in rows
+        ]
+
+_usage_ledger = None
+_usage_ledger_lock = threading.Lock()
+
+def usage_source(client):
+    """장부의 source: 가짜 백엔드와 로컬 대역 서버(mock-llm)는 "fake", 그 밖은 "api"
+    
+    원격 호환 서버는 요금이 나갈 수 있으므로 그대로 "api"로 셈
+    """
+    if isinstance(client, LocalBatchClient):
+        client = client.chat_client
+    if isinstance(client, FakeLLMClient):
+        return "fake"
+    host = urlparse(str(getattr(client, "base_url", "") or "")).hostname or ""
+    return "fake" if host in LOCAL_LLM_HOSTS else "api"
+
+def get_usage_ledger():
+    """프로세스 전체가 공유하는 장부 (호출마다 기록하므로 연결 1개 재사용)"""
+    global _usage_ledger
+    with _usage_ledger_lock:
+        if _usage_ledger is None:
+            _usage_ledger = UsageLedger()
+        return _usage_ledger
+
+def configure_usage(settings):
+    """설정의 가격표를 장부에 반영 (설정을 다시 읽을 때마다)"""
+    get_usage_ledger().prices = price_table(settings)
+
+def use_scratch_storage(root):
+    """벤치마크/부하 테스트용: 성능 기록(TRACE_FILE)과 사용량 장부(USAGE_FILE)를 root 아래로
+    
+    운영 data/의 traces.jsonl, usage.db에 측정용 호출이 섞이지 않도록
+    """
+    global _usage_ledger
+    tracer.path = os.path.join(root, "traces.jsonl")
+    with _usage_ledger_lock:
+        _usage_ledger = UsageLedger(os.path.join(root, "usage.db"))
+
+class SpendBudget:
+    """고객 작업 1건의 사용량 기록 + 지출 한도 확인 (CustomerJob마다 1개)
+    
+    호출 전 check(): 이번 호출이 최대로 쓸 비용(입력 + max_tokens 출력)을 더해도
+    작업 한도/하루 한도 안인지 확인하고, 넘으면 SpendCapExceeded로 호출하지 않음.
+    이미 나간 동시 호출은 서로의 비용을 모르므로 한도를 그만큼 조금 넘을 수 있음
+    """
+    
+    def __init__(self, job_id, customer="", model="", total_pages=0, limits=None, ledger=None):
+        self.ledger = ledger or get_usage_ledger()
+        self.job_id = job_id
+        self.customer = customer
+        self.limits = limits or {}
+        self.lock = threading.Lock()
+        self.ledger.start_job(job_id, model, customer, total_pages)
+        # 이어받은 작업은 이전 실행에서 쓴 비용부터 시작
+        self.job_spent = self.ledger.job_total(job_id)
+    
+    def check(self, model, input_tokens, max_tokens):
+        job_cap = self.limits.get("job") or 0
+        daily_cap = self.limits.get("daily") or 0
+        if not job_cap and not daily_cap:
+            return
+        worst = token_cost(model, input_tokens, max_tokens, prices=self.ledger.prices)
+        if job_cap and self.job_spent + worst > job_cap:
+            raise SpendCapExceeded(f"작업당 지출 한도 ${job_cap:.2f} 도달 (사용 ${self.job_spent:.3f})")
+        if daily_cap:
+            today = self.ledger.day_total()
+            if today + worst > daily_cap:
+                raise SpendCapExceeded(f"하루 지출 한도 ${daily_cap:.2f} 도달 (오늘 ${today:.3f})")
+    
+    def record(self, model, usage, expected_tokens=None, source="api"):
+        cost = self.ledger.record(model, usage, self.job_id, self.customer, source, expected_tokens=expected_tokens)
+        with self.lock:
+            self.job_spent += cost
+        return cost
+    
+    def finish(self):
+        self.ledger.finish_job(self.job_id)
+
+class TemplateBudget(SpendBudget):
+    """템플릿 공통 본문 생성용: 여러 고객이 나눠 쓰므로 어느 작업에도 넣지 않음
+    
+    job_id 없이 source="template"으로 기록하고, 하루 한도만 확인
+    """
+    
+    def __init__(self, limits=None, ledger=None):
+        self.ledger = ledger or get_usage_ledger()
+        self.job_id = ""
+        self.customer = ""
+        self.limits = {"daily": (limits or {}).get("daily") or 0}
+        self.lock = threading.Lock()
+        self.job_spent = 0.0
+    
+    def record(self, model, usage, expected_tokens=None, source="api"):
+        # 가짜 백엔드 호출은 그대로 장부 밖
+        return super().record(model, usage, expected_tokens, "fake" if source == "fake" else "template")
+    
+    def finish(self):
+        pass
+
+# ============================================
+# 앞 내용 요약 (파트 이어 쓰기, GPT 호출 없이 본문에서 추출)
+# ============================================
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def key_sentences(text):
+    """요약 후보 문장: 소제목 + 문단마다 첫 문장 (너무 길면 잘라서)"""
+    sentences = []
+    for para in text.split('\n'):
+        para = para.strip()
+        if not para:
+            continue
+        if para.startswith('**') or para.startswith('##') or (len(para) < 40 and para[0].isdigit()):
+            sentence = para.replace('**', '').replace('##', '').strip()
+        else:
+            sentence = SENTENCE_END.split(para, 1)[0]
+        if len(sentence) > CONTEXT_SENTENCE_CHARS:
+            sentence = sentence[:CONTEXT_SENTENCE_CHARS - 1] + "…"
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+def summarize_extract(text, max_chars):
+    """후보 문장을 본문 처음부터 끝까지 고르게 골라 max_chars 이내로 이어 붙임"""
+    sentences = key_sentences(text)
+    if not sentences or max_chars <= 0:
+        return ""
+    
+    for count in range(len(sentences), 0, -1):
+        picked = sorted(set(i * len(sentences) // count for i in range(count)))
+        summary = " / ".join(sentences[i] for i in picked)
+        if len(summary) <= max_chars:
+            return summary
+    return sentences[0][:max_chars]
+
+def fit_tokens(text, max_tokens, model=None):
+    """estimate_tokens 기준 max_tokens를 넘지 않도록 뒤를 자름"""
+    tokens = estimate_tokens(text, model)
+    while text and tokens > max_tokens:
+        text = text[:max(0, int(len(text) * max_tokens / tokens) - 1)]
+        tokens = estimate_tokens(text, model)
+    return text
+
+def build_context_summary(chapters, results, ch_idx, part, max_tokens=CONTEXT_SUMMARY_TOKENS, model=None):
+    """ch_idx 챕터의 part번 파트를 쓰기 전에 넘길 앞 내용 요약 (max_tokens 이내)
+    
+    현재 챕터의 앞 파트들에 몫의 대부분을 주고, 남은 몫은 이미 써 둔 앞 챕터들에
+    똑같이 나눔. 챕터가 많아 몫이 너무 작으면 앞 챕터는 제목만 넣음
+    """
+    if max_tokens <= 0:
+        return ""
+    
+    current = "\n".join(content for content in results[ch_idx][:part - 1] if content)
+    earlier = [
+        (chapters[i], "\n".join(content for content in results[i] if content))
+        for i in range(ch_idx)
+    ]
+    earlier = [(title, text) for title, text in earlier if text]
+    sample = current or earlier[-1][1] if (current or earlier) else ""
+    if not sample:
+        return ""
+    
+    # 요약은 본문 문장을 그대로 쓰므로 본문의 글자당 토큰 비율로 글자 예산을 잡음
+    # (구분 기호 몫으로 10% 남김, 넘치면 마지막에 fit_tokens가 자름)
+    density = estimate_tokens(sample, model) / len(sample)
+    budget = int(max_tokens / max(density, 0.1) * 0.9)
+    
+    current_line = ""
+    if current:
+        current_budget = int(budget * CONTEXT_CHAPTER_SHARE) if earlier else budget
+        current_line = f"- 이 챕터 앞부분: {summarize_extract(current, current_budget)}"
+    
+    lines = []
+    if earlier:
+        remaining = budget - len(current_line)
+        per_chapter = remaining // len(earlier)
+        if per_chapter < CONTEXT_SENTENCE_CHARS // 2:
+            titles = ("- 앞 챕터: " + ", ".join(title for title, _ in earlier))[:max(0, remaining)]
+            if titles:
+                lines.append(titles)
+        else:
+            for title, text in earlier:
+                summary = summarize_extract(text, per_chapter - len(title) - 4)
+                if summary:
+                    lines.append(f"- {title}: {summary}")
+    if current_line:
+        lines.append(current_line)
+    
+    return fit_tokens("\n".join(lines), max_tokens, model)
+
+# ============================================
+# 성능 기록 (단계별 span → TRACE_FILE, 📈 성능 탭)
+# ============================================
+
+class TraceSpan:
+    """기록 중인 단계 1개. with 블록 안에서 set()으로 토큰 수/쪽수 등을 추가"""
+    
+    def __init__(self, stage, attrs):
+        self.stage = stage
+        self.attrs = attrs
+    
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+class Tracer:
+    """작업 단계별 소요 시간을 JSONL로 기록 (span 1개 = 1줄)
+    
+    - span(stage, **attrs): with 블록의 소요 시간과 성공 여부를 기록
+    - context(**attrs): 이 스레드가 남기는 span에 job/customer 등을 붙임
+    - bind(func): 스레드 풀에서 실행할 func에 지금 context를 넘김
+    여러 스레드/프로세스가 같은 파일에 한 줄씩 덧붙이고, 기록 실패는 무시
+    (성능 기록 때문에 작업이 멈추지 않도록)
+    """
+    
+    def __init__(self, path=TRACE_FILE, enabled=True, max_bytes=TRACE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.local = threading.local()
+    
+    def configure(self, settings):
+        self.enabled = bool(settings.get("trace_enabled", True))
+    
+    def current_context(self):
+        return dict(getattr(self.local, "attrs", {}))
+    
+    def set_context(self, **attrs):
+        """이 스레드의 context를 통째로 바꿈 (작업을 하나씩 꺼내 처리하는 워커 루프용)"""
+        self.local.attrs = attrs
+    
+    @contextmanager
+    def context(self, **attrs):
+        previous = getattr(self.local, "attrs", {})
+        self.local.attrs = {**previous, **attrs}
+        try:
+            yield
+        finally:
+            self.local.attrs = previous
+    
+    def bind(self, func, **defaults):
+        """지금 스레드의 context(없는 값은 defaults)를 붙여 func를 실행하는 함수"""
+        attrs = {**defaults, **self.current_context()}
+        
+        def run(*args, **kwargs):
+            with self.context(**attrs):
+                return func(*args, **kwargs)
+        return run
+    
+    @contextmanager
+    def span(self, stage, **attrs):
+        span = TraceSpan(stage, {**self.current_context(), **attrs})
+        if not self.enabled:
+            yield span
+            return
+        
+        started_at = time.time()
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield span
+        except BaseException as e:
+            status = "error"
+            span.attrs.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            self.record(stage, started_at, time.perf_counter() - started, status, **span.attrs)
+    
+    def record(self, stage, started_at, seconds, status="ok", **attrs):
+        """따로 잰 시간을 span 1개로 기록 (with 블록으로 감싸기 어려운 구간용)"""
+        if not self.enabled:
+            return
+        self.write({
+            "stage": stage,
+            "start": started_at,
+            "seconds": seconds,
+            "status": status,
+            "pid": os.getpid(),
+            **self.current_context(),
+            **attrs
+        })
+    
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        try:
+            with self.lock:
+                folder = os.path.dirname(self.path)
+                if folder and not os.path.exists(folder):
+                    os.makedirs(folder)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                    size = f.tell()
+                if size > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+        except OSError:
+            pass
+    
+    def load(self, since=None):
+        """기록된 span 목록 (since 이후 시작한 것만, 넘겨 둔 .1 파일 포함)"""
+        spans = []
+        for path in (self.path + ".1", self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 다른 프로세스가 쓰는 중이던 줄
+                        continue
+                    if since is None or record.get("start", 0) >= since:
+                        spans.append(record)
+        return spans
+    
+    def clear(self):
+        with self.lock:
+            for path in (self.path, self.path + ".1"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+tracer = Tracer()
+
+def percentile(values, q):
+    """q 분위수 (0~1, 선형 보간). 값이 없으면 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def span_end(span):
+    return span["start"] + span["seconds"]
+
+def span_cost(span):
+    """GPT 호출 span의 비용 (기록 당시 장부 비용, 없으면 기본 가격표로 계산)"""
+    if "cost" in span:
+        return span["cost"]
+    return token_cost(span.get("model"), span.get("prompt_tokens", 0), span.get("completion_tokens", 0), span.get("cached_tokens", 0))
+
+def summarize_stages(spans):
+    """단계별 건수/오류/p50/p95/합계 (TRACE_STAGES 순서)"""
+    by_stage = {}
+    for span in spans:
+        by_stage.setdefault(span.get("stage"), []).append(span)
+    
+    rows = []
+    for stage, label in TRACE_STAGES.items():
+        stage_spans = by_stage.get(stage)
+        if not stage_spans:
+            continue
+        seconds = [span["seconds"] for span in stage_spans]
+        rows.append({
+            "단계": label,
+            "건수": len(stage_spans),
+            "오류": sum(1 for span in stage_spans if span.get("status") != "ok"),
+            "p50 (초)": round(percentile(seconds, 0.5), 3),
+            "p95 (초)": round(percentile(seconds, 0.95), 3),
+            "합계 (초)": round(sum(seconds), 1)
+        })
+    return rows
+
+def generation_stats(spans):
+    """GPT 호출 합계와 토큰/초(호출 시간 기준), 쪽당 비용(렌더링된 쪽수 기준)"""
+    calls = [span for span in spans if span.get("stage") == "generate"]
+    succeeded = [span for span in calls if span.get("status") == "ok"]
+    completion = sum(span.get("completion_tokens", 0) for span in succeeded)
+    seconds = sum(span["seconds"] for span in succeeded)
+    cost = sum(span_cost(span) for span in succeeded)
+    pages = sum(span.get("pages", 0) for span in spans if span.get("stage") == "render" and span.get("status") == "ok")
+    return {
+        "calls": len(calls),
+        "failed": len(calls) - len(succeeded),
+        "retries": sum(max(0, span.get("attempts", 1) - 1) for span in calls),
+        "completion_tokens": completion,
+        "tokens_per_second": completion / seconds if seconds else 0.0,
+        "cost": cost,
+        "pages": pages,
+        "cost_per_page": cost / pages if pages else None
+    }
+
+def job_timings(spans, limit=100):
+    """작업(고객)별 단계 시간 - 최근 시작 순. 가장 오래 걸린 단계를 '병목'으로 표시"""
+    jobs = {}
+    for span in spans:
+        if span.get("job"):
+            jobs.setdefault(span["job"], []).append(span)
+    
+    rows = []
+    for job, job_spans in jobs.items():
+        by_stage = {stage: [span for span in job_spans if span.get("stage") == stage] for stage in TRACE_STAGES}
+        generate = by_stage["generate"]
+        succeeded = [span for span in generate if span.get("status") == "ok"]
+        # 파트는 동시에 호출되므로 합계가 아니라 첫 호출 시작 ~ 마지막 호출 끝
+        generate_seconds = max(map(span_end, generate)) - min(span["start"] for span in generate) if generate else 0.0
+        call_seconds = sum(span["seconds"] for span in succeeded)
+        completion = sum(span.get("completion_tokens", 0) for span in succeeded)
+        cost = sum(span_cost(span) for span in succeeded)
+        pages = sum(span.get("pages", 0) for span in by_stage["render"] if span.get("status") == "ok")
+        durations = {
+            TRACE_STAGES["generate"]: generate_seconds,
+            TRACE_STAGES["layout"]: sum(span["seconds"] for span in by_stage["layout"]),
+            TRACE_STAGES["render"]: sum(span["seconds"] for span in by_stage["render"]),
+            TRACE_STAGES["smtp"]: sum(span["seconds"] for span in by_stage["smtp"])
+        }
+        started_at = min(span["start"] for span in job_spans)
+        rows.append((started_at, {
+            "작업": job,
+            "고객": next((span["customer"] for span in job_spans if span.get("customer")), ""),
+            "시작": datetime.fromtimestamp(started_at).strftime('%m-%d %H:%M:%S'),
+            "GPT 호출": len(generate),
+            "재시도": sum(max(0, span.get("attempts", 1) - 1) for span in generate),
+            "GPT p95 (초)": round(percentile([span["seconds"] for span in generate], 0.95), 2),
+            "GPT 구간 (초)": round(generate_seconds, 1),
+            "토큰/초": round(completion / call_seconds, 1) if call_seconds else None,
+            "레이아웃 (초)": round(durations[TRACE_STAGES["layout"]], 2),
+            "렌더링 (초)": round(durations[TRACE_STAGES["render"]], 2),
+            "메일 (초)": round(durations[TRACE_STAGES["smtp"]], 2),
+            "쪽수": pages or None,
+            "비용 ($)": round(cost, 4),
+            "쪽당 비용 ($)": round(cost / pages, 5) if pages else None,
+            "병목": max(durations, key=durations.get) if any(durations.values()) else ""
+        }))
+    
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return [row for _, row in rows[:limit]]
+
+# ============================================
+# LLM 백엔드 (OpenAI / 부하 테스트용 가짜 백엔드)
+# ============================================
+
+FAKE_SENTENCES = [
+    "타고난 기운이 단단해서 한번 정한 일은 끝까지 밀고 나가는 힘이 있습니다.",
+    "올해는 주변 사람들과의 관계에서 새로운 기회가 열리는 흐름입니다.",
+    "서두르기보다 한 걸음씩 쌓아 가는 방식이 더 큰 결과로 이어집니다.",
+    "봄과 가을에는 재물의 흐름이 좋아지니 계획해 둔 일을 이때 시작해 보세요.",
+    "감정을 솔직하게 표현하는 것이 오히려 관계를 편안하게 만들어 줍니다.",
+    "작은 습관 하나가 한 해 전체의 분위기를 바꾸는 계기가 될 수 있습니다.",
+    "무리한 약속보다는 지킬 수 있는 약속을 하는 것이 신뢰를 지키는 길입니다.",
+    "건강은 충분한 휴식과 규칙적인 생활에서 가장 먼저 회복됩니다.",
+]
+
+def sample_latency(rng, config):
+    """응답 시작까지 걸리는 시간 (초, time_scale 적용 전)
+    
+    fixed: 항상 median / uniform: 0 ~ 2×median / lognormal: 중앙값 median, 95%가 p95 이내
+    """
+    median = float(config["latency_median"])
+    dist = config["latency_dist"]
+    if dist == "fixed" or median <= 0:
+        return max(0.0, median)
+    if dist == "uniform":
+        return rng.uniform(0, 2 * median)
+    sigma = math.log(max(float(config["latency_p95"]), median * 1.0001) / median) / 1.645
+    return rng.lognormvariate(math.log(median), sigma)
+
+class FakeLLMClient:
+    """OpenAI chat.completions.create와 같은 모양으로 답하는 가짜 백엔드 (API 키/비용 없음)
+    
+    - 같은 요청(모델 + 메시지 + 몇 번째 시도)이면 지연/오류/본문이 항상 같음 (seed 고정)
+    - 지연: sample_latency + 출력 토큰 / tokens_per_second, 전체에 time_scale을 곱해 대기
+    - 오류: error_rate 확률로 500, rate_limit_rate 확률로 429 (SDK와 같은 예외 클래스)
+    - 분량: 프롬프트의 목표 글자 수 × output_ratio (± output_jitter), max_tokens에서 잘림
+    - stream=True면 조각으로 나눠 보내고 include_usage면 마지막에 usage
+    """
+    
+    def __init__(self, config=None):
+        self.config = {**FAKE_LLM_DEFAULTS, **(config or {})}
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.seen_prefixes = set()
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    def _sleep(self, seconds):
+        seconds *= float(self.config["time_scale"])
+        if seconds > 0:
+            time.sleep(seconds)
+    
+    def _make_text(self, rng, chars):
+        paragraphs = []
+        total = 0
+        while total < chars:
+            if len(paragraphs) % 5 == 0:
+                paragraph = f"**{rng.choice(FAKE_SENTENCES)[:14].strip()}**"
+            else:
+                paragraph = " ".join(rng.choice(FAKE_SENTENCES) for _ in range(rng.randint(2, 5)))
+            paragraphs.append(paragraph)
+            total += len(paragraph) + 1
+        return "\n".join(paragraphs)[:max(1, chars)]
+    
+    def create(self, model, messages, max_tokens=None, temperature=None, stream=False, stream_options=None, **kwargs):
+        key = hashlib.sha256(json.dumps([self.config["seed"], model, messages], ensure_ascii=False).encode("utf-8")).hexdigest()
+        with self.lock:
+            self.calls += 1
+            attempt = self.attempts.get(key, 0) + 1
+            self.attempts[key] = attempt
+        rng = random.Random(f"{key}:{attempt}")
+        
+        roll = rng.random()
+        if roll < float(self.config["rate_limit_rate"]):
+            with self.lock:
+                self.rate_limited += 1
+            self._sleep(0.05)
+            raise RateLimitError("Rate limit reached (fake)", response=SimpleNamespace(request=None, status_code=429, headers={}), body=None)
+        latency = sample_latency(rng, self.config)
+        if roll < float(self.config["rate_limit_rate"]) + float(self.config["error_rate"]):
+            with self.lock:
+                self.errors += 1
+            self._sleep(latency)
+            raise InternalServerError("Internal server error (fake)", response=SimpleNamespace(request=None, status_code=500, headers={}), body=None)
+        
+        prompt = messages[-1]["content"] if messages else ""
+        match = re.search(r"약 (\d+)자", prompt)
+        ratio = TOKENS_PER_HANGUL.get(model, 1.0)
+        target = int(match.group(1)) if match else int((max_tokens or 1000) / ratio / MAX_TOKENS_HEADROOM)
+        chars = int(target * max(0.05, rng.gauss(float(self.config["output_ratio"]), float(self.config["output_jitter"]))))
+        finish_reason = "stop"
+        if max_tokens and chars * ratio > max_tokens:
+            chars = int(max_tokens / ratio)
+            finish_reason = "length"
+        text = self._make_text(rng, chars)
+        
+        # OpenAI처럼 같은 앞부분(시스템 메시지)이 1024토큰 이상이면 128토큰 단위로 캐시
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        system_tokens = estimate_tokens(system, model)
+        with self.lock:
+            seen = system in self.seen_prefixes
+            self.seen_prefixes.add(system)
+        cached = system_tokens // 128 * 128 if seen and system_tokens >= 1024 else 0
+        prompt_tokens = sum(estimate_tokens(message["content"], model) for message in messages)
+        completion_tokens = estimate_tokens(text, model)
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=cached)
+        )
+        
+        response_id = f"chatcmpl-fake-{key[:12]}-{attempt}"
+        created = int(time.time())
+        tokens_per_second = float(self.config["tokens_per_second"])
+        seconds_per_char = completion_tokens / max(1, len(text)) / tokens_per_second if tokens_per_second > 0 else 0.0
+        
+        if not stream:
+            self._sleep(latency + len(text) * seconds_per_char)
+            return SimpleNamespace(
+                id=response_id, object="chat.completion", created=created, model=model,
+                choices=[SimpleNamespace(index=0, message=SimpleNamespace(role="assistant", content=text), finish_reason=finish_reason)],
+                usage=usage
+            )
+        
+        def chunks():
+            self._sleep(latency)
+            step = FAKE_STREAM_CHUNK_CHARS
+            for start in range(0, len(text), step):
+                piece = text[start:start + step]
+                self._sleep(len(piece) * seconds_per_char)
+                last = start + step >= len(text)
+                yield SimpleNamespace(
+                    id=response_id, object="chat.completion.chunk", created=created, model=model,
+                    choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=piece), finish_reason=finish_reason if last else None)],
+                    usage=None
+                )
+            if stream_options and stream_options.get("include_usage"):
+                yield SimpleNamespace(id=response_id, object="chat.completion.chunk", created=created, model=model, choices=[], usage=usage)
+        return chunks()
+    
+    def stats(self):
+        with self.lock:
+            return {"calls": self.calls, "errors": self.errors, "rate_limited": self.rate_limited}
+
+def make_llm_client(settings, max_retries=0):
+    """설정(llm_backend)에 맞는 chat 클라이언트. 모두 chat.completions.create 모양이 같음
+    
+    - openai: OpenAI SDK. llm_base_url이 있으면 그 주소의 OpenAI 호환 서버
+      (python app.py mock-llm 같은 로컬 대역 서버 포함)
+    - fake: FakeLLMClient (settings의 fake_llm으로 지연/오류율/분량 조절)
+    """
+    if settings.get("llm_backend") == "fake":
+        return FakeLLMClient(settings.get("fake_llm"))
+    base_url = settings.get("llm_base_url") or None
+    # 로컬 호환 서버는 키를 확인하지 않으므로 비어 있어도 됨
+    api_key = settings.get("api_key") or ("local" if base_url else None)
+    return OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+
+def llm_ready(settings):
+    """생성을 시작할 수 있는지 (OpenAI면 API 키 또는 호환 서버 주소 필요)"""
+    return bool(settings.get("llm_backend") == "fake" or settings.get("api_key") or settings.get("llm_base_url"))
+
+def run_mock_llm_server(port=MOCK_LLM_PORT, settings=None):
+    """python app.py mock-llm [포트]: FakeLLMClient를 OpenAI 호환 HTTP 서버로 띄움
+    
+    설정의 llm_base_url을 http://127.0.0.1:<포트>/v1 로 두면 SDK/HTTP 경로까지
+    포함해서 부하 테스트할 수 있음 (/v1/chat/completions, stream 포함)
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    settings = settings or load_settings()
+    fake = FakeLLMClient(settings.get("fake_llm"))
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def _send_json(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def do_POST(self):
+            if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            try:
+                result = fake.create(**request)
+            except APIStatusError as e:
+                self._send_json(e.status_code, {"error": {"message": e.message, "type": "server_error", "code": None}})
+                return
+            
+            if not request.get("stream"):
+                self._send_json(200, to_plain(result))
+                return
+            
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for chunk in result:
+                self.wfile.write(f"data: {json.dumps(to_plain(chunk), ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    print(f"[mock-llm] http://127.0.0.1:{port}/v1 (지연 중앙값 {fake.config['latency_median']}초 × {fake.config['time_scale']}, 오류 {fake.config['error_rate']}, 429 {fake.config['rate_limit_rate']})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# ============================================
+# 챕터 템플릿 (공통 본문 1번 생성 → 고객마다 짧은 맞춤 도입부)
+# ============================================
+
+class TemplateStore:
+    """(모델, 서비스, 챕터, 파트, 분량, 버킷, 지침)별 공통 본문 (SQLite, TEMPLATE_FILE)
+    
+    같은 키를 여러 스레드가 동시에 요청하면 한 스레드만 생성하고 나머지는 기다렸다 읽음.
+    워커 프로세스끼리는 잠그지 않으므로 드물게 같은 본문을 두 번 만들 수 있음 (먼저 저장한 것 사용)
+    """
+    
+    def __init__(self, path=TEMPLATE_FILE):
+        ensure_data_dir()
+        self.path = path
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS templates (
+                key TEXT PRIMARY KEY,
+                service_type TEXT,
+                chapter TEXT,
+                part INTEGER,
+                bucket TEXT,
+                model TEXT,
+                content TEXT,
+                created_at REAL,
+                last_used REAL,
+                uses INTEGER DEFAULT 0
+            )
+        """)
+    
+    @staticmethod
+    def make_key(model, service_type, chapter, part, total_parts, target_chars, bucket, guide):
+        raw = json.dumps([model, service_type, chapter, part, total_parts, target_chars, bucket, guide], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT content FROM templates WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE templates SET uses = uses + 1, last_used = ? WHERE key = ?", (time.time(), key))
+        return row["content"]
+    
+    def put(self, key, content, service_type="", chapter="", part=0, bucket=None, model=""):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                """INSERT OR IGNORE INTO templates (key, service_type, chapter, part, bucket, model, content, created_at, last_used, uses)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)""",
+                (key, service_type, chapter, part, json.dumps(bucket or {}, ensure_ascii=False, sort_keys=True), model, content, now, now)
+            )
+    
+    def get_or_create(self, key, create, **info):
+        """저장된 본문, 없으면 create()로 만들어 저장 (같은 키는 한 번만 생성)"""
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            content = self.get(key)
+            if content is None:
+                content = create()
+                self.put(key, content, **info)
+            return content
+    
+    def stats(self):
+        with self.lock:
+            row = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(uses), 0) FROM templates").fetchone()
+        return {"templates": row[0], "uses": row[1]}
+    
+    def rows(self, limit=200):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT service_type, chapter, part, bucket, model, LENGTH(content), uses, created_at FROM templates ORDER BY uses DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [
+            {
+                "서비스": service_type,
+                "챕터": chapter,
+                "파트": part,
+                "버킷": ", ".join(f"{key}={value}" for key, value in json.loads(bucket).items()) or "(공통)",
+                "모델": model,
+                "글자 수": chars,
+                "사용": uses,
+                "생성": datetime.fromtimestamp(created_at).strftime('%m-%d %H:%M')
+            }
+            for service_type, chapter, part, bucket, model, chars, uses, created_at in rows
+        ]
+    
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM templates")
+
+_template_store = None
+_template_store_lock = threading.Lock()
+
+def get_template_store():
+    """프로세스 전체가 공유하는 템플릿 저장소 (키별 생성 잠금을 스레드끼리 공유해야 함)"""
+    global _template_store
+    with _template_store_lock:
+        if _template_store is None:
+            _template_store = TemplateStore()
+        return _template_store
+
+class ChapterTemplates:
+    """서비스 1개의 템플릿 설정: 템플릿으로 만들 챕터 + 공통 본문을 나누는 고객 정보 컬럼(버킷)"""
+    
+    def __init__(self, chapters, bucket_keys, store=None):
+        self.chapters = set(chapters)
+        self.bucket_keys = [key for key in bucket_keys if key]
+        self.store = store or get_template_store()
+    
+    def applies(self, chapter_title, part_num, total_parts):
+        # 보충 파트는 고객마다 모자란 분량이 달라서 템플릿으로 만들지 않음
+        return chapter_title in self.chapters and part_num <= total_parts
+    
+    def missing_keys(self, columns):
+        """업로드한 시트에 없는 버킷 컬럼"""
+        columns = set(columns)
+        return [key for key in self.bucket_keys if key not in columns]
+    
+    def bucket(self, customer_data):
+        """버킷 컬럼 값만 뽑은 고객 정보 (값이 빈 셀은 빠짐)
+        
+        컬럼 자체가 없으면 오류: 빼고 진행하면 값이 다른 고객끼리 공통 본문을 나눠 쓰게 됨
+        """
+        missing = self.missing_keys(customer_data.keys())
+        if missing:
+            raise ValueError(f"템플릿 버킷 컬럼이 고객 정보에 없음: {', '.join(missing)}")
+        values = {}
+        for key in self.bucket_keys:
+            value = customer_data.get(key)
+            if value is not None and pd.notna(value) and normalize_cell(value):
+                values[key] = normalize_cell(value)
+        return values
+    
+    @staticmethod
+    def personal_chars(target_chars):
+        """파트 분량 중 맞춤 도입부 글자 수 (나머지가 공통 본문)"""
+        chars = min(TEMPLATE_PERSONAL_MAX_CHARS, max(TEMPLATE_PERSONAL_MIN_CHARS, int(target_chars * TEMPLATE_PERSONAL_SHARE)))
+        return min(chars, target_chars // 2)
+
+def chapter_templates(settings, service_type):
+    """settings.json chapter_templates[서비스] → ChapterTemplates (템플릿 챕터가 없으면 None)"""
+    config = (settings.get("chapter_templates") or {}).get(service_type) or {}
+    if not config.get("chapters"):
+        return None
+    return ChapterTemplates(config["chapters"], config.get("bucket_keys") or [])
+
+# ============================================
+# GPT API 호출 (목차별 + 파트별 분할)
+# ============================================
+
+def usage_field(obj, name):
+    # SDK 응답 객체와 Batch API 결과(dict) 둘 다
+    value = obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+    return value or 0
+
+def usage_counts(usage):
+    """응답 usage → (입력, 캐시 적중 입력, 출력) 토큰 수. usage가 없으면 모두 0"""
+    if usage is None:
+        return 0, 0, 0
+    details = usage_field(usage, "prompt_tokens_details")
+    cached = usage_field(details, "cached_tokens") if details else 0
+    return usage_field(usage, "prompt_tokens"), cached, usage_field(usage, "completion_tokens")
+
+class PromptCacheStats:
+    """모델별 입력 토큰 중 OpenAI 프롬프트 캐시에서 읽은 비율 (이 프로세스에서 측정)
+    
+    usage.prompt_tokens_details.cached_tokens를 모아서 앞부분 고정이 실제로
+    캐시에 맞고 있는지 확인하는 용도
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+    
+    def record(self, model, usage):
+        if usage is None:
+            return
+        prompt, cached, completion = usage_counts(usage)
+        with self.lock:
+            calls, prompt_sum, cached_sum, completion_sum = self.totals.get(model, (0, 0, 0, 0))
+            self.totals[model] = (calls + 1, prompt_sum + prompt, cached_sum + cached, completion_sum + completion)
+    
+    def snapshot(self):
+        """모든 모델 합계 (호출, 입력, 캐시 적중 입력, 출력 토큰)"""
+        with self.lock:
+            values = list(self.totals.values())
+        return tuple(sum(v[i] for v in values) for i in range(4))
+    
+    def since(self, start=None):
+        """start = 이전 snapshot() 값. 그 이후 증가분과 적중률"""
+        calls, prompt, cached, completion = self.snapshot()
+        if start:
+            calls, prompt, cached, completion = calls - start[0], prompt - start[1], cached - start[2], completion - start[3]
+        return {
+            "calls": calls,
+            "prompt_tokens": prompt,
+            "cached_tokens": cached,
+            "completion_tokens": completion,
+            "hit_rate": cached / prompt if prompt else 0.0
+        }
+    
+    def describe(self, start=None):
+        stats = self.since(start)
+        if not stats["calls"]:
+            return ""
+        return f"프롬프트 캐시 적중 {stats['hit_rate'] * 100:.0f}% ({stats['cached_tokens']:,}/{stats['prompt_tokens']:,} 토큰)"
+
+prompt_cache_stats = PromptCacheStats()
+
+def stream_completion(client, sink=None, **request):
+    """stream=True로 호출해 도착하는 조각을 sink.feed()로 바로 넘기고 (전체 텍스트, usage) 반환
+    
+    재시도하면 처음부터 다시 받으므로 시작할 때 sink.reset().
+    usage는 include_usage로 요청해 마지막 조각(choices 없음)에 실려 옴
+    """
+    if sink:
+        sink.reset()
+    pieces = []
+    usage = None
+    for chunk in client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request):
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            pieces.append(delta)
+            if sink:
+                sink.feed(delta)
+    return "".join(pieces), usage
+
+def format_customer_info(customer_data):
+    """고객 정보 → 프롬프트용 목록 (빈 값은 제외)"""
+    return "\n".join([f"- {key}: {value}" for key, value in customer_data.items() if pd.notna(value) and str(value).strip()])
+
+class PromptPrefix:
+    """고객 1명의 모든 파트 호출이 그대로 공유하는 앞부분 (시스템 메시지)
+    
+    역할 + 서비스 유형 + 작성 지침 + 공통 규칙 + 고객 정보 순서로, 파트마다
+    바뀌는 챕터/분량 지시는 뒤의 짧은 user 메시지로만 보냄. 앞부분이 글자 단위로
+    같아야 OpenAI 프롬프트 캐시가 적중하므로 고객마다 한 번만 만들어 재사용하고
+    숫자(글자 수, 파트 번호)는 여기에 넣지 않음
+    """
+    
+    def __init__(self, customer_data, guide, service_type):
+        self.customer_info = format_customer_info(customer_data)
+        self.system_message = f"""당신은 {service_type} 분야 30년 경력 전문가입니다. 요청받은 분량을 반드시 채워서 상세하게 작성합니다. 절대 짧게 쓰지 않습니다.
+
+[서비스 유형]
+{service_type}
+
+[작성 지침]
+{guide}
+
+[공통 규칙]
+1. 요청한 글자 수 이상 작성하세요.
+2. 내용을 풍부하게, 예시를 많이 들어주세요.
+3. 일반적인 내용이 아닌, 고객 맞춤형 내용으로 작성하세요.
+4. 절대 분량을 줄이지 마세요. 요청한 글자 수를 꼭 채우세요.
+5. 문단을 나누어 읽기 쉽게 작성하세요.
+
+[고객 정보]
+{self.customer_info}"""
+        # 같은 앞부분끼리 같은 서버로 라우팅되도록 넘기는 키
+        self.cache_key = hashlib.sha256(self.system_message.encode("utf-8")).hexdigest()[:32]
+
+def build_part_prompt(chapter_title, part_num, total_parts, target_chars, context="", personalize=False):
+    """파트마다 달라지는 짧은 user 메시지. part_num > total_parts면 분량 보충 호출
+    
+    context는 앞 내용 요약 (이어 쓰기 모드에서만).
+    personalize=True면 템플릿 챕터의 맞춤 도입부 호출 (context = 공통 본문 요약)
+    """
+    
+    if personalize:
+        part_instruction = f"""이 파트의 본문은 같은 조건의 고객에게 공통으로 쓰는 해설로 이미 준비되어 있습니다.
+[고객 정보]를 바탕으로 이 고객에게만 해당하는 도입 문단을 약 {target_chars}자 분량으로 작성해주세요.
+공통 해설이 이 고객에게 어떤 의미인지 이어 주고, 해설 내용을 반복하지 마세요. 챕터 제목이나 인사말은 쓰지 마세요."""
+    elif part_num > total_parts:
+        part_instruction = f"""이 챕터의 본문({total_parts}개 파트)은 이미 작성되었지만 분량이 부족합니다.
+앞 내용을 반복하지 말고, 이어서 읽을 보충 내용(추가 사례, 구체적인 실천 조언, 시기별 흐름 등)을
+약 {target_chars}자 분량으로 작성해주세요. 챕터 제목이나 인사말은 다시 쓰지 마세요."""
+    elif total_parts == 1:
+        part_instruction = f"이 챕터를 약 {target_chars}자 분량으로 상세하게 작성해주세요."
+    else:
+        part_instruction = f"""이 챕터는 총 {total_parts}개 파트로 나뉩니다.
+현재는 파트 {part_num}/{total_parts}을 작성해주세요.
+이 파트를 약 {target_chars}자 분량으로 상세하게 작성해주세요.
+
+파트 {part_num} 작성 시:
+- 파트 1이면: 챕터 도입부와 전반부 내용
+- 중간 파트면: 핵심 내용과 상세 분석
+- 마지막 파트면: 심화 내용과 마무리"""
+
+    context_section = ""
+    if context and personalize:
+        context_section = f"""
+[공통 해설 요약]
+{context}
+"""
+    elif context:
+        context_section = f"""
+[앞에서 이미 쓴 내용 요약]
+{context}
+위 내용은 다시 쓰지 말고, 이어지는 새로운 내용으로 작성하세요.
+"""
+
+    return f"""[현재 작성할 챕터]
+{chapter_title}
+{context_section}
+[분량 지시]
+{part_instruction}
+
+반드시 {target_chars}자 이상 작성하세요.
+"""
+
+def build_part_messages(customer_data, chapter_title, part_num, total_parts, target_chars, guide, service_type, prefix=None, context=""):
+    """파트 1개의 (시스템 메시지, 프롬프트). prefix가 있으면 그 앞부분을 재사용"""
+    if prefix is None:
+        prefix = PromptPrefix(customer_data, guide, service_type)
+    return prefix.system_message, build_part_prompt(chapter_title, part_num, total_parts, target_chars, context)
+
+def build_part_request(model, prefix, chapter_title, part_num, total_parts, target_chars, context="", personalize=False):
+    """chat.completions.create에 넘길 파트 1개의 요청 본문 (동기 호출 / Batch API 공용)"""
+    return dict(
+        model=model,
+        messages=[
+            {"role": "system", "content": prefix.system_message},
+            {"role": "user", "content": build_part_prompt(chapter_title, part_num, total_parts, target_chars, context, personalize)}
+        ],
+        max_tokens=part_max_tokens(target_chars, model),
+        temperature=PART_TEMPERATURE,
+        prompt_cache_key=prefix.cache_key
+    )
+
+def part_cache_key(cache, request):
+    """build_part_request 요청의 ContentCache 키"""
+    return cache.make_key(
+        request["model"], request["messages"][0]["content"], request["messages"][1]["content"],
+        request["temperature"], request["max_tokens"]
+    )
+
+def generate_chapter_part(client, model, customer_data, chapter_title, part_num, total_parts, target_chars, guide, service_type, rate_limiter=None, concurrency=None, max_attempts=RETRY_MAX_ATTEMPTS, cache=None, use_cache=True, stream=False, sink=None, prefix=None, context="", budget=None, template=None, personalize=False):
+    """챕터의 각 파트 생성 (실패 시 PartGenerationError)
+    
+    cache가 있으면 같은 프롬프트 결과를 재사용. use_cache=False면 캐시를
+    읽지 않고 새로 생성한 결과로 덮어씀.
+    stream=True면 토큰이 도착하는 대로 sink(StreamingLayout 등)에 넘겨서
+    미리보기와 문단 줄바꿈을 생성과 동시에 진행.
+    prefix(PromptPrefix)를 넘기면 고객의 모든 파트가 같은 시스템 메시지를 써서
+    프롬프트 캐시에 맞음. context(앞 내용 요약)는 뒤쪽 user 메시지에만 들어감.
+    budget(SpendBudget)이 있으면 호출 전에 지출 한도를 확인하고 usage를 작업 단위로
+    기록. 없어도 usage는 장부에 남음.
+    template(ChapterTemplates)이 이 챕터를 맡으면 공통 본문 + 맞춤 도입부로 생성
+    """
+    
+    if template is not None and template.applies(chapter_title, part_num, total_parts):
+        return generate_templated_part(
+            client, model, customer_data, chapter_title, part_num, total_parts, target_chars, guide, service_type,
+            template, rate_limiter, concurrency, max_attempts, cache, use_cache, sink, prefix, budget
+        )
+    
+    with tracer.span("prompt", chapter=chapter_title, part=part_num):
+        if prefix is None:
+            prefix = PromptPrefix(customer_data, guide, service_type)
+        request = build_part_request(model, prefix, chapter_title, part_num, total_parts, target_chars, context, personalize)
+    system_message, prompt = request["messages"][0]["content"], request["messages"][1]["content"]
+    
+    cache_key = None
+    if cache:
+        cache_key = part_cache_key(cache, request)
+        if use_cache:
+            cached = cache.get(cache_key)
+            if cached:
+                if sink:
+                    sink.reset()
+                    sink.feed(cached)
+                    sink.finish()
+                return cached
+    
+    input_tokens = estimate_tokens(system_message + prompt, model)
+    expected_tokens = (input_tokens, target_chars * TOKENS_PER_HANGUL.get(model, 1.0))
+    source = usage_source(client)
+    
+    def call_api():
+        if budget:
+            budget.check(model, input_tokens, request["max_tokens"])
+        if rate_limiter:
+            rate_limiter.acquire(input_tokens + request["max_tokens"])
+        
+        if stream:
+            content, usage = stream_completion(client, sink, **request)
+        else:
+            response = client.chat.completions.create(**request)
+            content = response.choices[0].message.content
+            usage = getattr(response, "usage", None)
+        prompt_cache_stats.record(model, usage)
+        if budget:
+            cost = budget.record(model, usage, expected_tokens, source)
+        else:
+            cost = get_usage_ledger().record(model, usage, source=source, expected_tokens=expected_tokens)
+        prompt_tokens, cached_tokens, completion_tokens = usage_counts(usage)
+        span.set(prompt_tokens=prompt_tokens, cached_tokens=cached_tokens, completion_tokens=completion_tokens, cost=cost)
+        if not content or not content.strip():
+            raise EmptyCompletionError("GPT 응답이 비어 있습니다")
+        return content
+    
+    # 재시도 대기와 호출 한도 대기까지 포함한 시간 (attempts = 시도 횟수)
+    with tracer.span("generate", model=model, chapter=chapter_title, part=part_num, stream=stream) as span:
+        try:
+            content, attempts = call_with_retry(call_api, max_attempts, concurrency)
+        except Exception as e:
+            span.set(attempts=getattr(e, "attempts", 1), error=type(e).__name__)
+            raise PartGenerationError(chapter_title, part_num, e, getattr(e, "attempts", 1)) from e
+        span.set(attempts=attempts, chars=len(content))
+    
+    output_yield.record(model, target_chars, len(content))
+    if sink:
+        if not stream:
+            sink.reset()
+            sink.feed(content)
+        sink.finish()
+    if cache:
+        cache.set(cache_key, model, content)
+    return content
+
+def generate_templated_part(client, model, customer_data, chapter_title, part_num, total_parts, target_chars, guide, service_type, template, rate_limiter=None, concurrency=None, max_attempts=RETRY_MAX_ATTEMPTS, cache=None, use_cache=True, sink=None, prefix=None, budget=None):
+    """템플릿 챕터의 파트 = 고객 맞춤 도입부 + 공통 본문
+    
+    공통 본문은 버킷 값만 고객 정보로 넣은 프롬프트로 (모델, 서비스, 챕터, 파트, 버킷, 지침)마다
+    한 번만 생성해 저장. 고객마다는 도입부(personal_chars)만 호출하므로 출력 토큰이 크게 줄고,
+    입력도 고객의 다른 파트와 같은 앞부분(prefix)이라 프롬프트 캐시에 맞음
+    """
+    personal_chars = template.personal_chars(target_chars)
+    body_chars = target_chars - personal_chars
+    bucket = template.bucket(customer_data)
+    key = template.store.make_key(model, service_type, chapter_title, part_num, total_parts, body_chars, bucket, guide)
+    
+    def create_body():
+        # 응답 캐시는 쓰지 않음 (템플릿 저장소가 캐시 역할).
+        # 비용은 처음 만든 고객이 아니라 별도 템플릿 항목으로 기록 (작업 한도에 넣지 않음)
+        body_budget = TemplateBudget(budget.limits, budget.ledger) if budget else TemplateBudget()
+        return generate_chapter_part(
+            client, model, bucket, chapter_title, part_num, total_parts, body_chars, guide, service_type,
+            rate_limiter, concurrency, max_attempts, budget=body_budget
+        )
+    
+    body = template.store.get_or_create(key, create_body, service_type=service_type, chapter=chapter_title, part=part_num, bucket=bucket, model=model)
+    intro = generate_chapter_part(
+        client, model, customer_data, chapter_title, part_num, total_parts, personal_chars, guide, service_type,
+        rate_limiter, concurrency, max_attempts, cache, use_cache, prefix=prefix,
+        context=summarize_extract(body, TEMPLATE_DIGEST_CHARS), budget=budget, personalize=True
+    )
+    content = intro.strip() + "\n\n" + body.strip()
+    if sink:
+        sink.reset()
+        sink.feed(content)
+        sink.finish()
+    return content
+
+def assemble_chapters(chapters, results, layouts=None):
+    """챕터별 파트 결과를 순서대로 합쳐서 [{title, content}] 목록으로
+    
+    layouts[챕터][파트]에 스트리밍 중 만들어 둔 (기준, 문단 레이아웃)이 모두
+    있으면 챕터 레이아웃도 이어 붙여서 넘김 (PDF 렌더링 때 줄바꿈 생략)
+    """
+    
+    full_content = []
+    for ch_idx, (chapter, chapter_content_parts) in enumerate(zip(chapters, results)):
+        # 파트들을 합쳐서 하나의 챕터로 (분량이 차서 건너뛴 빈 파트는 제외)
+        kept = [i for i, content in enumerate(chapter_content_parts) if content]
+        full_chapter_content = "\n\n".join(chapter_content_parts[i] for i in kept)
+        
+        chapter_content = {
+            "title": chapter,
+            "content": full_chapter_content
+        }
+        
+        part_layouts = [layouts[ch_idx][i] for i in kept] if layouts else None
+        if part_layouts and all(part_layouts) and len({key for key, _ in part_layouts}) == 1:
+            # "\n\n"으로 이어 붙이면 파트 사이에 빈 문단 하나가 생김
+            entries = []
+            for i, (_, part_entries) in enumerate(part_layouts):
+                if i:
+                    entries.append(("blank", []))
+                entries.extend(part_entries)
+            chapter_content["layout_key"] = part_layouts[0][0]
+            chapter_content["layout"] = entries
+        
+        full_content.append(chapter_content)
+    
+    return full_content
+
+def generate_full_content(client, model, customer_data, chapters, total_pages, guide, service_type, progress_callback=None, max_workers=1, rate_limiter=None, max_attempts=RETRY_MAX_ATTEMPTS, cache=None, use_cache=True, journal=None, stream=False, chain_context=False, context_tokens=CONTEXT_SUMMARY_TOKENS, spend_limits=None, templates=None):
+    """전체 콘텐츠 생성 (목차별 + 파트별 분할, max_workers개 동시 호출)
+    
+    실패한 파트가 있으면 나머지 파트를 모두 시도한 뒤 ContentGenerationError.
+    journal이 있으면 이미 끝난 파트는 건너뛰고, 새 파트는 도착 즉시 기록.
+    챕터가 목표 분량보다 짧게 끝나면 보충 파트를 추가로 호출.
+    stream=True면 파트를 받는 동안 문단 줄바꿈까지 끝내 둠.
+    chain_context=True면 챕터 안 파트는 앞 내용 요약을 받아 차례로 생성.
+    templates(ChapterTemplates)가 맡은 챕터는 공통 본문 + 맞춤 도입부로 생성
+    """
+    
+    font_name = get_assets().font_name()
+    line_breaker = get_assets().line_breaker(font_name)
+    page_counter = PageCounter(font_name, line_breaker)
+    
+    # 고객 이름은 호출한 쪽(process_queued_job)의 성능 기록 context에서 가져옴 (사용량 장부 표시용)
+    job = CustomerJob(None, tracer.current_context().get("customer", ""), customer_data, chapters, total_pages, guide, service_type, journal, model, skip_done=False, page_counter=page_counter, chain_context=chain_context, context_tokens=context_tokens, spend_limits=spend_limits, templates=templates, stage_parts=True)
+    # 워커 스레드의 성능 기록도 이 고객으로 묶이도록
+    call_part = tracer.bind(generate_chapter_part, job=job.trace_id)
+    concurrency = AdaptiveConcurrency(max_workers)
+    workers = max(1, max_workers)
+    completed = job.resumed_parts
+    
+    if progress_callback:
+        progress_callback(completed / job.total_parts, f"GPT 호출 시작... ({completed}/{job.total_parts}, 동시 {workers}개)")
+    
+    def report(ch_idx, label):
+        if progress_callback:
+            progress_callback(completed / job.total_parts, f"'{chapters[ch_idx]}' {label} ({completed}/{job.total_parts}, 동시 {concurrency.limit}개)")
+    
+    # 진행률 콜백과 작업 상태 변경은 Streamlit 스레드(현재 스레드)에서만.
+    # 워커 수만큼만 미리 넣어 두고, 파트를 넣기 직전에 챕터 쪽수를 확인
+    # (챕터의 나머지 본문 파트는 첫 파트 결과가 나온 뒤에 waiting에 들어옴)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        waiting = job.pending_parts()  # (챕터 번호, 파트 번호) 순서
+        
+        while waiting or futures:
+            while waiting and len(futures) < workers:
+                ch_idx, part = waiting.pop(0)
+                if job.should_skip(ch_idx, part):
+                    waiting = sorted(waiting + job.skip_part(ch_idx, part))
+                    completed += 1
+                    report(ch_idx, f"{job.part_label(part)} 건너뜀 (쪽수 충분)")
+                    continue
+                job.in_flight.add((ch_idx, part))
+                
+                sink = StreamingLayout(font_name, line_breaker) if stream else None
+                future = executor.submit(
+                    call_part,
+                    client, model, customer_data,
+                    chapters[ch_idx], part, job.parts_per_chapter,
+                    job.part_target(ch_idx, part), guide, service_type,
+                    rate_limiter, concurrency, max_attempts,
+                    cache, use_cache, stream, sink, job.prefix,
+                    job.context_for(ch_idx, part), job.budget, job.templates
+                )
+                futures[future] = (ch_idx, part, sink)
+            
+            if not futures:
+                continue
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                ch_idx, part, sink = futures.pop(future)
+                try:
+                    content = future.result()
+                except PartGenerationError as e:
+                    waiting = sorted(waiting + job.fail_part(e, ch_idx, part))
+                else:
+                    # 챕터가 쪽수 예산보다 짧게 끝났으면 보충 파트 추가
+                    waiting = sorted(waiting + job.complete_part(ch_idx, part, content, (sink.key, sink.entries) if sink else None))
+                completed += 1
+                report(ch_idx, f"{job.part_label(part)} 완료")
+    
+    if job.failures:
+        raise ContentGenerationError(job.failures)
+    
+    job.budget.finish()
+    return job.chapters_content()
+
+# ============================================
+# 배치 스케줄러 (여러 고객 동시 처리 + 전역 호출 한도)
+# ============================================
+
+class RateLimiter:
+    """분당 요청 수(RPM)와 분당 토큰 수(TPM)를 함께 지키는 토큰 버킷"""
+    
+    def __init__(self, rpm, tpm):
+        self.lock = threading.Lock()
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_allowance = float(rpm)
+        self.token_allowance = float(tpm)
+        self.last_refill = time.monotonic()
+    
+    def update_limits(self, rpm, tpm):
+        with self.lock:
+            self.rpm = rpm
+            self.tpm = tpm
+            self.request_allowance = min(self.request_allowance, rpm)
+            self.token_allowance = min(self.token_allowance, tpm)
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        self.request_allowance = min(self.rpm, self.request_allowance + elapsed * self.rpm / 60)
+        self.token_allowance = min(self.tpm, self.token_allowance + elapsed * self.tpm / 60)
+    
+    def acquire(self, tokens):
+        """요청 1건 + tokens 토큰을 쓸 수 있을 때까지 대기"""
+        while True:
+            with self.lock:
+                self._refill()
+                # 한 번에 TPM보다 큰 요청은 버킷이 가득 찼을 때 통과시킴
+                needed = min(tokens, self.tpm)
+                if self.request_allowance >= 1 and self.token_allowance >= needed:
+                    self.request_allowance -= 1
+                    self.token_allowance -= needed
+                    return
+                wait = max(
+                    (1 - self.request_allowance) * 60 / self.rpm,
+                    (needed - self.token_allowance) * 60 / self.tpm
+                )
+            time.sleep(min(max(wait, 0.01), 1.0))
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(model, rate_limits=None):
+    """모델별 전역 RateLimiter (같은 프로세스의 모든 고객/스레드가 공유)"""
+    limits = (rate_limits or {}).get(model) or MODEL_RATE_LIMITS.get(model) or MODEL_RATE_LIMITS["gpt-4o-mini"]
+    rpm = max(1, int(limits.get("rpm", 500)))
+    tpm = max(1, int(limits.get("tpm", 30000)))
+    
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(model)
+        if limiter is None:
+            limiter = RateLimiter(rpm, tpm)
+            _rate_limiters[model] = limiter
+        elif (limiter.rpm, limiter.tpm) != (rpm, tpm):
+            limiter.update_limits(rpm, tpm)
+        return limiter
+
+class CustomerJob:
+    """고객 1명의 파트 계획과 결과 (배치 스케줄러 / generate_full_content 공용)
+    
+    파트 번호가 parts_per_chapter보다 크면 분량이 모자란 챕터의 보충 파트.
+    page_counter가 있으면 분량을 실제 PDF 쪽수로 판단: 챕터가 쪽수 예산을
+    채우면 남은 중간 파트는 건너뛰고(마지막 파트는 마무리라 항상 생성),
+    모자라면 부족한 쪽수만큼 보충 파트를 추가.
+    stage_parts=True면 챕터의 첫 파트가 끝나 쪽수를 안 뒤에 나머지 본문 파트를
+    내보냄 (전부 한꺼번에 보내면 건너뛸지 판단할 쪽수가 없으므로).
+    chain_context=True면 챕터 안의 파트를 순서대로 하나씩 호출하면서 앞 내용
+    요약(context_tokens 이내)을 넘김. 챕터끼리는 그대로 동시에 진행.
+    지출 한도에 걸리면 남은 파트는 호출 없이 바로 실패 처리됨
+    """
+    
+    def __init__(self, key, name, customer_data, chapters, total_pages, guide, service_type, journal=None, model=None, skip_done=True, page_counter=None, chain_context=False, context_tokens=CONTEXT_SUMMARY_TOKENS, spend_limits=None, templates=None, stage_parts=False):
+        self.key = key
+        self.model = model
+        self.page_counter = page_counter
+        self.page_budgets = chapter_page_budgets(len(chapters), total_pages)
+        self._entries = {}
+        self.name = name
+        self.customer_data = customer_data
+        self.chapters = chapters
+        self.total_pages = total_pages
+        self.guide = guide
+        self.service_type = service_type
+        # 모든 파트 호출이 공유하는 프롬프트 앞부분 (고객 정보 포함, 1번만 만듦)
+        self.prefix = PromptPrefix(customer_data, guide, service_type)
+        self.chain_context = chain_context
+        self.context_tokens = context_tokens
+        # 쪽수로 판단할 수 있을 때만 단계적으로 (이어 쓰기 모드는 원래 한 파트씩)
+        self.stage_parts = stage_parts and page_counter is not None and not chain_context
+        # 템플릿 챕터 설정 (ChapterTemplates, 없으면 모든 챕터를 고객별로 생성)
+        self.templates = templates
+        
+        self.parts_per_chapter, self.chars_per_call = plan_chapter_parts(chapters, total_pages)
+        self.target_chars = chapter_target_chars(chapters, total_pages)
+        self.total_parts = len(chapters) * self.parts_per_chapter
+        self.results = [[None] * self.parts_per_chapter for _ in chapters]
+        self.layouts = [[None] * self.parts_per_chapter for _ in chapters]
+        self.part_targets = [[self.chars_per_call] * self.parts_per_chapter for _ in chapters]
+        self.topups = [0] * len(chapters)
+        self.skipped_parts = 0
+        self.remaining = self.total_parts
+        # 이 고객의 결과/계획을 바꿀 때 잡는 잠금 (BatchScheduler 워커 스레드끼리)
+        self.lock = threading.Lock()
+        self.failures = []
+        self.failed_parts = set()
+        # 호출 중인 (챕터, 파트) - 쪽수로 건너뛸지 볼 때 곧 나올 분량으로 셈
+        self.in_flight = set()
+        
+        self.done = threading.Event()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.status = "대기"
+        self.message = ""
+        
+        # 저널에 남은 파트 복원 (이전 실행이 중단된 경우)
+        self.journal = journal
+        # 성능 기록에서 이 고객의 span을 묶는 값
+        self.trace_id = journal.job_id if journal else uuid.uuid4().hex[:16]
+        # 사용량 장부 기록 + 지출 한도 (spend_limits: {"job": USD, "daily": USD})
+        self.budget = SpendBudget(self.trace_id, name, model, total_pages, spend_limits)
+        self.skipped = False
+        self.resumed_parts = 0
+        if journal:
+            if skip_done and journal.is_done():
+                self.skipped = True
+            else:
+                for (ch_idx, part), content in sorted(journal.completed_parts().items()):
+                    if ch_idx >= len(chapters) or part > self.parts_per_chapter + MAX_TOPUP_PARTS:
+                        continue
+                    while len(self.results[ch_idx]) < part:
+                        self._add_part(ch_idx, self.chars_per_call)
+                    if self.results[ch_idx][part - 1] is None:
+                        self.results[ch_idx][part - 1] = content
+                        self.resumed_parts += 1
+                        self.remaining -= 1
+                
+                # 이전 실행에서 챕터는 끝났지만 보충 파트를 못 붙인 경우
+                for ch_idx in range(len(chapters)):
+                    self._plan_topups(ch_idx)
+    
+    def _add_part(self, ch_idx, target_chars):
+        self.results[ch_idx].append(None)
+        self.layouts[ch_idx].append(None)
+        self.part_targets[ch_idx].append(target_chars)
+        if len(self.results[ch_idx]) > self.parts_per_chapter:
+            self.topups[ch_idx] += 1
+        self.total_parts += 1
+        self.remaining += 1
+        return len(self.results[ch_idx])
+    
+    def part_entries(self, ch_idx, part, content, layout=None):
+        """파트 1개의 쪽수 계산용 문단 레이아웃 (page_counter 없으면 None)
+        
+        잠금 없이 불러도 됨: BatchScheduler는 잠그기 전에 만들어 complete_part에 넘김
+        """
+        if self.page_counter is None or not content:
+            return None
+        if layout and layout[0] == self.page_counter.key:
+            return layout[1]
+        with tracer.span("layout", job=self.trace_id, chapter=self.chapters[ch_idx], part=part, chars=len(content)):
+            return self.page_counter.layout(content)
+    
+    def chapter_fill(self, ch_idx):
+        """지금까지 끝난 파트만으로 (쪽수, 채운 분량) - page_counter 필요"""
+        entries = []
+        for i, content in enumerate(self.results[ch_idx]):
+            if not content:
+                continue
+            part_entries = self._entries.get((ch_idx, i))
+            if part_entries is None:
+                part_entries = self.part_entries(ch_idx, i + 1, content, self.layouts[ch_idx][i])
+                self._entries[(ch_idx, i)] = part_entries
+            if entries:
+                entries.append(("blank", []))
+            entries.extend(part_entries)
+        return count_chapter_pages(entries)
+    
+    def should_skip(self, ch_idx, part):
+        """이미 쪽수 예산을 채운(호출 중인 파트까지 치면 채울) 챕터의 남은 중간 파트인지"""
+        if self.page_counter is None or part >= self.parts_per_chapter:
+            return False
+        pages, fill = self.chapter_fill(ch_idx)
+        if pages >= self.page_budgets[ch_idx]:
+            return True
+        # 호출 중인 파트와 아직 안 끝난 마지막 파트(마무리라 항상 생성)도
+        # 지금까지 끝난 파트의 평균 쪽수만큼 나온다고 봄
+        finished = sum(1 for content in self.results[ch_idx] if content)
+        running = sum(1 for running_ch, _ in self.in_flight if running_ch == ch_idx)
+        last = (ch_idx, self.parts_per_chapter)
+        if self.results[ch_idx][self.parts_per_chapter - 1] is None and last not in self.in_flight and last not in self.failed_parts:
+            running += 1
+        if not finished or not running:
+            return False
+        return fill + fill / finished * running >= self.page_budgets[ch_idx]
+    
+    def _plan_topups(self, ch_idx):
+        """챕터가 다 끝났는데 목표보다 짧으면 보충 파트 추가 → [(챕터, 파트)]"""
+        parts = self.results[ch_idx]
+        if any(content is None for content in parts):
+            return []
+        actual = sum(len(content) for content in parts if content)
+        target = self.target_chars
+        
+        if self.page_counter is not None and actual:
+            # 실제 쪽수 기준: 예산보다 모자라면 마지막 쪽을 70%쯤 채울 만큼의 글자 수를 목표로
+            budget = self.page_budgets[ch_idx]
+            pages, fill = self.chapter_fill(ch_idx)
+            if pages >= budget or budget - pages <= budget * TOPUP_TOLERANCE:
+                return []
+            target = int(actual * (budget - 0.3) / max(fill, 0.1))
+        
+        return [
+            (ch_idx, self._add_part(ch_idx, chars))
+            for chars in plan_topup_parts(actual, target, self.chars_per_call, self.topups[ch_idx], output_yield.ratio(self.model))
+        ]
+    
+    def part_target(self, ch_idx, part):
+        return self.part_targets[ch_idx][part - 1]
+    
+    def part_label(self, part):
+        if part > self.parts_per_chapter:
+            return f"보충 {part - self.parts_per_chapter}"
+        return f"파트 {part}/{self.parts_per_chapter}"
+    
+    def complete_part(self, ch_idx, part, content, layout=None, entries=None, record=True):
+        """파트 결과 저장 (+ 저널 기록). 새로 필요한 보충 파트 [(챕터, 파트)] 반환
+        
+        entries: 미리 만든 part_entries 결과. record=False면 호출한 쪽이 이미 저널에 기록함
+        """
+        self.in_flight.discard((ch_idx, part))
+        self.results[ch_idx][part - 1] = content
+        self.layouts[ch_idx][part - 1] = layout
+        if entries is not None:
+            self._entries[(ch_idx, part - 1)] = entries
+        if self.journal and record:
+            self.journal.record_part(ch_idx, part, content)
+        self.remaining -= 1
+        topups = self._plan_topups(ch_idx)
+        if self.chain_context:
+            return self._next_chained(ch_idx)
+        return self._released_parts(ch_idx, part) + topups
+    
+    def skip_part(self, ch_idx, part, record=True):
+        """쪽수 예산을 채워서 호출하지 않는 파트 (빈 결과로 기록해서 이어받기 때도 건너뜀)"""
+        self.skipped_parts += 1
+        return self.complete_part(ch_idx, part, "", record=record)
+    
+    def fail_part(self, failure, ch_idx=None, part=None):
+        """실패 기록. 이어 쓰기/단계 모드면 그 챕터의 다음 파트 [(챕터, 파트)] 반환"""
+        self.failures.append(failure)
+        self.remaining -= 1
+        if ch_idx is None:
+            return []
+        self.in_flight.discard((ch_idx, part))
+        self.failed_parts.add((ch_idx, part))
+        if self.chain_context:
+            return self._next_chained(ch_idx)
+        return self._released_parts(ch_idx, part)
+    
+    def _held(self, ch_idx, part):
+        """단계 모드에서 첫 파트를 기다리는 본문 파트인지"""
+        if not self.stage_parts or part == 1 or part > self.parts_per_chapter:
+            return False
+        return self.results[ch_idx][0] is None and (ch_idx, 1) not in self.failed_parts
+    
+    def _released_parts(self, ch_idx, part):
+        """단계 모드에서 첫 파트가 끝나면 그 챕터의 나머지 본문 파트"""
+        if not self.stage_parts or part != 1:
+            return []
+        return [
+            (ch_idx, next_part)
+            for next_part in range(2, self.parts_per_chapter + 1)
+            if self.results[ch_idx][next_part - 1] is None
+        ]
+    
+    def _next_chained(self, ch_idx):
+        """챕터에서 아직 시작하지 않은 첫 파트 (앞 파트가 모두 끝난 뒤에만 호출)"""
+        for part in range(1, len(self.results[ch_idx]) + 1):
+            if self.results[ch_idx][part - 1] is None and (ch_idx, part) not in self.failed_parts:
+                return [(ch_idx, part)]
+        return []
+    
+    def context_for(self, ch_idx, part):
+        """이어 쓰기 모드에서 이 파트에 넘길 앞 내용 요약 (아니면 빈 문자열)"""
+        if not self.chain_context:
+            return ""
+        with tracer.span("prompt", job=self.trace_id, chapter=self.chapters[ch_idx], part=part, kind="context"):
+            return build_context_summary(self.chapters, self.results, ch_idx, part, self.context_tokens, self.model)
+    
+    def page_report(self):
+        """완성된 챕터들의 실제 PDF 쪽수 (page_counter 없으면 None)"""
+        if self.page_counter is None:
+            return None
+        return self.page_counter.document_pages(self.chapters_content())
+    
+    def pending_parts(self):
+        if self.chain_context:
+            return [item for ch_idx in range(len(self.chapters)) for item in self._next_chained(ch_idx)]
+        return [
+            (ch_idx, part)
+            for ch_idx in range(len(self.chapters))
+            for part in range(1, len(self.results[ch_idx]) + 1)
+            if self.results[ch_idx][part - 1] is None and not self._held(ch_idx, part)
+        ]
+    
+    def chapters_content(self):
+        return assemble_chapters(self.chapters, self.results, self.layouts)
+    
+    def elapsed(self):
+        if not self.started_at:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+class BatchScheduler:
+    """여러 고객의 파트를 하나의 작업 큐 + 공유 워커 풀로 처리
+    
+    - 큐는 (고객 순번, 챕터, 파트) 순서라 먼저 들어온 고객이 먼저 끝나고,
+      느린 고객의 남은 파트를 기다리는 동안 다음 고객 파트가 진행됨
+    - 모든 호출은 모델별 전역 RateLimiter를 거침
+    - 일시적 오류는 재시도, 429가 나면 동시 호출 수를 줄였다가 다시 늘림
+    - 고객별 완료 시 job.done 이벤트 + 완료 큐로 알림
+    - stream=True면 파트를 토큰 단위로 받으면서 문단 줄바꿈을 미리 하고,
+      live_preview()로 지금 생성 중인 글을 보여줄 수 있음
+    - 챕터의 나머지 본문 파트는 첫 파트가 끝나 쪽수를 안 뒤에 큐에 들어감
+      (분량이 넘치는 모델이면 나머지 중간 파트를 건너뛰도록)
+    - chain_context=True면 챕터 안 파트는 앞 파트가 끝나야 큐에 들어감
+      (앞 내용 요약을 넘기기 위해). 그동안 다른 챕터/고객 파트가 워커를 채움
+    """
+    
+    def __init__(self, client, model, max_workers, rate_limiter=None, max_attempts=RETRY_MAX_ATTEMPTS, cache=None, use_cache=True, stream=False, chain_context=False, context_tokens=CONTEXT_SUMMARY_TOKENS, spend_limits=None, templates=None):
+        self.client = client
+        self.model = model
+        self.max_workers = max(1, max_workers)
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts
+        self.cache = cache
+        self.use_cache = use_cache
+        self.stream = stream
+        self.chain_context = chain_context
+        self.context_tokens = context_tokens
+        self.spend_limits = spend_limits
+        self.templates = templates
+        # 생성 중인 파트 → (고객 작업, StreamingLayout)
+        self.active_streams = {}
+        # 폰트/줄바꿈 자산은 워커 스레드가 아닌 여기서 한 번만 가져옴
+        self.layout_font = get_assets().font_name()
+        self.line_breaker = get_assets().line_breaker(self.layout_font)
+        self.page_counter = PageCounter(self.layout_font, self.line_breaker)
+        # 워커 스레드 수는 상한, 실제 동시 호출 수는 429 여부에 따라 자동 조절
+        self.concurrency = AdaptiveConcurrency(self.max_workers)
+        # 이 배치에서의 프롬프트 캐시 적중률 계산 기준
+        self.cache_stats_start = prompt_cache_stats.snapshot()
+        
+        self.jobs = []
+        self.task_queue = queue.PriorityQueue()
+        self.completed_queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.total_parts = 0
+        self.completed_parts = 0
+        self.threads = []
+        self.stopped = False
+        self.worker_error = None  # 워커 스레드를 멈춘 오류 (있으면 iter_completed가 알림)
+    
+    def submit_customer(self, key, name, customer_data, chapters, total_pages, guide, service_type, journal=None):
+        job = CustomerJob(
+            key, name, customer_data, chapters, total_pages, guide, service_type, journal, self.model,
+            page_counter=self.page_counter, chain_context=self.chain_context, context_tokens=self.context_tokens,
+            spend_limits=self.spend_limits, templates=self.templates, stage_parts=True
+        )
+        
+        with self.lock:
+            seq = len(self.jobs)
+            self.jobs.append(job)
+            
+            if job.skipped:
+                # 이미 PDF까지 끝난 고객은 큐에 넣지 않음
+                job.status = "건너뜀"
+                job.message = "이전 실행에서 완료됨"
+            else:
+                self.total_parts += job.total_parts
+                self.completed_parts += job.resumed_parts
+                if job.journal:
+                    job.journal.start(name=name, service_type=service_type, total_pages=total_pages, total_parts=job.total_parts)
+        
+        if job.skipped or job.remaining == 0:
+            if not job.skipped:
+                job.started_at = job.finished_at = time.time()
+                job.status = "생성 완료"
+            job.done.set()
+            self.completed_queue.put(job)
+            return job
+        
+        for ch_idx, part in job.pending_parts():
+            self.task_queue.put((seq, ch_idx, part))
+        
+        return job
+    
+    def start(self):
+        for _ in range(self.max_workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def stop(self):
+        self.stopped = True
+        for _ in self.threads:
+            self.task_queue.put((float("inf"), 0, 0))
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+    
+    def _worker(self):
+        try:
+            while True:
+                seq, ch_idx, part = self.task_queue.get()
+                if self.stopped or seq == float("inf"):
+                    return
+                
+                job = self.jobs[seq]
+                tracer.set_context(job=job.trace_id, customer=job.name)
+                try:
+                    outcome = self._run_part(job, seq, ch_idx, part)
+                except Exception as e:
+                    # 쪽수 확인/요약/레이아웃 등 호출 밖의 오류도 이 파트의 실패로 (스레드는 계속)
+                    outcome = (False, None, None, None, PartGenerationError(job.chapters[ch_idx], part, e, 1))
+                self._settle_part(job, seq, ch_idx, part, *outcome)
+        except BaseException as e:
+            # 여기까지 오면 스레드가 멈춤 → iter_completed가 기다리지 않고 알림
+            self.worker_error = e
+            raise
+    
+    def _run_part(self, job, seq, ch_idx, part):
+        """파트 1개 생성 + 레이아웃 + 저널 기록 → (건너뜀, 내용, 스트리밍 레이아웃, 문단 레이아웃, 실패)"""
+        # 고객 상태는 고객별 잠금으로 (쪽수 확인/요약이 다른 고객의 파트를 막지 않도록)
+        with job.lock:
+            if job.started_at is None:
+                job.started_at = time.time()
+                job.status = "생성 중"
+            # 앞 파트들로 이미 쪽수 예산을 채운 챕터면 호출하지 않음
+            skip = job.should_skip(ch_idx, part)
+            if not skip:
+                job.in_flight.add((ch_idx, part))
+            context = "" if skip else job.context_for(ch_idx, part)
+        
+        content = None
+        failure = None
+        sink = None
+        if not skip:
+            if self.stream:
+                sink = StreamingLayout(self.layout_font, self.line_breaker)
+                with self.lock:
+                    self.active_streams[(seq, ch_idx, part)] = (job, sink)
+            try:
+                content = generate_chapter_part(
+                    self.client, self.model, job.customer_data,
+                    job.chapters[ch_idx], part, job.parts_per_chapter,
+                    job.part_target(ch_idx, part), job.guide, job.service_type,
+                    self.rate_limiter, self.concurrency, self.max_attempts,
+                    self.cache, self.use_cache, self.stream, sink, job.prefix, context, job.budget, job.templates
+                )
+            except PartGenerationError as e:
+                failure = e
+            except Exception as e:
+                failure = PartGenerationError(job.chapters[ch_idx], part, e, 1)
+            finally:
+                if sink:
+                    with self.lock:
+                        self.active_streams.pop((seq, ch_idx, part), None)
+        
+        # 파트 레이아웃(쪽수 계산)과 저널 기록(fsync)은 잠금 밖에서
+        layout = (sink.key, sink.entries) if sink else None
+        entries = None
+        if not skip and not failure:
+            entries = job.part_entries(ch_idx, part, content, layout)
+        if job.journal and not failure:
+            try:
+                job.journal.record_part(ch_idx, part, "" if skip else content)
+            except OSError as e:
+                # 디스크 부족/fsync 실패: 이어받기 기록이 없는 파트는 실패로 (다음 실행에서 다시 생성)
+                failure = PartGenerationError(job.chapters[ch_idx], part, e, 1)
+                skip = False
+        return skip, content, layout, entries, failure
+    
+    def _settle_part(self, job, seq, ch_idx, part, skip, content, layout, entries, failure):
+        """파트 결과를 고객 작업과 진행 카운터에 반영 (오류가 나도 카운터와 완료 알림은 항상 진행)"""
+        with job.lock:
+            planned = job.total_parts
+            remaining = job.remaining
+            try:
+                if skip:
+                    topups = job.skip_part(ch_idx, part, record=False)
+                elif failure:
+                    topups = job.fail_part(failure, ch_idx, part)
+                else:
+                    # 챕터가 쪽수 예산보다 짧게 끝났으면 보충 파트를 같은 우선순위로 큐에 추가
+                    # (이어 쓰기 모드면 같은 챕터의 다음 파트)
+                    topups = job.complete_part(ch_idx, part, content, layout, entries, record=False)
+            except Exception as e:
+                error = PartGenerationError(job.chapters[ch_idx], part, e, 1)
+                if job.remaining == remaining:
+                    topups = job.fail_part(error, ch_idx, part)
+                else:
+                    # 결과는 반영됐고 보충 파트 계획에서 실패
+                    job.failures.append(error)
+                    topups = []
+            added = job.total_parts - planned
+            finished = job.remaining == 0
+            if finished:
+                job.finished_at = time.time()
+                job.status = "생성 실패" if job.failures else "생성 완료"
+        
+        # 스케줄러 전체 잠금은 진행 카운터에만
+        with self.lock:
+            self.total_parts += added
+            self.completed_parts += 1
+        for next_ch, next_part in topups:
+            self.task_queue.put((seq, next_ch, next_part))
+        
+        if finished:
+            try:
+                if not job.failures:
+                    job.budget.finish()
+            except Exception as e:
+                job.message = f"사용량 기록 실패: {e}"
+            job.done.set()
+            self.completed_queue.put(job)
+    
+    def iter_completed(self, progress_callback=None, poll_interval=0.5, yield_idle=False):
+        """완료된 고객 작업을 완료 순서대로 반환 (호출한 스레드에서 진행률 갱신)
+        
+        yield_idle=True면 완료된 작업이 없을 때도 poll_interval마다 None을 반환
+        (기다리는 동안 렌더링 결과 처리 등을 할 수 있도록).
+        워커 스레드가 모두 멈추면 RuntimeError (남은 작업을 끝없이 기다리지 않도록)
+        """
+        yielded = 0
+        while yielded < len(self.jobs):
+            try:
+                job = self.completed_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                job = None
+            
+            if progress_callback:
+                progress = self.completed_parts / self.total_parts if self.total_parts else 1.0
+                running = sum(1 for j in self.jobs if j.status == "생성 중")
+                message = f"파트 {self.completed_parts}/{self.total_parts} 완료 · 고객 {yielded}/{len(self.jobs)} 완료 · {running}명 진행 중 · 동시 {self.concurrency.limit}개 (재시도 {self.concurrency.retries}회)"
+                cache_report = self.prompt_cache_report()
+                if cache_report:
+                    message += f" · {cache_report}"
+                progress_callback(progress, message)
+            
+            if job is not None:
+                yielded += 1
+                yield job
+                continue
+            if self.threads and not any(thread.is_alive() for thread in self.threads):
+                # 워커가 모두 멈추면 남은 파트는 끝나지 않으므로 기다리지 않음
+                raise RuntimeError(f"생성 워커 스레드가 모두 멈춤: {self.worker_error or '알 수 없는 오류'}")
+            if yield_idle:
+                yield None
+    
+    def live_preview(self, max_chars=600):
+        """가장 최근에 토큰이 들어온 파트의 미리보기 (없으면 None)"""
+        with self.lock:
+            streams = list(self.active_streams.items())
+        if not streams:
+            return None
+        
+        (_, ch_idx, part), (job, sink) = max(streams, key=lambda item: item[1][1].updated_at)
+        text = sink.preview(max_chars)
+        if not text:
+            return None
+        return {
+            "고객": job.name,
+            "챕터": job.chapters[ch_idx],
+            "파트": job.part_label(part),
+            "생성 중": len(streams),
+            "text": text
+        }
+    
+    def prompt_cache_report(self):
+        """이 배치의 GPT 호출 중 프롬프트 캐시에 맞은 입력 토큰 비율 (호출 전이면 빈 문자열)"""
+        return prompt_cache_stats.describe(self.cache_stats_start)
+    
+    def failure_rows(self):
+        """실패한 파트 목록 (고객/챕터/파트/오류)"""
+        return [
+            {"고객": job.name, **failure.to_dict()}
+            for job in self.jobs
+            for failure in job.failures
+        ]
+    
+    def summary(self):
+        """배치 종료 후 요약 표 (고객별 한 줄)"""
+        return [
+            {
+                "고객": job.name,
+                "API 호출": job.total_parts - job.resumed_parts - job.skipped_parts,
+                "이어받은 파트": job.resumed_parts,
+                "건너뛴 파트": job.skipped_parts,
+                "실패 파트": len(job.failures),
+                "쪽수 (목표)": self.page_label(job),
+                "대기 (초)": round((job.started_at or job.submitted_at) - job.submitted_at, 1),
+                "생성 시간 (초)": round(job.elapsed(), 1),
+                "상태": job.status,
+                "메시지": job.message
+            }
+            for job in self.jobs
+        ]
+    
+    @staticmethod
+    def page_label(job):
+        """생성이 끝난 고객의 실제 PDF 쪽수 / 선택한 페이지 수"""
+        if job.skipped or job.failures or job.remaining:
+            return ""
+        report = job.page_report()
+        return f"{report['합계']} ({job.total_pages})" if report else ""
+
+# ============================================
+# 레이아웃 엔진 (줄바꿈)
+# ============================================
+
+class LineBreaker:
+    """폰트의 글자별 폭을 한 번만 읽어 두고, 문단마다 누적 폭(prefix sum)을
+    만든 뒤 이진 탐색으로 줄바꿈 위치를 찾음
+    
+    기존 방식(한 글자씩 줄이며 stringWidth 재계산, 문단당 O(n²))과
+    같은 줄을 만들어 냄: 폭에 맞는 가장 긴 길이를 찾고, 10자를 넘으면
+    뒤쪽 절반 안의 공백/쉼표/마침표에서 자름
+    """
+    
+    def __init__(self, font_name):
+        self.font_name = font_name
+        font = pdfmetrics.getFont(font_name)
+        face = getattr(font, "face", None)
+        
+        # TTF는 글자별 폭 표(1000 단위)를 그대로 사용
+        if face is not None and hasattr(face, "charWidths"):
+            self.char_widths = face.charWidths
+            self.default_width = face.defaultWidth
+        else:
+            self.char_widths = None
+            self.default_width = None
+    
+    def prefix_widths(self, text):
+        """prefix[k] = text[:k]의 폭 (1000 단위 합)"""
+        get_width = self.char_widths.get
+        default_width = self.default_width
+        return list(accumulate((get_width(ord(ch), default_width) for ch in text), initial=0))
+    
+    def break_lines(self, text, font_size, max_width):
+        """text(앞뒤 공백을 제거한 문단)를 max_width 안에 들어가는 줄 목록으로 나눔"""
+        n = len(text)
+        if n == 0:
+            return []
+        
+        if self.char_widths is not None:
+            prefix = self.prefix_widths(text)
+            scale = 0.001 * font_size
+            
+            def width_of(start, end):
+                return scale * (prefix[end] - prefix[start])
+        else:
+            # TTF가 아닌 대체 폰트(Helvetica 등)는 stringWidth로 측정 (이진 탐색은 동일)
+            def width_of(start, end):
+                return pdfmetrics.stringWidth(text[start:end], self.font_name, font_size)
+        
+        lines = []
+        start = 0
+        while start < n:
+            if width_of(start, n) <= max_width:
+                lines.append(text[start:])
+                break
+            
+            # width_of(start, start + cut) <= max_width 를 만족하는 가장 큰 cut
+            lo, hi = 0, n - start - 1
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if width_of(start, start + mid) <= max_width:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            cut = max(lo, 1)
+            
+            # 단어 중간 자르기 방지 (한글은 글자 단위로)
+            if cut > 10:
+                segment = text[start:start + cut]
+                best_cut = max(segment.rfind(' '), segment.rfind(','), segment.rfind('.'))
+                if best_cut > cut * 0.5:
+                    cut = best_cut + 1
+            
+            lines.append(text[start:start + cut])
+            
+            # 다음 줄 앞의 공백 제거 (기존 words[cut:].strip()과 동일)
+            start += cut
+            while start < n and text[start].isspace():
+                start += 1
+        
+        return lines
+
+def body_layout_params(font_name=None):
+    """본문 줄바꿈 기준 (폰트, 글자 크기, 줄 폭) - PDF 렌더링과 같은 값"""
+    if font_name is None:
+        font_name = get_assets().font_name()
+    width, _ = A4
+    return font_name, PDF_FONT_SIZE, width - 2 * PDF_MARGIN
+
+def layout_paragraph(para, line_breaker, font_size, max_width):
+    """문단 1개를 (종류, 줄 목록)으로. 종류는 blank / subheading / text"""
+    para = para.strip()
+    if not para:
+        return ("blank", [])
+    
+    # 소제목 처리 (**, ##, 숫자. 등으로 시작)
+    if para.startswith('**') or para.startswith('##') or (len(para) < 40 and para[0].isdigit()):
+        para = para.replace('**', '').replace('##', '').strip()
+        return ("subheading", line_breaker.break_lines(para, font_size, max_width))
+    
+    return ("text", line_breaker.break_lines(para, font_size, max_width))
+
+def layout_text(text, line_breaker, font_size, max_width):
+    """챕터 본문 전체를 문단별 (종류, 줄 목록) 리스트로"""
+    return [layout_paragraph(para, line_breaker, font_size, max_width) for para in text.split('\n')]
+
+class StreamingLayout:
+    """스트리밍으로 도착하는 파트 텍스트를 문단이 끝나는 대로 바로 줄바꿈
+    
+    - feed(delta): 토큰 조각 추가. 줄바꿈이 들어오면 완성된 문단을 레이아웃
+    - reset(): 재시도로 처음부터 다시 받을 때 호출
+    - finish(): 마지막 문단까지 레이아웃
+    결과(entries)는 layout_text(text)와 같음. 실시간 미리보기는 preview()
+    """
+    
+    def __init__(self, font_name=None, line_breaker=None):
+        self.key = body_layout_params(font_name)
+        self.line_breaker = line_breaker or get_assets().line_breaker(self.key[0])
+        self.reset()
+    
+    def reset(self):
+        self.chunks = []
+        self.pending = ""
+        self.entries = []
+        self.finished = False
+        self.updated_at = time.time()
+    
+    def feed(self, delta):
+        if not delta:
+            return
+        self.chunks.append(delta)
+        self.updated_at = time.time()
+        if "\n" not in delta:
+            self.pending += delta
+            return
+        
+        paragraphs = (self.pending + delta).split("\n")
+        self.pending = paragraphs.pop()
+        _, font_size, max_width = self.key
+        for para in paragraphs:
+            self.entries.append(layout_paragraph(para, self.line_breaker, font_size, max_width))
+    
+    def finish(self):
+        if not self.finished:
+            _, font_size, max_width = self.key
+            self.entries.append(layout_paragraph(self.pending, self.line_breaker, font_size, max_width))
+            self.pending = ""
+            self.finished = True
+        return self.entries
+    
+    def text(self):
+        return "".join(self.chunks)
+    
+    def preview(self, max_chars=600):
+        """지금까지 받은 텍스트의 끝부분"""
+        return "".join(self.chunks)[-max_chars:]
+    
+    def line_count(self):
+        return sum(len(lines) for _, lines in self.entries)
+
+# ============================================
+# 쪽수 계산 (그리지 않고 레이아웃만)
+# ============================================
+
+def count_toc_pages(chapter_count, page_height=A4[1]):
+    """목차 쪽수 (create_pdf_with_toc 목차 루프와 같은 계산)"""
+    pages = 1
+    toc_y = page_height - 160
+    for _ in range(chapter_count):
+        toc_y -= 28
+        if toc_y < 80:
+            pages += 1
+            toc_y = page_height - 80
+    return pages
+
+def count_chapter_pages(entries, page_height=A4[1]):
+    """챕터 레이아웃 → (쪽수, 채운 분량). 채운 분량은 마지막 쪽 사용 비율까지 더한 실수
+    
+    create_pdf_with_toc 본문 루프와 같은 계산 (그리지는 않음)
+    """
+    top = page_height - PDF_MARGIN_TOP
+    current_y = top - PDF_TITLE_GAP
+    pages = 1
+    
+    for kind, lines in entries:
+        if kind == "blank":
+            current_y -= PDF_BLANK_GAP
+            continue
+        if kind == "subheading":
+            current_y -= PDF_SUBHEADING_GAP[0]
+        for _ in lines:
+            if current_y < PDF_MARGIN_BOTTOM:
+                pages += 1
+                current_y = top
+            current_y -= PDF_LINE_HEIGHT
+        if kind == "subheading":
+            current_y -= PDF_SUBHEADING_GAP[1]
+    
+    used = (top - current_y) / (top - PDF_MARGIN_BOTTOM + PDF_LINE_HEIGHT)
+    return pages, pages - 1 + min(1.0, max(0.0, used))
+
+def chapter_page_budgets(chapter_count, total_pages):
+    """전체 페이지 수에서 표지/목차를 빼고 챕터별로 나눈 쪽수 목록"""
+    body_pages = max(chapter_count, total_pages - 1 - count_toc_pages(chapter_count))
+    base, extra = divmod(body_pages, max(1, chapter_count))
+    return [base + 1 if i < extra else base for i in range(chapter_count)]
+
+class PageCounter:
+    """실제 PDF와 같은 줄바꿈/쪽 나눔으로 쪽수만 계산 (생성 중 분량 판단용)"""
+    
+    def __init__(self, font_name=None, line_breaker=None):
+        self.key = body_layout_params(font_name)
+        self.line_breaker = line_breaker or get_assets().line_breaker(self.key[0])
+    
+    def layout(self, text):
+        _, font_size, max_width = self.key
+        return layout_text(text, self.line_breaker, font_size, max_width)
+    
+    def chapter_entries(self, chapter):
+        """{title, content[, layout]} → 문단 레이아웃 (미리 만든 것이 같은 기준이면 재사용)"""
+        entries = chapter.get('layout')
+        if entries is None or tuple(chapter.get('layout_key') or ()) != self.key:
+            entries = self.layout(chapter['content'])
+        return entries
+    
+    def document_pages(self, chapters_content):
+        """쪽수 보고서: 표지/목차/챕터별/합계"""
+        chapter_pages = [count_chapter_pages(self.chapter_entries(chapter))[0] for chapter in chapters_content]
+        toc_pages = count_toc_pages(len(chapters_content))
+        return {
+            "표지": 1,
+            "목차": toc_pages,
+            "챕터": chapter_pages,
+            "합계": 1 + toc_pages + sum(chapter_pages)
+        }
+
+# ============================================
+# 배경 이미지 (축소 + 재압축)
+# ============================================
+
+def prepare_background_image(path, dpi=BG_IMAGE_DPI, quality=BG_JPEG_QUALITY):
+    """A4를 dpi 해상도로 채우는 크기로 줄이고 JPEG로 재압축
+    
+    파일이 없으면 None, 처리에 실패하면 data=None (원본 파일을 그대로 사용)
+    """
+    if not os.path.exists(path):
+        return None
+    
+    started = time.perf_counter()
+    data = None
+    original_size = processed_size = None
+    try:
+        with Image.open(path) as image:
+            original_size = image.size
+            image = image.convert("RGB")
+            
+            # A4 (8.27 × 11.69 inch) 기준 목표 픽셀 수, 원본보다 크게 늘리지는 않음
+            target_width = round(A4[0] / 72 * dpi)
+            target_height = round(A4[1] / 72 * dpi)
+            scale = min(1.0, target_width / image.width, target_height / image.height)
+            if scale < 1.0:
+                image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+            
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+            data = output.getvalue()
+            processed_size = image.size
+    except Exception:
+        pass
+    
+    original_bytes = os.path.getsize(path)
+    return {
+        "path": path,
+        "data": data,
+        "original_bytes": original_bytes,
+        "processed_bytes": len(data) if data else original_bytes,
+        "original_size": original_size,
+        "processed_size": processed_size or original_size,
+        "dpi": dpi,
+        "quality": quality,
+        "seconds": time.perf_counter() - started
+    }
+
+def background_image_report(dpi=BG_IMAGE_DPI, quality=BG_JPEG_QUALITY):
+    """표지/본문 배경의 원본 대비 처리 결과 (설정 화면 표시용)"""
+    assets = get_assets()
+    rows = []
+    for label, path in [("표지", COVER_IMAGE), ("본문 배경", PAGE_IMAGE)]:
+        prepared = assets.background(path, dpi, quality)
+        if prepared is None or not prepared["original_size"]:
+            continue
+        rows.append({
+            "이미지": label,
+            "원본 해상도": "{}×{}".format(*prepared["original_size"]),
+            "원본 크기 (KB)": round(prepared["original_bytes"] / 1024),
+            "처리 후 해상도": "{}×{}".format(*prepared["processed_size"]),
+            "처리 후 크기 (KB)": round(prepared["processed_bytes"] / 1024),
+            "절감률": f"{(1 - prepared['processed_bytes'] / prepared['original_bytes']) * 100:.0f}%",
+            "처리 시간 (ms)": round(prepared["seconds"] * 1000)
+        })
+    return rows
+
+def draw_background(c, prepared, width, height, **kwargs):
+    """축소된 이미지가 있으면 그것을, 없으면 원본 파일을 그림"""
+    if prepared is None:
+        return
+    try:
+        if prepared["data"]:
+            c.drawImage(ImageReader(io.BytesIO(prepared["data"])), 0, 0, width=width, height=height, **kwargs)
+        else:
+            c.drawImage(prepared["path"], 0, 0, width=width, height=height, **kwargs)
+    except:
+        pass
+
+# ============================================
+# 자산 레지스트리 (폰트 / 글자 폭 / 배경 이미지)
+# ============================================
+
+class AssetRegistry:
+    """폰트 등록, 글자 폭 표, 배경 이미지를 프로세스당 한 번만 읽어 두고
+    모든 PDF에서 재사용. 처음 쓸 때 읽거나(warm_up으로 미리 읽을 수도 있음)
+    자산별 로드 시간과 재사용 횟수를 기록
+    """
+    
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._font_name = None
+        self._line_breakers = {}
+        self._images = {}
+        self._stats = {}
+    
+    def _loaded(self, name, kind, seconds, status):
+        self._stats[name] = {"kind": kind, "status": status, "seconds": seconds, "hits": 0}
+    
+    def _hit(self, name):
+        if name in self._stats:
+            self._stats[name]["hits"] += 1
+    
+    def font_name(self):
+        """본문 폰트 이름 (NanumGothic이 없으면 Helvetica)"""
+        with self.lock:
+            if self._font_name is None:
+                started = time.perf_counter()
+                try:
+                    pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+                    self._font_name = FONT_NAME
+                    status = "로드됨"
+                except Exception:
+                    self._font_name = "Helvetica"
+                    status = f"{FONT_PATH} 없음 → Helvetica"
+                self._loaded(f"폰트 {FONT_NAME}", "폰트", time.perf_counter() - started, status)
+            else:
+                self._hit(f"폰트 {FONT_NAME}")
+            return self._font_name
+    
+    def line_breaker(self, font_name):
+        with self.lock:
+            name = f"글자 폭 {font_name}"
+            breaker = self._line_breakers.get(font_name)
+            if breaker is None:
+                started = time.perf_counter()
+                breaker = LineBreaker(font_name)
+                self._line_breakers[font_name] = breaker
+                self._loaded(name, "글자 폭", time.perf_counter() - started, "로드됨")
+            else:
+                self._hit(name)
+            return breaker
+    
+    def background(self, path, dpi=BG_IMAGE_DPI, quality=BG_JPEG_QUALITY):
+        """축소된 배경 이미지 (파일이 없으면 None - 존재 여부도 한 번만 확인)"""
+        key = (path, dpi, quality)
+        name = f"이미지 {path} ({dpi}dpi, q{quality})"
+        with self.lock:
+            if key not in self._images:
+                prepared = prepare_background_image(path, dpi, quality)
+                self._images[key] = prepared
+                if prepared is None:
+                    status = "파일 없음"
+                elif prepared["data"] is None:
+                    status = "처리 실패 → 원본 사용"
+                else:
+                    status = f"{prepared['original_bytes'] // 1024}KB → {prepared['processed_bytes'] // 1024}KB"
+                self._loaded(name, "배경 이미지", prepared["seconds"] if prepared else 0.0, status)
+            else:
+                self._hit(name)
+            return self._images[key]
+    
+    def warm_up(self, dpi=BG_IMAGE_DPI, quality=BG_JPEG_QUALITY):
+        """폰트/글자 폭/배경 이미지를 미리 모두 읽음"""
+        font_name = self.font_name()
+        self.line_breaker(font_name)
+        self.background(COVER_IMAGE, dpi, quality)
+        self.background(PAGE_IMAGE, dpi, quality)
+        return self
+    
+    def reset(self):
+        """다시 읽기 (이미지 파일 교체 후 등)"""
+        with self.lock:
+            self._font_name = None
+            self._line_breakers = {}
+            self._images = {}
+            self._stats = {}
+    
+    def stats(self):
+        with self.lock:
+            return [
+                {
+                    "자산": name,
+                    "종류": item["kind"],
+                    "상태": item["status"],
+                    "로드 시간 (ms)": round(item["seconds"] * 1000, 1),
+                    "재사용 횟수": item["hits"]
+                }
+                for name, item in self._stats.items()
+            ]
+
+@st.cache_resource(show_spinner=False)
+def get_assets():
+    """프로세스 전역 AssetRegistry (Streamlit 재실행 사이에도 유지)"""
+    return AssetRegistry()
+
+# ============================================
+# PDF 생성 (표지 → 목차 → 본문)
+# ============================================
+
+def create_pdf_with_toc(chapters_content, customer_name, service_type, customer_name2=None, image_dpi=BG_IMAGE_DPI, image_quality=BG_JPEG_QUALITY, output_path=None):
+    """output_path가 있으면 PDF를 그 파일에 바로 쓰고 경로 반환, 없으면 BytesIO 반환"""
+    with tracer.span("render", customer=customer_name, chapters=len(chapters_content)) as span:
+        result, pages = draw_pdf_with_toc(chapters_content, customer_name, service_type, customer_name2, image_dpi, image_quality, output_path)
+        span.set(pages=pages, bytes=os.path.getsize(output_path) if output_path else result.getbuffer().nbytes)
+    return result
+
+def draw_pdf_with_toc(chapters_content, customer_name, service_type, customer_name2=None, image_dpi=BG_IMAGE_DPI, image_quality=BG_JPEG_QUALITY, output_path=None):
+    """표지 → 목차 → 본문을 그려서 (경로 또는 BytesIO, 쪽수) 반환"""
+    buffer = output_path or io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    
+    # 폰트/글자 폭/배경 이미지는 프로세스당 한 번만 로드
+    assets = get_assets()
+    font_name = assets.font_name()
+    
+    # 본문 배경은 폼(XObject) 하나로 등록하고 모든 페이지가 참조
+    page_bg = assets.background(PAGE_IMAGE, image_dpi, image_quality)
+    has_page_bg = page_bg is not None
+    if has_page_bg:
+        c.beginForm("page_bg")
+        draw_background(c, page_bg, width, height)
+        c.endForm()
+    
+    def draw_page_background():
+        if has_page_bg:
+            c.doForm("page_bg")
+    
+    # ============ 1. 표지 ============
+    cover_bg = assets.background(COVER_IMAGE, image_dpi, image_quality)
+    draw_background(c, cover_bg, width, height, preserveAspectRatio=True, mask='auto')
+    
+    c.setFont(font_name, 28)
+    if service_type == "연애" and customer_name2:
+        name_text = f"{customer_name}  ♥  {customer_name2}"
+    else:
+        name_text = f"{customer_name} 님"
+    
+    text_width = c.stringWidth(name_text, font_name, 28)
+    c.drawString((width - text_width) / 2, height * 0.22, name_text)
+    c.showPage()
+    
+    # ============ 2. 목차 ============
+    draw_page_background()
+    
+    c.setFont(font_name, 24)
+    title_text = "목 차"
+    title_width = c.stringWidth(title_text, font_name, 24)
+    c.drawString((width - title_width) / 2, height - 100, title_text)
+    
+    c.setFont(font_name, 13)
+    toc_y = height - 160
+    
+    for i, chapter in enumerate(chapters_content):
+        chapter_title = chapter['title']
+        c.drawString(70, toc_y, chapter_title)
+        toc_y -= 28
+        
+        if toc_y < 80:
+            c.showPage()
+            draw_page_background()
+            toc_y = height - 80
+    
+    c.showPage()
+    
+    # ============ 3. 본문 ============
+    margin_left = PDF_MARGIN
+    margin_right = PDF_MARGIN
+    margin_top = PDF_MARGIN_TOP
+    margin_bottom = PDF_MARGIN_BOTTOM
+    line_height = PDF_LINE_HEIGHT
+    font_size = PDF_FONT_SIZE
+    max_width = width - margin_left - margin_right
+    line_breaker = assets.line_breaker(font_name)
+    layout_key = (font_name, font_size, max_width)
+    layout_started_at = time.time()
+    layout_seconds = 0.0
+    reused_layouts = 0
+    
+    for chapter in chapters_content:
+        # 챕터 시작 - 새 페이지
+        draw_page_background()
+        
+        current_y = height - margin_top
+        
+        # 챕터 제목
+        c.setFont(font_name, 18)
+        c.drawString(margin_left, current_y, chapter['title'])
+        current_y -= PDF_TITLE_GAP
+        
+        # 본문 (스트리밍 단계에서 미리 줄바꿈해 둔 결과가 같은 기준이면 그대로 사용)
+        c.setFont(font_name, font_size)
+        
+        entries = chapter.get('layout')
+        if entries is None or tuple(chapter.get('layout_key') or ()) != layout_key:
+            started = time.perf_counter()
+            entries = layout_text(chapter['content'], line_breaker, font_size, max_width)
+            layout_seconds += time.perf_counter() - started
+        else:
+            reused_layouts += 1
+        
+        for kind, lines in entries:
+            if kind == "blank":
+                current_y -= PDF_BLANK_GAP
+                continue
+            
+            if kind == "subheading":
+                current_y -= PDF_SUBHEADING_GAP[0]
+                c.setFont(font_name, font_size + 1)
+            else:
+                c.setFont(font_name, font_size)
+            
+            for line in lines:
+                if current_y < margin_bottom:
+                    c.showPage()
+                    draw_page_background()
+                    current_y = height - margin_top
+                    c.setFont(font_name, font_size)
+                
+                c.drawString(margin_left, current_y, line)
+                current_y -= line_height
+            
+            if kind == "subheading":
+                current_y -= PDF_SUBHEADING_GAP[1]
+        
+        # 챕터 끝나면 새 페이지
+        c.showPage()
+    
+    # 본문 줄바꿈은 그리기와 번갈아 하므로 챕터마다 잰 시간을 합쳐 한 번에 기록
+    tracer.record("layout", layout_started_at, layout_seconds, customer=customer_name, chapters=len(chapters_content), reused=reused_layouts)
+    
+    pages = c.getPageNumber() - 1
+    c.save()
+    if output_path:
+        return output_path, pages
+    buffer.seek(0)
+    return buffer, pages
+
+# ============================================
+# 병렬 PDF 렌더링 (프로세스 풀)
+# ============================================
+
+def _init_render_worker(image_dpi, image_quality, trace_enabled=True):
+    """렌더링 프로세스 시작 시 폰트/이미지를 미리 로드"""
+    tracer.enabled = trace_enabled
+    get_assets().warm_up(image_dpi, image_quality)
+
+def render_pdf_job(chapters_content, customer_name, service_type, customer_name2=None, image_dpi=BG_IMAGE_DPI, image_quality=BG_JPEG_QUALITY, output_path=None, trace_context=None):
+    """프로세스 풀에서 실행: output_path가 있으면 파일로 저장 후 경로, 없으면 PDF bytes 반환
+    
+    trace_context: 제출한 쪽의 성능 기록 context (같은 작업으로 묶이도록)
+    """
+    with tracer.context(**(trace_context or {})):
+        if output_path:
+            return create_pdf_with_toc(chapters_content, customer_name, service_type, customer_name2, image_dpi, image_quality, output_path)
+        return create_pdf_with_toc(chapters_content, customer_name, service_type, customer_name2, image_dpi, image_quality).getvalue()
+
+class PdfRenderPool:
+    """ReportLab 렌더링(CPU 작업, GIL 점유)을 별도 프로세스에서 실행
+    
+    - 워커 프로세스는 시작할 때 폰트/배경 이미지를 미리 로드
+    - Streamlit에서는 이 파일이 __main__으로 실행되므로, 자식 프로세스가
+      찾을 수 있도록 모듈 이름(app)으로 다시 import한 함수를 넘김
+    - 생성 스레드가 돌고 있으므로 fork 대신 spawn 사용
+    """
+    
+    def __init__(self, processes, image_dpi=BG_IMAGE_DPI, image_quality=BG_JPEG_QUALITY):
+        self.image_dpi = image_dpi
+        self.image_quality = image_quality
+        self.module = importlib.import_module(os.path.splitext(os.path.basename(__file__))[0])
+        self.executor = ProcessPoolExecutor(
+            max_workers=max(1, processes),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self.module._init_render_worker,
+            initargs=(image_dpi, image_quality, tracer.enabled)
+        )
+    
+    def submit(self, chapters_content, customer_name, service_type, customer_name2=None, output_path=None):
+        """Future 반환 (결과: PDF bytes 또는 output_path)"""
+        return self.executor.submit(
+            self.module.render_pdf_job,
+            chapters_content, customer_name, service_type, customer_name2,
+            self.image_dpi, self.image_quality, output_path, tracer.current_context()
+        )
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+# ============================================
+# 백그라운드 워커 (python app.py worker)
+# ============================================
+
+class JobQueue:
+    """SQLite 기반 작업 큐 (UI는 등록/조회만, 생성은 워커 프로세스가 담당)
+    
+    status: queued → running → done / failed
+    여러 워커 프로세스가 동시에 claim해도 한 작업은 한 워커만 가져감.
+    진행/완료/실패 기록은 작업을 가져간 워커(worker 컬럼)일 때만 반영되고 성공 여부를 돌려줌
+    → 멈춘 것으로 보여 다른 워커가 이어받은 뒤에는 이전 워커의 기록이 덮어쓰지 않음
+    """
+    
+    def __init__(self, path=QUEUE_FILE):
+        ensure_data_dir()
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch_id TEXT,
+                customer_name TEXT,
+                payload TEXT,
+                status TEXT DEFAULT 'queued',
+                progress REAL DEFAULT 0,
+                message TEXT DEFAULT '',
+                pdf_path TEXT,
+                worker TEXT,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+    
+    def submit(self, batch_id, customer_name, payload):
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (batch_id, customer_name, payload, created_at) VALUES (?, ?, ?, ?)",
+                (batch_id, customer_name, json.dumps(payload, ensure_ascii=False, default=str), time.time())
+            )
+            return cursor.lastrowid
+    
+    def claim(self, worker_id, stale_seconds=WORKER_STALE_SECONDS):
+        """대기 중인 작업 1건을 가져옴 (없으면 None)"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 진행 보고가 끊긴 작업(워커 종료)은 다시 대기 상태로
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker = NULL, message = '다른 워커가 이어서 처리' WHERE status = 'running' AND heartbeat < ?",
+                    (now - stale_seconds,)
+                )
+                row = self.conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat = ? WHERE id = ?",
+                        (worker_id, now, now, row["id"])
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+    
+    def heartbeat(self, job_id, worker_id):
+        """작업 중임을 알림 (False: 이미 다른 워커가 이어받았거나 끝난 작업)"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time(), job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+    
+    def update_progress(self, job_id, worker_id, progress, message):
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET progress = ?, message = ?, heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (progress, message, time.time(), job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+    
+    def finish(self, job_id, worker_id, pdf_path, message):
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'done', progress = 1, pdf_path = ?, message = ?, finished_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (pdf_path, message, time.time(), job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+    
+    def fail(self, job_id, worker_id, message):
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'failed', message = ?, finished_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (message, time.time(), job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+    
+    def requeue(self, job_id, worker_id, message=""):
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, message = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (message, job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+    
+    def retry_failed(self):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET status = 'queued', progress = 0, message = '' WHERE status = 'failed'")
+    
+    def clear_finished(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed')")
+    
+    def list_jobs(self, limit=500):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, batch_id, customer_name, status, progress, message, pdf_path, worker, created_at, started_at, finished_at FROM jobs ORDER BY id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def counts(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+def get_job_queue():
+    return JobQueue(QUEUE_FILE)
+
+class JobHeartbeat:
+    """작업을 처리하는 동안 별도 스레드에서 주기적으로 heartbeat 갱신
+    
+    진행 보고가 없는 긴 단계(배치 대기, PDF 렌더링, 메일 발송)에서도
+    WORKER_STALE_SECONDS가 지나 다른 워커가 같은 작업을 다시 가져가지 않도록 함
+    """
+    
+    def __init__(self, job_queue, job_id, worker_id, interval=WORKER_HEARTBEAT_SECONDS):
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.lost = False  # 다른 워커가 이어받음 → 이 워커의 결과는 기록되지 않음
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"heartbeat-{job_id}", daemon=True)
+    
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                if not self.job_queue.heartbeat(self.job_id, self.worker_id):
+                    self.lost = True
+                    return
+            except sqlite3.Error:
+                # 잠깐 잠긴 경우 등: 다음 주기에 다시 시도
+                continue
+    
+    def __enter__(self):
+        self.thread.start()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.stop_event.set()
+        self.thread.join()
+        return False
+
+def process_queued_job(payload, settings, progress_callback=None, mailer=None):
+    """큐에 등록된 고객 1명 처리: 생성 → PDF 저장 → 이메일. (PDF 경로, 메시지) 반환
+    
+    이메일은 발송 큐에 넣고 mailer(MailSender)로 바로 발송을 시도.
+    실패한 메일은 발송 큐에 남아 백오프 후 다시 발송됨
+    """
+    model = payload.get("model") or settings.get("model", "gpt-4o-mini")
+    service_type = payload["service_type"]
+    customer_data = payload["customer_data"]
+    chapters = payload["chapters"]
+    guide = payload["guide"]
+    total_pages = payload["total_pages"]
+    
+    client = make_llm_client(settings)
+    journal = JobJournal.for_customer(model, service_type, customer_data, chapters, guide, total_pages)
+    if not payload.get("resume", True):
+        journal.reset()
+    
+    with tracer.context(job=journal.job_id, customer=payload["customer_name"]):
+        chapters_content = generate_full_content(
+            client, model, customer_data,
+            chapters, total_pages,
+            guide, service_type,
+            progress_callback,
+            max_workers=int(settings.get("max_workers", DEFAULT_MAX_WORKERS)),
+            rate_limiter=get_rate_limiter(model, settings.get("rate_limits")),
+            max_attempts=int(settings.get("max_retries", RETRY_MAX_ATTEMPTS)),
+            cache=get_content_cache(settings),
+            use_cache=payload.get("use_cache", True),
+            journal=journal,
+            stream=payload.get("stream", False),
+            chain_context=payload.get("chain_context", False),
+            context_tokens=int(settings.get("context_summary_tokens", CONTEXT_SUMMARY_TOKENS)),
+            spend_limits=spend_limits(settings),
+            templates=chapter_templates(settings, service_type)
+        )
+        
+        return deliver_customer_pdf(payload, settings, chapters_content, journal, progress_callback, mailer)
+
+def deliver_customer_pdf(payload, settings, chapters_content, journal, progress_callback=None, mailer=None):
+    """생성이 끝난 고객 1명: PDF 저장 → 이메일 발송 큐 → 저널 완료 표시. (PDF 경로, 메시지) 반환
+    
+    큐 작업(process_queued_job)과 Batch API 결과 처리가 같이 사용
+    """
+    service_type = payload["service_type"]
+    customer_name = payload["customer_name"]
+    customer_name2 = payload.get("customer_name2")
+    customer_email = payload.get("customer_email")
+    
+    if progress_callback:
+        progress_callback(1.0, "📄 PDF 생성 중...")
+    filename = make_pdf_filename(customer_name, service_type, customer_name2)
+    pdf_path = create_pdf_with_toc(
+        chapters_content, customer_name, service_type, customer_name2,
+        int(settings.get("bg_image_dpi", BG_IMAGE_DPI)),
+        int(settings.get("bg_jpeg_quality", BG_JPEG_QUALITY)),
+        make_output_path(journal.job_id, filename)
+    )
+    
+    pages = PageCounter().document_pages(chapters_content)
+    message = f"PDF 생성 완료 ({pages['합계']}쪽)"
+    email_requested = bool(payload.get("auto_email") and customer_email)
+    delivery = None
+    if email_requested and email_configured(settings):
+        if progress_callback:
+            progress_callback(1.0, "📧 이메일 발송 중...")
+        email_subject, email_body = make_email_content(customer_name, service_type)
+        sender = mailer or MailSender(get_email_outbox(), settings)
+        message_id = sender.outbox.enqueue(
+            customer_name, customer_email, email_subject, email_body,
+            pdf_path, filename, payload.get("batch_id", ""),
+            dedupe_key=f"{journal.job_id}:{customer_email}"
+        )
+        sender.deliver_pending()
+        if mailer is None:
+            sender.close()
+        delivery = sender.outbox.get(message_id)
+        message = describe_delivery(delivery)
+    elif email_requested:
+        message += " · 메일 설정이 없어 발송하지 못함"
+    
+    index_keys = (payload["customer_fingerprint"], payload.get("customer_key", "")) if payload.get("customer_fingerprint") else None
+    record_customer_delivery(journal, delivery, index_keys, customer_name, customer_email, service_type, filename, pdf_path, email_requested)
+    return pdf_path, message
+
+def run_worker(poll_interval=WORKER_POLL_SECONDS):
+    """큐에서 작업을 하나씩 가져와 처리 (여러 프로세스 동시 실행 가능)"""
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    job_queue = get_job_queue()
+    print(f"[worker {worker_id}] 시작 - 큐: {QUEUE_FILE}", flush=True)
+    
+    settings = load_settings()
+    tracer.configure(settings)
+    configure_usage(settings)
+    assets = get_assets().warm_up(
+        int(settings.get("bg_image_dpi", BG_IMAGE_DPI)),
+        int(settings.get("bg_jpeg_quality", BG_JPEG_QUALITY))
+    )
+    for row in assets.stats():
+        print(f"[worker {worker_id}] {row['자산']}: {row['상태']} ({row['로드 시간 (ms)']}ms)", flush=True)
+    
+    # SMTP 연결은 작업 사이에도 유지하고, 쉬는 동안 재시도 차례가 된 메일을 발송
+    mailer = MailSender(get_email_outbox(), settings)
+    last_sweep = 0.0
+    
+    while True:
+        try:
+            job = job_queue.claim(worker_id)
+        except KeyboardInterrupt:
+            break
+        
+        if job is None:
+            try:
+                deliver_due_mail(mailer, worker_id)
+                # 보관 기간이 지난 출력 PDF는 OUTPUT_SWEEP_SECONDS마다 정리
+                if time.time() - last_sweep >= OUTPUT_SWEEP_SECONDS:
+                    last_sweep = time.time()
+                    sweep_due_output(settings, mailer.outbox, worker_id)
+                # Batch API로 제출한 run은 BATCH_POLL_SECONDS마다 확인
+                for run_id, message in poll_batch_runs(settings, worker_id):
+                    print(f"[worker {worker_id}] 배치 {run_id}: {message}", flush=True)
+                time.sleep(poll_interval)
+            except KeyboardInterrupt:
+                break
+            continue
+        
+        job_id = job["id"]
+        print(f"[worker {worker_id}] #{job_id} {job['customer_name']} 시작", flush=True)
+        
+        def update_progress(progress, status):
+            job_queue.update_progress(job_id, worker_id, progress, status)
+        
+        def report(recorded, text):
+            if recorded:
+                print(f"[worker {worker_id}] #{job_id} {text}", flush=True)
+            else:
+                print(f"[worker {worker_id}] #{job_id} 다른 워커가 이어받은 작업 - 결과를 기록하지 않음 ({text})", flush=True)
+        
+        try:
+            with JobHeartbeat(job_queue, job_id, worker_id):
+                # 설정은 작업마다 다시 읽음 (UI에서 바꾼 API 키/한도 반영)
+                settings = load_settings()
+                mailer.configure(settings)
+                tracer.configure(settings)
+                configure_usage(settings)
+                cache_stats_start = prompt_cache_stats.snapshot()
+                pdf_path, message = process_queued_job(job["payload"], settings, update_progress, mailer)
+            report(job_queue.finish(job_id, worker_id, pdf_path, message), f"완료: {pdf_path}")
+            cache_report = prompt_cache_stats.describe(cache_stats_start)
+            if cache_report:
+                print(f"[worker {worker_id}] #{job_id} {cache_report}", flush=True)
+        except KeyboardInterrupt:
+            # 다음 워커가 이어받도록 대기 상태로 되돌림 (완료된 파트는 저널에 남아 있음)
+            job_queue.requeue(job_id, worker_id, "워커 중단 - 대기 중")
+            break
+        except ContentGenerationError as e:
+            report(job_queue.fail(job_id, worker_id, f"{len(e.failures)}개 파트 실패: {e.failures[0]}"), "실패")
+        except Exception as e:
+            report(job_queue.fail(job_id, worker_id, str(e)), f"실패: {e}")
+    
+    mailer.close()
+    print(f"[worker {worker_id}] 종료", flush=True)
+
+def deliver_due_mail(mailer, worker_id):
+    """워커가 쉬는 동안: 재시도 차례가 된 메일 발송, 없으면 쉬고 있는 SMTP 연결 정리"""
+    try:
+        if not mailer.outbox.due_count():
+            mailer.close_if_idle()
+            return
+        if mailer.connection.server is None:
+            mailer.configure(load_settings())
+        result = mailer.deliver_pending()
+    except Exception as e:
+        print(f"[worker {worker_id}] 메일 발송 오류: {e}", flush=True)
+        return
+    print(f"[worker {worker_id}] 메일 발송 {result['sent']}통, 재시도 대기 {result['retry']}통, 실패 {result['failed']}통 {result['stopped']}", flush=True)
+
+def sweep_due_output(settings, outbox, worker_id):
+    """워커가 쉬는 동안: 보관 기간이 지난 출력 PDF 삭제"""
+    try:
+        removed, freed = sweep_output_dir(int(settings.get("output_retention_days", OUTPUT_RETENTION_DAYS)), outbox)
+    except Exception as e:
+        print(f"[worker {worker_id}] 출력 PDF 정리 오류: {e}", flush=True)
+        return
+    if removed:
+        print(f"[worker {worker_id}] 출력 PDF {removed}개 정리 ({freed / 1024 / 1024:.1f} MB)", flush=True)
+
+# ============================================
+# OpenAI Batch API (야간 대량 처리, python app.py batch)
+# ============================================
+
+BATCH_ACTIVE_STATUSES = {"validating", "in_progress", "finalizing", "cancelling"}
+
+class BatchRunStore:
+    """Batch API로 제출한 실행(run) 기록 (SQLite, 앱/워커/CLI가 같이 사용)
+    
+    run 1개 = 한 번에 선택한 고객 전체. 라운드마다 남은 파트를 모아 배치를 제출
+    (본문 → 보충 → 실패분 재요청)하고, 받은 파트는 고객별 JobJournal에 기록.
+    그래서 run에는 고객 payload와 현재 라운드의 배치 id만 둠.
+    status: submitted → done / failed
+    """
+    
+    def __init__(self, path=BATCH_RUNS_FILE):
+        ensure_data_dir()
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_runs (
+                id TEXT PRIMARY KEY,
+                batch_id TEXT,
+                endpoint TEXT,
+                model TEXT,
+                payloads TEXT,
+                status TEXT DEFAULT 'submitted',
+                round INTEGER DEFAULT 0,
+                batch_ids TEXT DEFAULT '[]',
+                requests INTEGER DEFAULT 0,
+                message TEXT DEFAULT '',
+                worker TEXT,
+                lease_until REAL DEFAULT 0,
+                next_check_at REAL DEFAULT 0,
+                created_at REAL,
+                updated_at REAL,
+                finished_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_batch_runs_status ON batch_runs(status, next_check_at)")
+    
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        run = dict(row)
+        run["payloads"] = json.loads(run["payloads"])
+        run["batch_ids"] = json.loads(run["batch_ids"])
+        return run
+    
+    def create(self, run_id, batch_id, endpoint, model, payloads):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO batch_runs (id, batch_id, endpoint, model, payloads, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (run_id, batch_id, endpoint, model, json.dumps(payloads, ensure_ascii=False, default=str), now, now)
+            )
+    
+    def update(self, run_id, **fields):
+        if "batch_ids" in fields:
+            fields["batch_ids"] = json.dumps(fields["batch_ids"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.conn.execute(f"UPDATE batch_runs SET {assignments} WHERE id = ?", (*fields.values(), run_id))
+    
+    def claim(self, worker_id, run_id=None, force=False, exclude=(), lease_seconds=BATCH_LEASE_SECONDS, poll_seconds=BATCH_POLL_SECONDS):
+        """확인할 차례가 된 run 1개를 잡음 (다른 워커가 처리 중이면 건너뜀)
+        
+        force=True면 다음 확인 시각을 기다리지 않음 (UI의 '상태 확인' 버튼).
+        exclude는 이번에 이미 확인한 run id들
+        """
+        now = time.time()
+        conditions = ["status = 'submitted'", "lease_until < ?"]
+        params = [now]
+        if run_id:
+            conditions.append("id = ?")
+            params.append(run_id)
+        if exclude:
+            conditions.append(f"id NOT IN ({', '.join('?' * len(exclude))})")
+            params.extend(exclude)
+        if not force:
+            conditions.append("next_check_at <= ?")
+            params.append(now)
+        
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    f"SELECT * FROM batch_runs WHERE {' AND '.join(conditions)} ORDER BY next_check_at LIMIT 1",
+                    params
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE batch_runs SET worker = ?, lease_until = ?, next_check_at = ? WHERE id = ?",
+                        (worker_id, now + lease_seconds, now + poll_seconds, row["id"])
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self._row(row)
+    
+    def extend_lease(self, run_id, lease_seconds=BATCH_LEASE_SECONDS):
+        with self.lock:
+            self.conn.execute("UPDATE batch_runs SET lease_until = ? WHERE id = ?", (time.time() + lease_seconds, run_id))
+    
+    def release(self, run_id):
+        with self.lock:
+            self.conn.execute("UPDATE batch_runs SET worker = NULL, lease_until = 0 WHERE id = ?", (run_id,))
+    
+    def get(self, run_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM batch_runs WHERE id = ?", (run_id,)).fetchone()
+        return self._row(row)
+    
+    def active_count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM batch_runs WHERE status = 'submitted'").fetchone()[0]
+    
+    def list_runs(self, limit=100):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, batch_id, endpoint, model, payloads, status, round, batch_ids, requests, message, worker, created_at, updated_at, finished_at FROM batch_runs ORDER BY created_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+def get_batch_store():
+    return BatchRunStore(BATCH_RUNS_FILE)
+
+def to_plain(value):
+    """SDK 응답 객체(pydantic) / SimpleNamespace → dict/list (JSON으로 쓸 수 있게)"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, SimpleNamespace):
+        return {key: to_plain(item) for key, item in vars(value).items()}
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    return value
+
+class LocalBatchClient:
+    """Batch API와 같은 모양(files.create / files.content / batches.create / batches.retrieve)의
+    로컬 엔드포인트. 제출하는 즉시 요청을 한 줄씩 chat_client로 처리하고 결과 파일을 남김
+    
+    실제 배치 제출 전 점검이나, 가짜 chat 클라이언트로 배치 흐름 전체를 시험할 때 사용
+    (settings.json의 batch_endpoint = "local")
+    """
+    
+    def __init__(self, chat_client, root=None):
+        self.chat_client = chat_client
+        self.root = root or os.path.join(BATCH_DIR, "local")
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+    
+    def _save_file(self, data):
+        file_id = f"file-local-{uuid.uuid4().hex[:12]}"
+        with open(os.path.join(self.root, file_id), "wb") as f:
+            f.write(data)
+        return file_id
+    
+    def _create_file(self, file, purpose="batch"):
+        data = file.read() if hasattr(file, "read") else file
+        return SimpleNamespace(id=self._save_file(data), purpose=purpose)
+    
+    def _file_content(self, file_id):
+        with open(os.path.join(self.root, file_id), "rb") as f:
+            data = f.read()
+        return SimpleNamespace(content=data, text=data.decode("utf-8"))
+    
+    def _create_batch(self, input_file_id, endpoint, completion_window, metadata=None):
+        outputs = []
+        errors = []
+        for line in self._file_content(input_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            try:
+                response = self.chat_client.chat.completions.create(**request["body"])
+                outputs.append({
+                    "id": f"batch_req_{len(outputs) + len(errors)}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": to_plain(response)},
+                    "error": None
+                })
+            except Exception as e:
+                errors.append({
+                    "id": f"batch_req_{len(outputs) + len(errors)}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": getattr(e, "status_code", 500), "body": {"error": {"message": str(e)}}},
+                    "error": None
+                })
+        
+        def save_lines(records):
+            if not records:
+                return None
+            return self._save_file("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8"))
+        
+        batch = {
+            "id": f"batch-local-{uuid.uuid4().hex[:12]}",
+            "status": "completed",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "output_file_id": save_lines(outputs),
+            "error_file_id": save_lines(errors),
+            "metadata": metadata or {},
+            "request_counts": {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        }
+        with open(os.path.join(self.root, f"{batch['id']}.json"), "w", encoding="utf-8") as f:
+            json.dump(batch, f)
+        return self._retrieve_batch(batch["id"])
+    
+    def _retrieve_batch(self, batch_id):
+        with open(os.path.join(self.root, f"{batch_id}.json"), "r", encoding="utf-8") as f:
+            batch = json.load(f)
+        batch["request_counts"] = SimpleNamespace(**batch["request_counts"])
+        return SimpleNamespace(**batch)
+
+def make_batch_client(settings, endpoint="openai"):
+    """run을 제출/확인할 클라이언트. endpoint="local"이면 설정한 LLM 백엔드로 바로 처리하는 LocalBatchClient"""
+    if endpoint == "local":
+        return LocalBatchClient(make_llm_client(settings))
+    return make_llm_client(settings, max_retries=2)
+
+def batch_jobs(payloads):
+    """run의 고객 payload → [(payload, CustomerJob)]
+    
+    저널에서 이미 받은 파트를 복원하므로, 본문이 다 모인 챕터는 이때 보충 파트가 계획됨
+    """
+    page_counter = PageCounter()
+    jobs = []
+    for payload in payloads:
+        model = payload["model"]
+        journal = JobJournal.for_customer(model, payload["service_type"], payload["customer_data"], payload["chapters"], payload["guide"], payload["total_pages"])
+        job = CustomerJob(
+            journal.job_id, payload["customer_name"], payload["customer_data"],
+            payload["chapters"], payload["total_pages"], payload["guide"], payload["service_type"],
+            journal, model, page_counter=page_counter
+        )
+        jobs.append((payload, job))
+    return jobs
+
+def fill_from_cache(jobs, cache):
+    """남은 파트 중 ContentCache에 있는 것은 배치에 넣지 않고 바로 기록. 채운 파트 수 반환"""
+    filled = 0
+    pending = [(job, ch_idx, part) for _, job in jobs if not job.skipped for ch_idx, part in job.pending_parts()]
+    while pending:
+        next_pending = []
+        for job, ch_idx, part in pending:
+            request = build_part_request(job.model, job.prefix, job.chapters[ch_idx], part, job.parts_per_chapter, job.part_target(ch_idx, part))
+            cached = cache.get(part_cache_key(cache, request))
+            if cached:
+                # 챕터가 다 채워지면 보충 파트가 생길 수 있으므로 그것도 다시 확인
+                next_pending.extend((job, new_ch, new_part) for new_ch, new_part in job.complete_part(ch_idx, part, cached))
+                filled += 1
+        pending = next_pending
+    return filled
+
+def write_batch_files(run_id, round_num, jobs, max_requests=BATCH_MAX_REQUESTS, max_bytes=BATCH_MAX_FILE_MB * 1024 * 1024):
+    """남은 파트를 Batch API 입력 JSONL로 (한도를 넘으면 여러 파일). [(경로, 요청 수)] 반환
+    
+    custom_id = "<저널 job_id>:<챕터 번호>:<파트 번호>" (결과를 고객/챕터/파트로 되돌릴 때 사용)
+    """
+    if not os.path.exists(BATCH_DIR):
+        os.makedirs(BATCH_DIR)
+    
+    files = []
+    f = None
+    size = 0
+    try:
+        for _, job in jobs:
+            if job.skipped:
+                continue
+            for ch_idx, part in job.pending_parts():
+                request = build_part_request(job.model, job.prefix, job.chapters[ch_idx], part, job.parts_per_chapter, job.part_target(ch_idx, part))
+                line = json.dumps({
+                    "custom_id": f"{job.key}:{ch_idx}:{part}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": request
+                }, ensure_ascii=False).encode("utf-8") + b"\n"
+                
+                if f is None or files[-1][1] >= max_requests or size + len(line) > max_bytes:
+                    if f is not None:
+                        f.close()
+                    path = os.path.join(BATCH_DIR, f"{run_id}_r{round_num}_{len(files) + 1}.jsonl")
+                    f = open(path, "wb")
+                    files.append([path, 0])
+                    size = 0
+                f.write(line)
+                size += len(line)
+                files[-1][1] += 1
+    finally:
+        if f is not None:
+            f.close()
+    return [tuple(item) for item in files]
+
+def apply_batch_output(text, jobs_by_key, cache=None, source="batch", price_ratio=BATCH_PRICE_RATIO):
+    """배치 결과(또는 오류) JSONL → 고객별 저널에 파트 기록. (받은 파트, 실패한 요청) 수
+    
+    실패한 요청은 저널에 없으므로 다음 라운드에 다시 제출됨.
+    source / price_ratio는 사용량 장부 기록용 (로컬 엔드포인트는 할인 없음)
+    """
+    received = 0
+    failed = 0
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            key, ch_idx, part = record["custom_id"].rsplit(":", 2)
+            ch_idx, part = int(ch_idx), int(part)
+        except (json.JSONDecodeError, KeyError, ValueError):
+            failed += 1
+            continue
+        
+        job = jobs_by_key.get(key)
+        if job is None or job.skipped or ch_idx >= len(job.chapters) or part > job.parts_per_chapter + MAX_TOPUP_PARTS:
+            continue
+        while len(job.results[ch_idx]) < part:
+            job._add_part(ch_idx, job.chars_per_call)
+        if job.results[ch_idx][part - 1] is not None:
+            # 이전 확인 때 이미 반영한 결과
+            continue
+        
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        choices = body.get("choices") or []
+        content = ""
+        if response.get("status_code") == 200 and not record.get("error") and choices:
+            content = (choices[0].get("message") or {}).get("content") or ""
+        if not content.strip():
+            failed += 1
+            continue
+        
+        target_chars = job.part_target(ch_idx, part)
+        request = build_part_request(job.model, job.prefix, job.chapters[ch_idx], part, job.parts_per_chapter, target_chars)
+        job.complete_part(ch_idx, part, content)
+        prompt_cache_stats.record(job.model, body.get("usage"))
+        get_usage_ledger().record(
+            job.model, body.get("usage"), job.trace_id, job.name, source=source, price_ratio=price_ratio,
+            expected_tokens=(
+                estimate_tokens(request["messages"][0]["content"] + request["messages"][1]["content"], job.model),
+                target_chars * TOKENS_PER_HANGUL.get(job.model, 1.0)
+            )
+        )
+        output_yield.record(job.model, target_chars, len(content))
+        if cache:
+            cache.set(part_cache_key(cache, request), job.model, content)
+        received += 1
+    return received, failed
+
+def submit_batch_round(client, store, run, jobs, settings):
+    """남은 파트를 모아 다음 라운드 배치를 제출. 제출한 요청 수 반환 (0이면 남은 파트 없음)"""
+    fill_from_cache(jobs, get_content_cache(settings))
+    round_num = run["round"] + 1
     
-    try:
-        pdfmetrics.registerFont(TTFont('NanumGothic', '/usr/share/fonts/truetype/nanum/NanumGothic.ttf'))
-        font_name = 'NanumGothic'
-    except:
-        font_name = 'Helvetica'
+    batch_ids = []
+    requests = 0
+    for path, count in write_batch_files(run["id"], round_num, jobs):
+        with open(path, "rb") as f:
+            uploaded = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"run_id": run["id"], "round": str(round_num)}
+        )
+        batch_ids.append(batch.id)
+        requests += count
     
-    # ============ 1. 표지 ============
-    if os.path.exists(COVER_IMAGE):
+    if batch_ids:
+        store.update(
+            run["id"], round=round_num, batch_ids=batch_ids, requests=requests, next_check_at=0,
+            message=f"{round_num}차 배치 {len(batch_ids)}개 제출 ({requests}건)"
+        )
+    return requests
+
+def finish_batch_run(store, run, jobs, settings, mailer=None, progress_callback=None):
+    """모든 라운드가 끝난 run: 파트가 다 모인 고객은 PDF 생성 + 발송, 아니면 실패로 남김"""
+    delivered = 0
+    incomplete = []
+    customers = [(payload, job) for payload, job in jobs if not job.skipped]
+    for index, (payload, job) in enumerate(customers):
+        if progress_callback:
+            progress_callback(index / max(1, len(customers)), f"📄 {job.name} PDF 생성 중... ({index + 1}/{len(customers)})")
+        # 마지막 라운드에서 새로 생긴 보충 파트는 빼고 만듦 (본문 파트가 빠지면 미완료)
+        if any(part <= job.parts_per_chapter for _, part in job.pending_parts()):
+            incomplete.append(job.name)
+            continue
         try:
-            c.drawImage(COVER_IMAGE, 0, 0, width=width, height=height, preserveAspectRatio=True, mask='auto')
-        except:
-            pass
-    
-    c.setFont(font_name, 28)
-    if service_type == "연애" and customer_name2:
-        name_text = f"{customer_name}  ♥  {customer_name2}"
-    else:
-        name_text = f"{customer_name} 님"
+            with tracer.context(job=job.trace_id, customer=job.name):
+                deliver_customer_pdf(payload, settings, job.chapters_content(), job.journal, None, mailer)
+            job.budget.finish()
+        except Exception as e:
+            incomplete.append(f"{job.name}: {e}")
+            continue
+        delivered += 1
+        store.extend_lease(run["id"])
     
-    text_width = c.stringWidth(name_text, font_name, 28)
-    c.drawString((width - text_width) / 2, height * 0.22, name_text)
-    c.showPage()
+    message = f"PDF {delivered}명 완료"
+    if incomplete:
+        # 받은 파트는 저널에 있으므로 '이어서 생성'으로 나머지만 호출하면 됨
+        message += f" · 미완료 {len(incomplete)}명 ({', '.join(incomplete[:5])}) - '이어서 생성'으로 마무리하세요"
+    store.update(run["id"], status="failed" if incomplete else "done", finished_at=time.time(), message=message)
+    return message
+
+def check_batch_spend(payloads, settings):
+    """Batch API는 제출 후 호출마다 멈출 수 없으므로 제출 전에 예상 비용으로 한도 확인
     
-    # ============ 2. 목차 ============
-    if os.path.exists(PAGE_IMAGE):
-        try:
-            c.drawImage(PAGE_IMAGE, 0, 0, width=width, height=height)
-        except:
-            pass
+    고객 1명 예상 비용이 작업당 한도를 넘거나, 전체 예상 비용 + 오늘 사용액이
+    하루 한도를 넘으면 SpendCapExceeded
+    """
+    limits = spend_limits(settings)
+    if not limits["job"] and not limits["daily"]:
+        return
+    prices = price_table(settings)
+    total = 0.0
+    for payload in payloads:
+        estimate = estimate_generation(payload["chapters"], payload["total_pages"], payload["model"], payload["guide"], payload["service_type"], prices=prices)
+        cost = estimate["cost"] * BATCH_PRICE_RATIO
+        if limits["job"] and cost > limits["job"]:
+            raise SpendCapExceeded(f"{payload['customer_name']}: 예상 비용 ${cost:.3f}가 작업당 한도 ${limits['job']:.2f}를 넘음")
+        total += cost
+    if limits["daily"]:
+        today = get_usage_ledger().day_total()
+        if today + total > limits["daily"]:
+            raise SpendCapExceeded(f"예상 비용 ${total:.2f} + 오늘 사용 ${today:.2f}가 하루 한도 ${limits['daily']:.2f}를 넘음")
+
+def submit_batch_run(client, payloads, settings, batch_id, endpoint="openai"):
+    """선택한 고객 전체를 Batch API로 제출하고 run id 반환
     
-    c.setFont(font_name, 24)
-    title_text = "목 차"
-    title_width = c.stringWidth(title_text, font_name, 24)
-    c.drawString((width - title_width) / 2, height - 100, title_text)
+    모든 파트가 이미 저널/캐시에 있으면 제출 없이 바로 PDF까지 만듦.
+    예상 비용이 지출 한도를 넘으면 제출하지 않고 SpendCapExceeded
+    """
+    check_batch_spend(payloads, settings)
+    store = get_batch_store()
+    run_id = f"{batch_id}_{uuid.uuid4().hex[:6]}"
+    store.create(run_id, batch_id, endpoint, payloads[0]["model"] if payloads else "", payloads)
+    run = store.get(run_id)
     
-    c.setFont(font_name, 13)
-    toc_y = height - 160
+    jobs = batch_jobs(payloads)
+    if not submit_batch_round(client, store, run, jobs, settings):
+        finish_batch_run(store, run, jobs, settings)
+    return run_id
+
+def poll_batch_run(client, store, run, settings, mailer=None, progress_callback=None):
+    """run의 현재 라운드 배치 상태 확인. 모두 끝났으면 결과를 저널에 반영하고
+    다음 라운드(보충/실패분)를 제출하거나, 더 없으면 PDF 생성. 상태 메시지 반환
+    """
+    batches = [client.batches.retrieve(batch_id) for batch_id in run["batch_ids"]]
+    active = [batch for batch in batches if batch.status in BATCH_ACTIVE_STATUSES]
+    if active:
+        counts = [getattr(batch, "request_counts", None) for batch in batches]
+        completed = sum(getattr(count, "completed", 0) or 0 for count in counts if count)
+        message = f"{run['round']}차 배치 처리 중 ({completed}/{run['requests']}건)"
+        store.update(run["id"], message=message)
+        return message
     
-    for i, chapter in enumerate(chapters_content):
-        chapter_title = chapter['title']
-        c.drawString(70, toc_y, chapter_title)
-        toc_y -= 28
-        
-        if toc_y < 80:
-            c.showPage()
-            if os.path.exists(PAGE_IMAGE):
-                try:
-                    c.drawImage(PAGE_IMAGE, 0, 0, width=width, height=height)
-                except:
-                    pass
-            toc_y = height - 80
+    jobs = batch_jobs(run["payloads"])
+    jobs_by_key = {job.key: job for _, job in jobs}
+    cache = get_content_cache(settings)
+    # 로컬 엔드포인트는 요청을 바로 chat 클라이언트로 처리하므로 Batch API 할인이 없음
+    if isinstance(client, LocalBatchClient):
+        source, price_ratio = usage_source(client), 1.0
+    else:
+        source, price_ratio = "batch", BATCH_PRICE_RATIO
+    received = 0
+    failed = 0
+    for batch in batches:
+        # 만료/취소된 배치도 끝난 요청의 결과 파일은 남아 있음
+        for file_id in (getattr(batch, "output_file_id", None), getattr(batch, "error_file_id", None)):
+            if file_id:
+                ok, errors = apply_batch_output(client.files.content(file_id).text, jobs_by_key, cache, source, price_ratio)
+                received += ok
+                failed += errors
     
-    c.showPage()
+    if run["round"] < BATCH_MAX_ROUNDS:
+        requests = submit_batch_round(client, store, run, jobs, settings)
+        if requests:
+            return f"{run['round']}차 결과 {received}건 반영 (실패 {failed}건) → {run['round'] + 1}차 배치 {requests}건 제출"
     
-    # ============ 3. 본문 ============
-    margin_left = PDF_MARGIN
-    margin_right = PDF_MARGIN
-    margin_top = 75
-    margin_bottom = 75
-    line_height = PDF_LINE_HEIGHT
-    font_size = PDF_FONT_SIZE
-    max_width = width - margin_left - margin_right
+    return finish_batch_run(store, run, jobs, settings, mailer, progress_callback)
+
+def poll_batch_runs(settings, worker_id, run_id=None, force=False, progress_callback=None):
+    """확인할 차례가 된 run을 하나씩 잡아서 처리. [(run id, 메시지)] 반환
     
-    for chapter in chapters_content:
-        # 챕터 시작 - 새 페이지
-        if os.path.exists(PAGE_IMAGE):
+    워커는 쉬는 동안 부르고(BATCH_POLL_SECONDS마다), UI 버튼은 force=True
+    """
+    store = get_batch_store()
+    handled = []
+    mailer = None
+    try:
+        while True:
+            run = store.claim(worker_id, run_id, force, exclude=[handled_id for handled_id, _ in handled])
+            if run is None:
+                break
             try:
-                c.drawImage(PAGE_IMAGE, 0, 0, width=width, height=height)
-            except:
-                pass
-        
-        current_y = height - margin_top
-        
-        # 챕터 제목
-        c.setFont(font_name, 18)
-        c.drawString(margin_left, current_y, chapter['title'])
-        current_y -= 45
-        
-        # 본문
-        c.setFont(font_name, font_size)
-        
-        content = chapter['content']
-        paragraphs = content.split('\n')
-        
-        for para in paragraphs:
-            para = para.strip()
-            
-            if not para:
-                current_y -= 12
+                if mailer is None:
+                    mailer = MailSender(get_email_outbox(), settings)
+                client = make_batch_client(settings, run["endpoint"])
+                message = poll_batch_run(client, store, run, settings, mailer, progress_callback)
+            except Exception as e:
+                message = f"확인 실패: {e}"
+                store.update(run["id"], message=message)
+            finally:
+                store.release(run["id"])
+            handled.append((run["id"], message))
+            if run_id:
+                break
+    finally:
+        if mailer:
+            mailer.close()
+    return handled
+
+def run_batch_poller(poll_interval=BATCH_POLL_SECONDS):
+    """python app.py batch: 제출한 run이 모두 끝날 때까지 주기적으로 확인 (cron으로 돌려도 됨)"""
+    worker_id = f"batch-{socket.gethostname()}-{os.getpid()}"
+    store = get_batch_store()
+    while True:
+        settings = load_settings()
+        tracer.configure(settings)
+        configure_usage(settings)
+        for run_id, message in poll_batch_runs(settings, worker_id, force=True):
+            print(f"[batch] {run_id}: {message}", flush=True)
+        if not store.active_count():
+            break
+        try:
+            time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            break
+    print("[batch] 확인할 배치 없음 - 종료", flush=True)
+
+# ============================================
+# 고객 명단 읽기 (큰 엑셀/CSV를 조각 단위로)
+# ============================================
+
+def sheet_columns(header):
+    """엑셀 첫 행 → 컬럼 이름 (pd.read_excel처럼 빈 칸은 Unnamed: n, 중복은 이름.1)"""
+    columns = []
+    seen = {}
+    for i, value in enumerate(header):
+        name = f"Unnamed: {i}" if value is None or str(value).strip() == "" else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+def iter_sheet_chunks(data, filename, chunk_rows=SHEET_CHUNK_ROWS):
+    """업로드한 파일 내용(bytes) → chunk_rows행씩 DataFrame
+    
+    CSV는 pandas chunksize, 엑셀은 openpyxl 읽기 전용 모드로 첫 시트를 한 행씩 읽음
+    (통합 문서 전체를 메모리에 올리지 않음). 모든 칸이 빈 행은 건너뜀
+    """
+    if filename.lower().endswith(".csv"):
+        for chunk in pd.read_csv(io.BytesIO(data), chunksize=chunk_rows):
+            yield chunk
+        return
+    
+    import openpyxl
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = sheet_columns(header)
+        buffer = []
+        for row in rows:
+            if all(value is None for value in row):
                 continue
-            
-            # 소제목 처리 (**, ##, 숫자. 등으로 시작)
-            is_subheading = para.startswith('**') or para.startswith('##') or (len(para) < 40 and para[0].isdigit())
-            
-            if is_subheading:
-                current_y -= 10
-                c.setFont(font_name, font_size + 1)
-                para = para.replace('**', '').replace('##', '').strip()
-            else:
-                c.setFont(font_name, font_size)
-            
-            # 텍스트 줄바꿈 처리
-            words = para
-            while words:
-                if current_y < margin_bottom:
-                    c.showPage()
-                    if os.path.exists(PAGE_IMAGE):
-                        try:
-                            c.drawImage(PAGE_IMAGE, 0, 0, width=width, height=height)
-                        except:
-                            pass
-                    current_y = height - margin_top
-                    c.setFont(font_name, font_size)
-                
-                if c.stringWidth(words, font_name, font_size) <= max_width:
-                    c.drawString(margin_left, current_y, words)
-                    current_y -= line_height
-                    break
-                else:
-                    cut = len(words)
-                    while cut > 0 and c.stringWidth(words[:cut], font_name, font_size) > max_width:
-                        cut -= 1
-                    
-                    # 단어 중간 자르기 방지 (한글은 글자 단위로)
-                    if cut > 10:
-                        space = words[:cut].rfind(' ')
-                        comma = words[:cut].rfind(',')
-                        period = words[:cut].rfind('.')
-                        best_cut = max(space, comma, period)
-                        if best_cut > cut * 0.5:
-                            cut = best_cut + 1
-                    
-                    c.drawString(margin_left, current_y, words[:cut])
-                    current_y -= line_height
-                    words = words[cut:].strip()
-            
-            if is_subheading:
-                current_y -= 5
-        
-        # 챕터 끝나면 새 페이지
-        c.showPage()
+            buffer.append(row[:len(columns)])
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=columns)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns)
+    finally:
+        workbook.close()
+
+def sheet_search_text(chunk):
+    """행마다 모든 칸을 공백으로 이은 소문자 문자열 (컬럼 단위로 이어 붙여 행 루프 없음)"""
+    text = pd.Series("", index=chunk.index)
+    for column in chunk.columns:
+        text = text + " " + chunk[column].fillna("").astype(str)
+    return text.str.lower()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_customer_sheet(file_hash, filename, _data):
+    """고객 명단 → (DataFrame, 행별 검색용 소문자 문자열)
     
-    c.save()
-    buffer.seek(0)
-    return buffer
+    파일 해시로 캐시하므로 Streamlit 재실행마다 다시 읽지 않음 (_data는 캐시 키에서 빠짐)
+    """
+    chunks = []
+    search_chunks = []
+    for chunk in iter_sheet_chunks(_data, filename):
+        chunks.append(chunk)
+        search_chunks.append(sheet_search_text(chunk))
+    if not chunks:
+        return pd.DataFrame(), pd.Series(dtype=str)
+    df = pd.concat(chunks, ignore_index=True)
+    search_text = pd.concat(search_chunks, ignore_index=True)
+    return df, search_text
+
+def search_customer_rows(search_text, query):
+    """검색어가 들어 있는 행 번호 목록 (모든 컬럼, 대소문자 무시). 검색어가 없으면 전체"""
+    query = query.strip().lower()
+    if not query:
+        return search_text.index.tolist()
+    return search_text.index[search_text.str.contains(query, regex=False)].tolist()
 
 # ============================================
 # 로그인 화면
@@ -543,11 +5372,13 @@ def show_main_app():
     
     if 'settings' not in st.session_state:
         st.session_state.settings = load_settings()
+    tracer.configure(st.session_state.settings)
+    configure_usage(st.session_state.settings)
     
     if "guides" not in st.session_state.settings:
         st.session_state.settings["guides"] = get_default_guides()
     
-    tab1, tab2, tab3 = st.tabs(["📝 지침서 관리", "📄 PDF 생성", "⚙️ 설정"])
+    tab1, tab2, tab_jobs, tab_perf, tab3 = st.tabs(["📝 지침서 관리", "📄 PDF 생성", "🗂️ 작업 현황", "📈 성능", "⚙️ 설정"])
     
     # ============ 탭 1: 지침서 관리 ============
     with tab1:
@@ -615,10 +5446,12 @@ def show_main_app():
     with tab2:
         st.header("📄 PDF 생성")
         
-        api_key_exists = st.session_state.settings.get("api_key")
+        api_key_exists = llm_ready(st.session_state.settings)
         
         if not api_key_exists:
             st.warning("⚠️ 먼저 '설정' 탭에서 OpenAI API 키를 입력해주세요!")
+        elif st.session_state.settings.get("llm_backend") == "fake":
+            st.info("🧪 가짜 LLM 백엔드로 생성합니다 (부하 테스트용, API 호출 없음). '설정' 탭에서 바꿀 수 있습니다.")
         
         st.subheader("🎯 생성 설정")
         
@@ -644,13 +5477,67 @@ def show_main_app():
         
         with col4:
             auto_email = st.checkbox("📧 이메일 발송", value=True)
+            resume_jobs = st.checkbox(
+                "⏯️ 이어서 생성",
+                value=True,
+                help="중단된 작업은 마지막으로 완료된 파트부터 이어서 생성하고, 이미 완료된 고객은 건너뜁니다. 끄면 처음부터 다시 생성합니다."
+            )
+            skip_delivered = st.checkbox(
+                "🔁 발송한 고객 건너뛰기",
+                value=True,
+                help="같은 명단을 다시 올려도 고객 정보와 목차/지침/페이지 수가 그대로인 고객은 다시 만들지 않습니다. 정보나 지침이 바뀐 고객만 다시 생성합니다."
+            )
+            run_in_worker = st.checkbox(
+                "🖥️ 백그라운드 워커",
+                value=False,
+                help="작업을 큐에 등록만 하고, 생성은 별도 프로세스(python app.py worker)가 처리합니다. 브라우저를 닫아도 계속 진행됩니다."
+            )
+            run_in_batch = st.checkbox(
+                "🌙 Batch API (야간 대량)",
+                value=False,
+                help="모든 고객의 파트를 배치 파일 하나로 OpenAI Batch API에 제출합니다. 비용은 절반이고 24시간 안에 끝나며, 워커(python app.py worker) 또는 python app.py batch가 결과를 받아 PDF 생성/발송까지 처리합니다. 앞 내용 이어 쓰기는 적용되지 않습니다."
+            )
+            use_cache = st.checkbox(
+                "💾 캐시 사용",
+                value=True,
+                help="같은 고객/지침으로 이미 생성한 파트는 API를 다시 호출하지 않습니다. 끄면 모두 새로 생성합니다."
+            )
+            stream_generation = st.checkbox(
+                "⚡ 스트리밍 생성",
+                value=True,
+                help="글자가 생성되는 대로 받아서 실시간 미리보기를 보여주고, 문단 줄바꿈을 생성과 동시에 끝내 둡니다."
+            )
+            chain_context = st.checkbox(
+                "🔗 앞 내용 이어 쓰기",
+                value=False,
+                help="챕터 안의 파트를 순서대로 생성하면서 앞 파트/앞 챕터 내용 요약을 함께 보내 같은 내용 반복을 줄입니다. 요약 크기는 설정 탭의 상한을 넘지 않습니다. 챕터끼리는 동시에 진행됩니다."
+            )
         
-        # 예상 정보 표시
-        parts_per_ch = max(1, (total_pages * CHARS_PER_PAGE // len(current_chapters)) // 2500) if current_chapters else 1
-        total_api_calls = len(current_chapters) * parts_per_ch
-        estimated_cost = total_api_calls * 0.02  # 대략적 비용
+        context_tokens = int(st.session_state.settings.get("context_summary_tokens", CONTEXT_SUMMARY_TOKENS))
         
-        st.info(f"📊 예상: 목차당 {parts_per_ch}회 × {len(current_chapters)}개 = **총 {total_api_calls}회 API 호출** (예상 비용: ${estimated_cost:.2f})")
+        # 예상 정보 표시 (생성에 쓰는 것과 같은 분량 계획으로 계산)
+        estimate_model = st.session_state.settings.get("model", "gpt-4o-mini")
+        usage_ledger = get_usage_ledger()
+        calibration = usage_ledger.calibration(estimate_model)
+        estimate = estimate_generation(
+            current_chapters, total_pages, estimate_model,
+            guides.get(pdf_service, {}).get("지침", ""), pdf_service,
+            context_tokens=context_tokens if chain_context and not run_in_batch else 0,
+            calibration=calibration, prices=price_table(st.session_state.settings)
+        )
+        topup_note = f" + 보충 약 {estimate['topup_calls']}회" if estimate["topup_calls"] else ""
+        price_ratio = BATCH_PRICE_RATIO if run_in_batch else 1.0
+        cost_note = f"${estimate['cost'] * price_ratio:.3f}"
+        if estimate["calibrated_cost"] is not None:
+            cost_note += f" → 실제 기록 보정 ${estimate['calibrated_cost'] * price_ratio:.3f} (최근 {calibration['calls']}회 기준)"
+        if run_in_batch:
+            cost_note += ", Batch API"
+        
+        st.info(f"📊 예상 (고객 1명): 목차당 {estimate['parts_per_chapter']}회 × {len(current_chapters)}개{topup_note} = **총 {estimate['calls']}회 API 호출** · 입력 {estimate['input_tokens']:,} / 출력 {estimate['output_tokens']:,} 토큰 (예상 비용: {cost_note}, {estimate_model})")
+        per_page = usage_ledger.cost_per_page(estimate_model)
+        if per_page:
+            finished_jobs, page_cost = per_page
+            st.caption(f"💰 완료된 작업 {finished_jobs}건의 실제 쪽당 비용 ${page_cost:.4f} → {total_pages}쪽 약 ${page_cost * total_pages:.3f}")
         
         st.markdown("---")
         
@@ -673,15 +5560,27 @@ def show_main_app():
         
         if uploaded_file:
             try:
-                if uploaded_file.name.endswith('.csv'):
-                    df = pd.read_csv(uploaded_file)
-                else:
-                    df = pd.read_excel(uploaded_file)
+                file_data = uploaded_file.getvalue()
+                file_hash = hashlib.sha256(file_data).hexdigest()
+                with st.spinner("고객 명단 읽는 중..."):
+                    df, search_text = load_customer_sheet(file_hash, uploaded_file.name, file_data)
                 
                 st.success(f"✅ {len(df)}명 로드 완료!")
                 
+                # 검색은 캐시해 둔 행별 문자열에서 처리 (화면에는 결과 한 쪽만 보냄)
+                search_query = st.text_input("🔍 고객 검색", placeholder="이름, 이메일, 주문번호 등 아무 컬럼의 값")
+                matched_rows = search_customer_rows(search_text, search_query)
+                if search_query.strip():
+                    st.caption(f"검색 결과 {len(matched_rows):,}명")
+                
                 with st.expander("📋 데이터 미리보기", expanded=True):
-                    st.dataframe(df, use_container_width=True)
+                    preview_pages = max(1, math.ceil(len(matched_rows) / PREVIEW_PAGE_ROWS))
+                    preview_page = st.number_input(f"쪽 (전체 {preview_pages:,}쪽)", min_value=1, max_value=preview_pages, value=1)
+                    preview_start = (preview_page - 1) * PREVIEW_PAGE_ROWS
+                    page_rows = matched_rows[preview_start:preview_start + PREVIEW_PAGE_ROWS]
+                    st.dataframe(df.iloc[page_rows], use_container_width=True)
+                    if page_rows:
+                        st.caption(f"{len(matched_rows):,}명 중 {preview_start + 1:,}~{preview_start + len(page_rows):,}번째")
                 
                 st.markdown("---")
                 st.subheader("🔗 컬럼 매핑")
@@ -698,21 +5597,49 @@ def show_main_app():
                 
                 st.markdown("---")
                 
-                selected_rows = st.multiselect(
-                    "생성할 고객 선택 (비우면 전체)",
-                    options=df.index.tolist(),
-                    format_func=lambda x: f"{x+1}. {df.iloc[x][name_col]}"
-                )
+                if len(matched_rows) <= SELECT_OPTIONS_LIMIT:
+                    selected_rows = st.multiselect(
+                        "생성할 고객 선택 (비우면 검색 결과 전체)",
+                        options=matched_rows,
+                        format_func=lambda x: f"{x+1}. {df.iloc[x][name_col]}"
+                    )
+                else:
+                    selected_rows = []
+                    st.caption(f"고객이 {len(matched_rows):,}명이라 선택 목록은 숨겼습니다. 일부만 만들려면 위 검색으로 {SELECT_OPTIONS_LIMIT:,}명 이하로 좁히세요.")
                 
                 if not selected_rows:
-                    selected_rows = df.index.tolist()
+                    selected_rows = matched_rows
+                
+                # 행별 fingerprint (생성 시작 때 쓰는 것과 같은 목차/지침 기준)
+                index_guide = guides.get(pdf_service) or get_default_guides()[pdf_service]
+                index_version = guide_version(index_guide.get("목차", ["총운"]), index_guide.get("지침", ""), total_pages)
+                with st.spinner("발송 기록 확인 중..."):
+                    row_keys = customer_row_keys(file_hash, pdf_service, index_version, name_col, email_col, df)
+                if skip_delivered and selected_rows:
+                    statuses = get_customer_index().classify([row_keys[idx] for idx in selected_rows])
+                    delivered_count = statuses.count("delivered")
+                    changed_count = statuses.count("changed")
+                    pending_count = statuses.count("pending")
+                    selected_rows = [idx for idx, status in zip(selected_rows, statuses) if status not in ("delivered", "pending")]
+                    if delivered_count or changed_count or pending_count:
+                        st.caption(f"🔁 이미 발송한 고객 {delivered_count:,}명 · 메일 발송 대기 중 {pending_count:,}명 건너뜀 · 정보/지침이 바뀐 고객 {changed_count:,}명은 다시 생성")
                 
                 st.info(f"📌 {len(selected_rows)}명 × {total_pages}페이지 PDF 생성 예정")
                 
-                if st.button("🚀 PDF 생성 시작", type="primary", use_container_width=True, disabled=not api_key_exists):
+                # 템플릿 버킷 컬럼이 시트에 없으면 시작하지 않음 (설정 탭의 확인에도 씀)
+                st.session_state["sheet_columns"] = columns
+                page_templates = chapter_templates(st.session_state.settings, pdf_service)
+                missing_buckets = page_templates.missing_keys(columns) if page_templates else []
+                if missing_buckets:
+                    st.error(f"🧩 템플릿 버킷 컬럼 {', '.join(missing_buckets)}이(가) 업로드한 시트에 없습니다. '설정' 탭의 챕터 템플릿에서 컬럼 이름을 고치거나 비워 주세요.")
+                
+                if st.button("🚀 PDF 생성 시작", type="primary", use_container_width=True, disabled=not api_key_exists or not selected_rows or bool(missing_buckets)):
                     
-                    client = OpenAI(api_key=st.session_state.settings["api_key"])
+                    # 재시도는 call_with_retry가 담당 (SDK 자체 재시도 끔)
+                    client = make_llm_client(st.session_state.settings)
                     model = st.session_state.settings.get("model", "gpt-4o-mini")
+                    max_workers = int(st.session_state.settings.get("max_workers", DEFAULT_MAX_WORKERS))
+                    max_attempts = int(st.session_state.settings.get("max_retries", RETRY_MAX_ATTEMPTS))
                     
                     guides = st.session_state.settings["guides"]
                     if pdf_service not in guides:
@@ -722,85 +5649,464 @@ def show_main_app():
                     chapters = current_guide.get("목차", ["총운"])
                     guide_text = current_guide.get("지침", "")
                     
-                    gmail_address = st.session_state.settings.get("gmail_address", "")
-                    gmail_password = st.session_state.settings.get("gmail_app_password", "")
+                    email_ready = email_configured(st.session_state.settings)
+                    batch_id = datetime.now().strftime('%Y%m%d_%H%M%S')
                     
-                    for idx in selected_rows:
+                    def make_payload(idx):
+                        """워커 큐 / Batch API에 넘기는 고객 1명 작업 정보"""
                         row = df.iloc[idx]
-                        customer_name = str(row[name_col])
-                        customer_name2 = str(row[name2_col]) if name2_col != "없음" and pd.notna(row.get(name2_col)) else None
-                        customer_email = str(row[email_col]) if email_col != "없음" and pd.notna(row.get(email_col)) else None
+                        return {
+                            "batch_id": batch_id,
+                            "customer_name": str(row[name_col]),
+                            "customer_name2": str(row[name2_col]) if name2_col != "없음" and pd.notna(row.get(name2_col)) else None,
+                            "customer_email": str(row[email_col]) if email_col != "없음" and pd.notna(row.get(email_col)) else None,
+                            "customer_data": row.to_dict(),
+                            "service_type": pdf_service,
+                            "model": model,
+                            "chapters": chapters,
+                            "guide": guide_text,
+                            "total_pages": total_pages,
+                            "auto_email": auto_email,
+                            "use_cache": use_cache,
+                            "stream": stream_generation,
+                            "chain_context": chain_context,
+                            "resume": resume_jobs,
+                            "customer_fingerprint": row_keys[idx][0],
+                            "customer_key": row_keys[idx][1]
+                        }
+                    
+                    if run_in_batch:
+                        # 모든 파트를 배치 파일로 제출, 결과는 워커 / python app.py batch가 처리
+                        payloads = [make_payload(idx) for idx in selected_rows]
+                        if not resume_jobs:
+                            for payload in payloads:
+                                JobJournal.for_customer(model, pdf_service, payload["customer_data"], chapters, guide_text, total_pages).reset()
+                        # 가짜 백엔드면 배치도 로컬에서 바로 처리
+                        endpoint = "local" if st.session_state.settings.get("llm_backend") == "fake" else st.session_state.settings.get("batch_endpoint", "openai")
+                        try:
+                            with st.spinner("배치 파일 만들어 제출하는 중..."):
+                                run_id = submit_batch_run(make_batch_client(st.session_state.settings, endpoint), payloads, st.session_state.settings, batch_id, endpoint)
+                        except SpendCapExceeded as e:
+                            st.error(f"💸 배치 제출 안 함: {e}")
+                        else:
+                            run = get_batch_store().get(run_id)
+                            st.success(f"✅ {len(payloads)}명 배치 제출 완료! ({run_id}: {run['message']}) '🗂️ 작업 현황' 탭에서 진행 상황을 확인하세요.")
+                    elif run_in_worker:
+                        # 작업만 등록하고 생성은 python app.py worker 프로세스가 처리
+                        job_queue = get_job_queue()
+                        
+                        for idx in selected_rows:
+                            payload = make_payload(idx)
+                            job_queue.submit(batch_id, payload["customer_name"], payload)
                         
-                        st.markdown(f"### 📝 {customer_name} 님 처리 중...")
+                        st.success(f"✅ {len(selected_rows)}명 작업 등록 완료! (배치 {batch_id}) '🗂️ 작업 현황' 탭에서 진행 상황을 확인하세요.")
+                    else:
+                        rate_limiter = get_rate_limiter(model, st.session_state.settings.get("rate_limits"))
                         
-                        customer_data = row.to_dict()
+                        # 모든 고객의 파트를 하나의 큐에 넣고 공유 워커 풀로 처리
+                        cache = get_content_cache(st.session_state.settings)
+                        scheduler = BatchScheduler(client, model, max_workers, rate_limiter, max_attempts, cache, use_cache, stream_generation, chain_context, context_tokens, spend_limits(st.session_state.settings), chapter_templates(st.session_state.settings, pdf_service))
+                        customer_meta = {}
                         
+                        for idx in selected_rows:
+                            row = df.iloc[idx]
+                            customer_name = str(row[name_col])
+                            customer_name2 = str(row[name2_col]) if name2_col != "없음" and pd.notna(row.get(name2_col)) else None
+                            customer_email = str(row[email_col]) if email_col != "없음" and pd.notna(row.get(email_col)) else None
+                            
+                            customer_data = row.to_dict()
+                            journal = JobJournal.for_customer(model, pdf_service, customer_data, chapters, guide_text, total_pages)
+                            if not resume_jobs:
+                                journal.reset()
+                            
+                            scheduler.submit_customer(
+                                idx, customer_name, customer_data,
+                                chapters, total_pages,
+                                guide_text, pdf_service,
+                                journal
+                            )
+                            customer_meta[idx] = (customer_name, customer_name2, customer_email)
+                        
+                        st.markdown(f"### 📝 {len(selected_rows)}명 처리 중... (동시 {max_workers}개 호출)")
                         progress_bar = st.progress(0)
                         status_text = st.empty()
+                        preview_box = st.empty()
                         
                         def update_progress(progress, status):
-                            progress_bar.progress(progress)
+                            progress_bar.progress(min(progress, 1.0))
                             status_text.text(status)
+                            
+                            preview = scheduler.live_preview() if stream_generation else None
+                            if preview:
+                                with preview_box.container():
+                                    st.caption(f"✍️ 실시간 미리보기 · {preview['고객']} 님 · {preview['챕터']} ({preview['파트']}) · 생성 중 {preview['생성 중']}개")
+                                    st.text(preview["text"])
+                            else:
+                                preview_box.empty()
                         
-                        chapters_content = generate_full_content(
-                            client, model, customer_data,
-                            chapters, total_pages,
-                            guide_text, pdf_service,
-                            update_progress
-                        )
+                        image_dpi = int(st.session_state.settings.get("bg_image_dpi", BG_IMAGE_DPI))
+                        image_quality = int(st.session_state.settings.get("bg_jpeg_quality", BG_JPEG_QUALITY))
+                        render_processes = int(st.session_state.settings.get("render_processes", RENDER_PROCESSES))
+                        file_output = st.session_state.settings.get("file_output", True)
                         
-                        status_text.text("📄 PDF 생성 중...")
-                        pdf_buffer = create_pdf_with_toc(
-                            chapters_content,
-                            customer_name,
-                            pdf_service,
-                            customer_name2
-                        )
+                        # 렌더링 프로세스를 쓰면 PDF 렌더링과 다른 고객의 GPT 생성이 동시에 진행됨
+                        render_pool = PdfRenderPool(render_processes, image_dpi, image_quality) if render_processes > 0 else None
+                        render_futures = {}
                         
-                        if pdf_service == "연애" and customer_name2:
-                            filename = f"{customer_name}_{customer_name2}_{pdf_service}_{datetime.now().strftime('%Y%m%d')}.pdf"
-                        else:
-                            filename = f"{customer_name}_{pdf_service}_{datetime.now().strftime('%Y%m%d')}.pdf"
+                        # 배치 전체에서 SMTP 연결 1개를 재사용 (실패한 메일은 발송 큐에 남아 재시도)
+                        mailer = MailSender(get_email_outbox(), st.session_state.settings) if auto_email and email_ready else None
                         
-                        if auto_email and customer_email and gmail_address and gmail_password:
-                            status_text.text("📧 이메일 발송 중...")
+                        def finish_customer(job, pdf):
+                            """렌더링이 끝난 고객: 이메일 발송 + 다운로드 버튼 (pdf: 파일 경로 또는 BytesIO)"""
+                            idx = job.key
+                            customer_name, customer_name2, customer_email = customer_meta[idx]
+                            filename = make_pdf_filename(customer_name, pdf_service, customer_name2)
                             
-                            email_subject = f"[{pdf_service}] {customer_name}님의 감정서가 도착했습니다"
-                            email_body = f"""안녕하세요, {customer_name}님!
-
-요청하신 {pdf_service} 감정서를 보내드립니다.
-첨부된 PDF 파일을 확인해주세요.
-
-감사합니다.
-"""
+                            job.status = "완료"
+                            delivery = None
                             
-                            pdf_buffer.seek(0)
-                            success, message = send_email_with_attachment(
-                                customer_email, email_subject, email_body,
-                                pdf_buffer, filename, gmail_address, gmail_password
-                            )
+                            if mailer and customer_email:
+                                email_subject, email_body = make_email_content(customer_name, pdf_service)
+                                
+                                attachment_path = pdf
+                                if not isinstance(pdf, str):
+                                    # 발송 큐는 파일 경로로 첨부하므로 메모리의 PDF는 파일로 저장
+                                    attachment_path = make_output_path(job.journal.job_id, filename)
+                                    with open(attachment_path, "wb") as f:
+                                        f.write(pdf.getvalue())
+                                
+                                message_id = mailer.outbox.enqueue(
+                                    customer_name, customer_email, email_subject, email_body,
+                                    attachment_path, filename, batch_id,
+                                    dedupe_key=f"{job.journal.job_id}:{customer_email}"
+                                )
+                                mailer.deliver_pending()
+                                delivery = mailer.outbox.get(message_id)
+                                job.message = describe_delivery(delivery)
+                                
+                                if delivery["status"] == "sent":
+                                    st.success(f"📧 {job.message}!")
+                                elif delivery["status"] == "failed":
+                                    st.warning(f"📧 {job.message}")
+                                    job.status = "발송 실패"
+                                else:
+                                    st.info(f"📧 {job.message} - '🗂️ 작업 현황' 탭의 메일 발송 현황에서 확인할 수 있습니다.")
                             
-                            if success:
-                                st.success(f"📧 {customer_email} 발송 완료!")
+                            if isinstance(pdf, str):
+                                # 디스크의 파일은 다운로드 버튼을 누를 때만 읽음
+                                download_data = lambda path=pdf: read_file_bytes(path)
                             else:
-                                st.warning(f"📧 발송 실패: {message}")
+                                pdf.seek(0)
+                                download_data = pdf
+                            
+                            st.download_button(
+                                f"📥 {filename}",
+                                download_data,
+                                filename,
+                                "application/pdf",
+                                key=f"dl_{idx}"
+                            )
+                            
+                            # 발송 실패한 고객은 다음 실행에서 다시 처리 (파트는 저널에서 복원)
+                            record_customer_delivery(
+                                job.journal, delivery, row_keys[idx], customer_name, customer_email, pdf_service, filename,
+                                pdf if isinstance(pdf, str) else None, email_requested=bool(auto_email and customer_email)
+                            )
                             
-                            pdf_buffer.seek(0)
+                            st.success(f"✅ {customer_name} 님 완료! ({job.elapsed():.0f}초)")
+                        
+                        def collect_renders(wait_all=False):
+                            """끝난 렌더링 결과 처리 (wait_all이면 남은 것 모두 기다림)"""
+                            futures = list(render_futures) if wait_all else [f for f in render_futures if f.done()]
+                            for future in as_completed(futures):
+                                job = render_futures.pop(future)
+                                try:
+                                    result = future.result()
+                                except Exception as e:
+                                    job.status = "PDF 실패"
+                                    job.message = str(e)
+                                    st.error(f"❌ {job.name} 님 PDF 생성 실패: {e}")
+                                    continue
+                                finish_customer(job, result if isinstance(result, str) else io.BytesIO(result))
                         
-                        st.download_button(
-                            f"📥 {filename}",
-                            pdf_buffer,
-                            filename,
-                            "application/pdf",
-                            key=f"dl_{idx}"
-                        )
+                        scheduler.start()
+                        try:
+                            # 고객별 생성이 끝나는 순서대로 PDF 생성 + 이메일 발송
+                            for job in scheduler.iter_completed(update_progress, yield_idle=render_pool is not None):
+                                if render_pool:
+                                    collect_renders()
+                                if job is None:
+                                    continue
+                                
+                                customer_name, customer_name2, customer_email = customer_meta[job.key]
+                                
+                                if job.skipped:
+                                    st.info(f"⏭️ {customer_name} 님: 이전 실행에서 이미 완료되어 건너뜁니다.")
+                                    continue
+                                
+                                # 실패한 파트가 있으면 PDF에 오류 문구를 넣지 않고 건너뜀
+                                if job.failures:
+                                    job.message = f"{len(job.failures)}개 파트 실패 - 다시 실행해주세요"
+                                    st.error(f"❌ {customer_name} 님: {job.message}")
+                                    continue
+                                
+                                job.status = "PDF 생성 중"
+                                output_path = None
+                                if file_output:
+                                    output_path = make_output_path(job.journal.job_id, make_pdf_filename(customer_name, pdf_service, customer_name2))
+                                
+                                with tracer.context(job=job.trace_id, customer=customer_name):
+                                    if render_pool:
+                                        future = render_pool.submit(job.chapters_content(), customer_name, pdf_service, customer_name2, output_path)
+                                        render_futures[future] = job
+                                    else:
+                                        pdf = create_pdf_with_toc(
+                                            job.chapters_content(),
+                                            customer_name,
+                                            pdf_service,
+                                            customer_name2,
+                                            image_dpi,
+                                            image_quality,
+                                            output_path
+                                        )
+                                        finish_customer(job, pdf)
+                            
+                            if render_pool:
+                                status_text.text("📄 남은 PDF 렌더링 중...")
+                                collect_renders(wait_all=True)
+                        finally:
+                            scheduler.stop()
+                            preview_box.empty()
+                            if mailer:
+                                mailer.close()
+                            if render_pool:
+                                render_pool.shutdown()
                         
-                        st.success(f"✅ {customer_name} 님 완료!")
                         st.markdown("---")
-                
+                        st.subheader("📋 배치 요약")
+                        st.dataframe(pd.DataFrame(scheduler.summary()), use_container_width=True)
+                        cache_report = scheduler.prompt_cache_report()
+                        if cache_report:
+                            st.caption(f"🧠 {cache_report}")
+                        
+                        failure_rows = scheduler.failure_rows()
+                        if failure_rows:
+                            st.subheader("⚠️ 실패한 파트")
+                            st.dataframe(pd.DataFrame(failure_rows), use_container_width=True)
+            
             except Exception as e:
                 st.error(f"❌ 오류: {str(e)}")
     
+    # ============ 탭: 작업 현황 (백그라운드 워커) ============
+    with tab_jobs:
+        st.header("🗂️ 작업 현황")
+        st.caption("백그라운드 워커 실행: 터미널에서 `python app.py worker` (여러 개 실행하면 동시에 처리)")
+        
+        job_queue = get_job_queue()
+        counts = job_queue.counts()
+        
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("⏳ 대기", counts.get("queued", 0))
+        col2.metric("⚙️ 진행 중", counts.get("running", 0))
+        col3.metric("✅ 완료", counts.get("done", 0))
+        col4.metric("❌ 실패", counts.get("failed", 0))
+        
+        col1, col2, col3 = st.columns([1, 1, 2])
+        with col1:
+            if st.button("🔄 새로고침", use_container_width=True):
+                st.rerun()
+        with col2:
+            if st.button("🔁 실패 작업 재시도", use_container_width=True):
+                job_queue.retry_failed()
+                st.rerun()
+        with col3:
+            if st.button("🧹 완료/실패 목록 정리"):
+                job_queue.clear_finished()
+                st.rerun()
+        
+        jobs = job_queue.list_jobs()
+        if jobs:
+            status_labels = {"queued": "⏳ 대기", "running": "⚙️ 진행 중", "done": "✅ 완료", "failed": "❌ 실패"}
+            st.dataframe(pd.DataFrame([
+                {
+                    "번호": job["id"],
+                    "배치": job["batch_id"],
+                    "고객": job["customer_name"],
+                    "상태": status_labels.get(job["status"], job["status"]),
+                    "진행률": f"{(job['progress'] or 0) * 100:.0f}%",
+                    "메시지": job["message"],
+                    "워커": job["worker"] or ""
+                }
+                for job in jobs
+            ]), use_container_width=True)
+            
+            finished = [job for job in jobs if job["status"] == "done" and job["pdf_path"] and os.path.exists(job["pdf_path"])]
+            if finished:
+                st.subheader("📥 완료된 PDF")
+                for job in finished[:50]:
+                    st.download_button(
+                        f"📥 {os.path.basename(job['pdf_path'])}",
+                        lambda path=job["pdf_path"]: read_file_bytes(path),
+                        os.path.basename(job["pdf_path"]),
+                        "application/pdf",
+                        key=f"queue_dl_{job['id']}"
+                    )
+        else:
+            st.info("등록된 작업이 없습니다. 'PDF 생성' 탭에서 '🖥️ 백그라운드 워커'를 켜고 생성을 시작하세요.")
+        
+        st.markdown("---")
+        st.subheader("🌙 Batch API 현황")
+        st.caption("제출한 배치는 워커가 쉬는 동안 확인하거나 `python app.py batch`로 끝날 때까지 확인합니다. 결과가 모이면 PDF 생성과 발송까지 자동으로 진행됩니다.")
+        
+        batch_store = get_batch_store()
+        batch_runs = batch_store.list_runs()
+        if batch_runs:
+            if st.button("🔄 배치 상태 확인", disabled=not api_key_exists):
+                with st.spinner("배치 상태 확인 중..."):
+                    handled = poll_batch_runs(st.session_state.settings, "ui", force=True)
+                for run_id, message in handled:
+                    st.info(f"{run_id}: {message}")
+            
+            run_labels = {"submitted": "⏳ 진행 중", "done": "✅ 완료", "failed": "⚠️ 일부 미완료"}
+            st.dataframe(pd.DataFrame([
+                {
+                    "실행": run["id"],
+                    "고객 수": len(run["payloads"]),
+                    "라운드": run["round"],
+                    "요청 수": run["requests"],
+                    "상태": run_labels.get(run["status"], run["status"]),
+                    "메시지": run["message"],
+                    "제출 시각": datetime.fromtimestamp(run["created_at"]).strftime('%m-%d %H:%M'),
+                    "완료 시각": datetime.fromtimestamp(run["finished_at"]).strftime('%m-%d %H:%M') if run["finished_at"] else ""
+                }
+                for run in batch_runs
+            ]), use_container_width=True)
+        else:
+            st.info("제출한 배치가 없습니다. 'PDF 생성' 탭에서 '🌙 Batch API'를 켜고 생성을 시작하세요.")
+        
+        st.markdown("---")
+        st.subheader("📮 메일 발송 현황")
+        st.caption("발송에 실패한 메일은 발송 큐에 남아 자동으로 재시도합니다 (워커가 실행 중이면 워커가 처리).")
+        
+        outbox = get_email_outbox()
+        mail_counts = outbox.counts()
+        daily_quota = int(st.session_state.settings.get("email_daily_quota", EMAIL_DAILY_QUOTA))
+        
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("📤 오늘 발송", f"{outbox.sent_today()} / {daily_quota}")
+        col2.metric("⏳ 발송 대기", mail_counts.get("queued", 0) + mail_counts.get("sending", 0))
+        col3.metric("✅ 발송 완료", mail_counts.get("sent", 0))
+        col4.metric("❌ 발송 실패", mail_counts.get("failed", 0))
+        
+        col1, col2, col3 = st.columns([1, 1, 2])
+        with col1:
+            if st.button("📨 지금 발송", use_container_width=True, disabled=not email_configured(st.session_state.settings)):
+                mailer = MailSender(outbox, st.session_state.settings)
+                try:
+                    with st.spinner("발송 중..."):
+                        result = mailer.deliver_pending()
+                finally:
+                    mailer.close()
+                st.success(f"발송 {result['sent']}통 · 재시도 대기 {result['retry']}통 · 실패 {result['failed']}통")
+                if result["stopped"]:
+                    st.warning(result["stopped"])
+        with col2:
+            if st.button("🔁 실패 메일 재시도", use_container_width=True):
+                outbox.retry_failed()
+                st.rerun()
+        with col3:
+            if st.button("🧹 발송 완료 목록 정리"):
+                outbox.clear_sent()
+                st.rerun()
+        
+        messages = outbox.list_messages()
+        if messages:
+            mail_labels = {"queued": "⏳ 대기", "sending": "📤 발송 중", "sent": "✅ 완료", "failed": "❌ 실패"}
+            st.dataframe(pd.DataFrame([
+                {
+                    "번호": message["id"],
+                    "배치": message["batch_id"],
+                    "고객": message["customer_name"],
+                    "이메일": message["to_email"],
+                    "상태": mail_labels.get(message["status"], message["status"]),
+                    "시도": message["attempts"],
+                    "다음 시도": datetime.fromtimestamp(message["next_attempt_at"]).strftime('%m-%d %H:%M') if message["status"] == "queued" and message["next_attempt_at"] else "",
+                    "발송 시각": datetime.fromtimestamp(message["sent_at"]).strftime('%m-%d %H:%M') if message["sent_at"] else "",
+                    "오류": message["last_error"]
+                }
+                for message in messages
+            ]), use_container_width=True)
+    
+    # ============ 탭: 성능 (단계별 소요 시간) ============
+    with tab_perf:
+        st.header("📈 성능")
+        st.caption(f"고객 작업의 단계별 소요 시간 기록({TRACE_FILE})입니다. 배치가 느려졌을 때 GPT 응답, PDF 렌더링, 메일 발송 중 어디가 원인인지 확인하세요.")
+        
+        if not tracer.enabled:
+            st.info("성능 기록이 꺼져 있습니다. '설정' 탭에서 켤 수 있습니다.")
+        
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            window = st.selectbox("기간", list(TRACE_WINDOWS.keys()), index=1)
+        with col2:
+            st.write("")
+            if st.button("🔄 새로고침", key="perf_refresh", use_container_width=True):
+                st.rerun()
+        with col3:
+            st.write("")
+            if st.button("🗑️ 기록 지우기", use_container_width=True):
+                tracer.clear()
+                st.rerun()
+        
+        seconds = TRACE_WINDOWS[window]
+        spans = tracer.load(since=time.time() - seconds if seconds else None)
+        if spans:
+            gen_stats = generation_stats(spans)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("GPT 호출", f"{gen_stats['calls']:,}회", f"재시도 {gen_stats['retries']:,}회 · 실패 {gen_stats['failed']:,}회", delta_color="off")
+            col2.metric("출력 토큰/초 (호출당)", f"{gen_stats['tokens_per_second']:.1f}")
+            col3.metric("GPT 비용", f"${gen_stats['cost']:.3f}")
+            col4.metric("쪽당 비용", f"${gen_stats['cost_per_page']:.5f}" if gen_stats["cost_per_page"] is not None else "-", f"{gen_stats['pages']:,}쪽 렌더링", delta_color="off")
+            
+            st.subheader("⏱️ 단계별 소요 시간")
+            st.dataframe(pd.DataFrame(summarize_stages(spans)), use_container_width=True)
+            st.caption("GPT 호출은 재시도 대기와 분당 한도 대기를 포함합니다. PDF 렌더링은 렌더링 중 줄바꿈(레이아웃) 시간을 포함합니다.")
+            
+            job_rows = job_timings(spans)
+            if job_rows:
+                st.subheader("👤 고객별")
+                st.caption("GPT 구간은 첫 파트 호출 시작부터 마지막 파트 끝까지입니다 (파트는 동시에 호출). 병목은 네 단계 중 가장 오래 걸린 단계입니다.")
+                st.dataframe(pd.DataFrame(job_rows), use_container_width=True)
+        else:
+            st.info("이 기간에 기록된 작업이 없습니다.")
+        
+        st.markdown("---")
+        st.subheader("💰 사용량")
+        st.caption(f"API 응답의 usage(입력/캐시 적중/출력 토큰)를 호출마다 기록한 실제 비용입니다({USAGE_FILE}). 가격은 MODEL_PRICES 기준이며 settings.json의 model_prices로 바꿀 수 있습니다.")
+        usage_ledger = get_usage_ledger()
+        limits = spend_limits(st.session_state.settings)
+        today_spent = usage_ledger.day_total()
+        col1, col2 = st.columns(2)
+        col1.metric("오늘 사용", f"${today_spent:.3f}", f"하루 한도 ${limits['daily']:.2f}" if limits["daily"] else "하루 한도 없음", delta_color="off")
+        col2.metric("고객 1명당 한도", f"${limits['job']:.2f}" if limits["job"] else "없음")
+        if limits["daily"]:
+            st.progress(min(1.0, today_spent / limits["daily"]))
+        
+        daily_rows = usage_ledger.daily_rows()
+        if daily_rows:
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("**날짜별**")
+                st.dataframe(pd.DataFrame(daily_rows), use_container_width=True)
+            with col2:
+                st.markdown("**모델별 (최근 30일)**")
+                since_day = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+                st.dataframe(pd.DataFrame(usage_ledger.model_rows(since_day)), use_container_width=True)
+            st.markdown("**작업별**")
+            st.dataframe(pd.DataFrame(usage_ledger.job_rows()), use_container_width=True)
+        else:
+            st.info("아직 기록된 API 사용량이 없습니다.")
+    
     # ============ 탭 3: 설정 ============
     with tab3:
         st.header("⚙️ 시스템 설정")
@@ -823,6 +6129,96 @@ def show_main_app():
                     st.session_state.settings.get("model", "gpt-4o-mini")
                 )
             )
+            
+            with st.expander("🧪 LLM 백엔드 (호환 서버 / 부하 테스트)"):
+                backends = {"openai": "OpenAI (또는 호환 서버)", "fake": "가짜 백엔드 (API 호출 없음)"}
+                llm_backend = st.selectbox(
+                    "백엔드",
+                    list(backends),
+                    index=list(backends).index(st.session_state.settings.get("llm_backend", "openai")),
+                    format_func=backends.get
+                )
+                llm_base_url = st.text_input(
+                    "API 주소 (OpenAI 호환, 비우면 기본)",
+                    value=st.session_state.settings.get("llm_base_url", ""),
+                    help=f"로컬 대역 서버: 터미널에서 `python app.py mock-llm` 실행 후 http://127.0.0.1:{MOCK_LLM_PORT}/v1"
+                )
+                
+                fake_llm = {**FAKE_LLM_DEFAULTS, **st.session_state.settings.get("fake_llm", {})}
+                st.caption("가짜 백엔드 / mock-llm 서버의 응답 특성")
+                col_a, col_b = st.columns(2)
+                with col_a:
+                    latency_dists = ["lognormal", "uniform", "fixed"]
+                    fake_llm["latency_dist"] = st.selectbox("지연 분포", latency_dists, index=latency_dists.index(fake_llm["latency_dist"]))
+                    fake_llm["latency_median"] = st.number_input("응답 시작 중앙값 (초)", min_value=0.0, value=float(fake_llm["latency_median"]), step=0.1)
+                    fake_llm["latency_p95"] = st.number_input("응답 시작 p95 (초)", min_value=0.0, value=float(fake_llm["latency_p95"]), step=0.1)
+                    fake_llm["tokens_per_second"] = st.number_input("출력 속도 (토큰/초)", min_value=0.0, value=float(fake_llm["tokens_per_second"]), step=10.0)
+                with col_b:
+                    fake_llm["error_rate"] = st.number_input("500 오류 확률", min_value=0.0, max_value=1.0, value=float(fake_llm["error_rate"]), step=0.01)
+                    fake_llm["rate_limit_rate"] = st.number_input("429 오류 확률", min_value=0.0, max_value=1.0, value=float(fake_llm["rate_limit_rate"]), step=0.01)
+                    fake_llm["output_ratio"] = st.number_input("출력 분량 비율", min_value=0.05, value=float(fake_llm["output_ratio"]), step=0.05)
+                    fake_llm["time_scale"] = st.number_input("대기 시간 배율", min_value=0.0, value=float(fake_llm["time_scale"]), step=0.1, help="0.01이면 모든 지연을 100배 빠르게")
+            
+            max_workers = st.number_input(
+                "동시 호출 수",
+                min_value=1,
+                max_value=MAX_WORKERS_LIMIT,
+                value=int(st.session_state.settings.get("max_workers", DEFAULT_MAX_WORKERS)),
+                help="챕터/파트를 동시에 몇 개씩 생성할지 설정합니다. 여러 고객을 처리할 때는 모든 고객이 이 워커 수를 공유합니다. 1이면 순차 생성."
+            )
+            
+            rate_limits = dict(st.session_state.settings.get("rate_limits", MODEL_RATE_LIMITS))
+            current_limits = rate_limits.get(model) or MODEL_RATE_LIMITS[model]
+            
+            col_rpm, col_tpm = st.columns(2)
+            with col_rpm:
+                model_rpm = st.number_input(
+                    f"{model} 분당 요청 수 (RPM)",
+                    min_value=1,
+                    value=int(current_limits.get("rpm", MODEL_RATE_LIMITS[model]["rpm"]))
+                )
+            with col_tpm:
+                model_tpm = st.number_input(
+                    f"{model} 분당 토큰 수 (TPM)",
+                    min_value=1000,
+                    step=1000,
+                    value=int(current_limits.get("tpm", MODEL_RATE_LIMITS[model]["tpm"]))
+                )
+            st.caption("OpenAI 계정 등급의 한도보다 약간 낮게 설정하면 429 오류 없이 최대 속도로 처리됩니다. 백그라운드 워커를 여러 개 실행하면 한도는 워커 프로세스마다 따로 적용되니 나눠서 설정하세요.")
+            
+            max_retries = st.number_input(
+                "파트당 최대 시도 횟수",
+                min_value=1,
+                max_value=20,
+                value=int(st.session_state.settings.get("max_retries", RETRY_MAX_ATTEMPTS)),
+                help="429/5xx 등 일시적 오류는 지수 백오프로 재시도합니다. 끝내 실패한 파트는 PDF에 넣지 않고 실패 목록에 표시합니다."
+            )
+            context_summary_tokens = st.number_input(
+                "앞 내용 요약 최대 토큰",
+                min_value=50,
+                max_value=2000,
+                step=50,
+                value=int(st.session_state.settings.get("context_summary_tokens", CONTEXT_SUMMARY_TOKENS)),
+                help="'앞 내용 이어 쓰기'를 켰을 때 호출마다 붙이는 요약의 상한입니다. 챕터가 길어져도 프롬프트는 이 크기 이상 늘지 않습니다."
+            )
+            cap_col1, cap_col2 = st.columns(2)
+            with cap_col1:
+                job_spend_cap = st.number_input(
+                    "고객 1명당 지출 한도 ($)",
+                    min_value=0.0,
+                    step=0.05,
+                    value=float(st.session_state.settings.get("job_spend_cap_usd", 0.0)),
+                    help="0이면 제한 없음. 한도에 닿으면 남은 파트는 호출하지 않고 실패로 표시합니다. 받은 파트는 저장되므로 한도를 올린 뒤 '이어서 생성'하면 됩니다."
+                )
+            with cap_col2:
+                daily_spend_cap = st.number_input(
+                    "하루 지출 한도 ($)",
+                    min_value=0.0,
+                    step=1.0,
+                    value=float(st.session_state.settings.get("daily_spend_cap_usd", 0.0)),
+                    help="0이면 제한 없음. 앱과 워커의 모든 호출을 합산하며, Batch API는 제출 전에 예상 비용으로 확인합니다."
+                )
+            rate_limits[model] = {"rpm": int(model_rpm), "tpm": int(model_tpm)}
         
         with col2:
             st.subheader("📧 Gmail 설정")
@@ -845,14 +6241,204 @@ def show_main_app():
                 3. 앱 이름 입력 후 생성
                 4. 16자리 비밀번호 복사하여 입력
                 """)
+            
+            with st.expander("📮 메일 서버 / 발송 한도"):
+                smtp_host = st.text_input(
+                    "SMTP 서버",
+                    value=st.session_state.settings.get("smtp_host", SMTP_HOST),
+                    help="테스트용 로컬 메일 서버(예: localhost)는 비밀번호 없이 발송합니다."
+                )
+                smtp_port = st.number_input(
+                    "SMTP 포트",
+                    min_value=1,
+                    max_value=65535,
+                    value=int(st.session_state.settings.get("smtp_port", SMTP_PORT))
+                )
+                smtp_starttls = st.checkbox(
+                    "STARTTLS 사용",
+                    value=st.session_state.settings.get("smtp_starttls", True)
+                )
+                email_daily_quota = st.number_input(
+                    "하루 발송 한도 (통)",
+                    min_value=1,
+                    max_value=10000,
+                    value=int(st.session_state.settings.get("email_daily_quota", EMAIL_DAILY_QUOTA)),
+                    help="한도에 도달하면 남은 메일은 발송 큐에 두었다가 다음 날 발송합니다. Gmail 일반 계정은 하루 500통입니다."
+                )
+                email_max_attempts = st.number_input(
+                    "메일당 최대 시도 횟수",
+                    min_value=1,
+                    max_value=20,
+                    value=int(st.session_state.settings.get("email_max_attempts", EMAIL_MAX_ATTEMPTS))
+                )
+        
+        st.markdown("---")
+        st.subheader("💾 GPT 응답 캐시")
+        
+        cache = get_content_cache(st.session_state.settings)
+        cache_stats = cache.stats()
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            cache_ttl_days = st.number_input(
+                "보관 기간 (일)",
+                min_value=1,
+                max_value=365,
+                value=int(st.session_state.settings.get("cache_ttl_days", CACHE_TTL_DAYS))
+            )
+        with col2:
+            cache_max_mb = st.number_input(
+                "최대 크기 (MB)",
+                min_value=10,
+                max_value=10000,
+                value=int(st.session_state.settings.get("cache_max_mb", CACHE_MAX_MB))
+            )
+        with col3:
+            st.metric("저장된 파트", f"{cache_stats['entries']}개", f"{cache_stats['bytes'] / 1024 / 1024:.1f} MB", delta_color="off")
+            if st.button("🗑️ 캐시 비우기"):
+                cache.purge()
+                st.success("✅ 캐시를 비웠습니다.")
+        
+        st.markdown("---")
+        st.subheader("🧩 챕터 템플릿")
+        st.caption("고객 정보 몇 개에만 달린 챕터(예: 행운의 방향과 색상)는 버킷 컬럼 값이 같은 고객끼리 공통 본문을 한 번만 생성해 재사용하고, 고객마다는 짧은 맞춤 도입부만 생성합니다. 목차/지침/페이지 수/모델이 바뀌면 새로 만듭니다. Batch API 모드에는 적용되지 않습니다.")
+        
+        template_config = dict(st.session_state.settings.get("chapter_templates") or {})
+        template_store = get_template_store()
+        setting_guides = st.session_state.settings.get("guides", {})
+        for service in SERVICE_TYPES:
+            service_config = template_config.get(service) or {}
+            service_chapters = setting_guides.get(service, {}).get("목차", [])
+            with st.expander(f"{service} ({len(service_config.get('chapters') or [])}개 챕터)"):
+                templated = st.multiselect(
+                    "템플릿으로 만들 챕터",
+                    service_chapters,
+                    default=[chapter for chapter in service_config.get("chapters") or [] if chapter in service_chapters],
+                    key=f"template_chapters_{service}"
+                )
+                bucket_keys = st.text_input(
+                    "버킷 컬럼 (쉼표로 구분)",
+                    value=", ".join(service_config.get("bucket_keys") or []),
+                    key=f"template_buckets_{service}",
+                    help="업로드한 엑셀의 컬럼 이름. 이 컬럼 값이 모두 같은 고객끼리 공통 본문을 함께 씁니다. 비우면 그 챕터는 모든 고객이 같은 본문을 씁니다."
+                )
+                sheet_columns_seen = st.session_state.get("sheet_columns")
+                if sheet_columns_seen is not None:
+                    missing_buckets = ChapterTemplates([], [key.strip() for key in bucket_keys.split(",")], template_store).missing_keys(sheet_columns_seen)
+                    if missing_buckets:
+                        st.warning(f"⚠️ 지금 업로드한 시트에 없는 컬럼: {', '.join(missing_buckets)} (이대로 두면 PDF 생성을 시작할 수 없습니다)")
+            template_config[service] = {
+                "chapters": templated,
+                "bucket_keys": [key.strip() for key in bucket_keys.split(",") if key.strip()]
+            }
+        
+        template_stats = template_store.stats()
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            st.metric("저장된 공통 본문", f"{template_stats['templates']}개", f"사용 {template_stats['uses']:,}회", delta_color="off")
+        with col2:
+            if st.button("🗑️ 템플릿 비우기"):
+                template_store.clear()
+                st.success("✅ 공통 본문을 모두 지웠습니다.")
+        if template_stats["templates"]:
+            with st.expander("📋 저장된 공통 본문"):
+                st.dataframe(pd.DataFrame(template_store.rows()), use_container_width=True)
+        
+        st.markdown("---")
+        st.subheader("🖼️ 배경 이미지")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            bg_image_dpi = st.number_input(
+                "해상도 (DPI)",
+                min_value=72,
+                max_value=300,
+                step=6,
+                value=int(st.session_state.settings.get("bg_image_dpi", BG_IMAGE_DPI)),
+                help="A4 기준 해상도. 150이면 화면/인쇄 모두 충분하고 PDF 용량이 크게 줄어듭니다."
+            )
+        with col2:
+            bg_jpeg_quality = st.slider(
+                "JPEG 품질",
+                min_value=40,
+                max_value=95,
+                value=int(st.session_state.settings.get("bg_jpeg_quality", BG_JPEG_QUALITY))
+            )
+        
+        image_report = background_image_report(int(bg_image_dpi), int(bg_jpeg_quality))
+        if image_report:
+            st.dataframe(pd.DataFrame(image_report), use_container_width=True)
+        
+        render_processes = st.number_input(
+            "PDF 렌더링 프로세스 수",
+            min_value=0,
+            max_value=max(1, os.cpu_count() or 1),
+            value=int(st.session_state.settings.get("render_processes", RENDER_PROCESSES)),
+            help="0이면 기존처럼 바로 렌더링합니다. 1 이상이면 별도 프로세스에서 렌더링해 여러 고객의 PDF를 CPU 코어 수만큼 동시에 만들고, 그동안 다른 고객의 GPT 생성도 계속 진행됩니다."
+        )
+        
+        file_output = st.checkbox(
+            "💽 PDF를 디스크에 바로 저장",
+            value=st.session_state.settings.get("file_output", True),
+            help=f"PDF를 메모리 대신 {OUTPUT_DIR} 폴더에 바로 쓰고, 이메일 첨부와 다운로드도 파일에서 조각씩 읽습니다. 고객이 많을 때 메모리 사용량이 일정하게 유지됩니다."
+        )
+        
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            output_retention_days = st.number_input(
+                "🧹 PDF 보관 기간 (일)",
+                min_value=0,
+                max_value=3650,
+                value=int(st.session_state.settings.get("output_retention_days", OUTPUT_RETENTION_DAYS)),
+                help=f"{OUTPUT_DIR}의 PDF 중 이 기간이 지난 파일을 워커가 쉬는 동안 지웁니다. 메일 발송을 기다리는 첨부는 남깁니다. 0이면 지우지 않습니다."
+            )
+        with col2:
+            if st.button("🧹 지금 정리"):
+                removed, freed = sweep_output_dir(int(output_retention_days))
+                st.success(f"✅ PDF {removed}개 삭제 ({freed / 1024 / 1024:.1f} MB)")
+        
+        trace_enabled = st.checkbox(
+            "📈 성능 기록",
+            value=st.session_state.settings.get("trace_enabled", True),
+            help=f"단계별 소요 시간(프롬프트 구성, GPT 호출, 레이아웃, PDF 렌더링, 메일 발송)을 {TRACE_FILE}에 기록하고 '성능' 탭에 요약합니다. 파일이 {TRACE_MAX_MB}MB를 넘으면 이전 기록부터 정리됩니다."
+        )
+        
+        with st.expander("⚡ 자산 캐시 (폰트/글자 폭/배경 이미지)"):
+            st.dataframe(pd.DataFrame(get_assets().stats()), use_container_width=True)
+            if st.button("🔄 자산 다시 읽기"):
+                get_assets().reset()
+                st.rerun()
         
         st.markdown("---")
         
         if st.button("💾 설정 저장", type="primary"):
             st.session_state.settings["api_key"] = api_key
             st.session_state.settings["model"] = model
+            st.session_state.settings["llm_backend"] = llm_backend
+            st.session_state.settings["llm_base_url"] = llm_base_url.strip()
+            st.session_state.settings["fake_llm"] = fake_llm
+            st.session_state.settings["max_workers"] = int(max_workers)
+            st.session_state.settings["rate_limits"] = rate_limits
+            st.session_state.settings["max_retries"] = int(max_retries)
+            st.session_state.settings["context_summary_tokens"] = int(context_summary_tokens)
+            st.session_state.settings["job_spend_cap_usd"] = float(job_spend_cap)
+            st.session_state.settings["daily_spend_cap_usd"] = float(daily_spend_cap)
+            st.session_state.settings["cache_ttl_days"] = int(cache_ttl_days)
+            st.session_state.settings["cache_max_mb"] = int(cache_max_mb)
+            st.session_state.settings["chapter_templates"] = template_config
+            st.session_state.settings["bg_image_dpi"] = int(bg_image_dpi)
+            st.session_state.settings["bg_jpeg_quality"] = int(bg_jpeg_quality)
+            st.session_state.settings["render_processes"] = int(render_processes)
+            st.session_state.settings["file_output"] = file_output
+            st.session_state.settings["output_retention_days"] = int(output_retention_days)
+            st.session_state.settings["trace_enabled"] = trace_enabled
             st.session_state.settings["gmail_address"] = gmail_address
             st.session_state.settings["gmail_app_password"] = gmail_password
+            st.session_state.settings["smtp_host"] = smtp_host.strip() or SMTP_HOST
+            st.session_state.settings["smtp_port"] = int(smtp_port)
+            st.session_state.settings["smtp_starttls"] = smtp_starttls
+            st.session_state.settings["email_daily_quota"] = int(email_daily_quota)
+            st.session_state.settings["email_max_attempts"] = int(email_max_attempts)
             save_settings(st.session_state.settings)
             st.success("✅ 설정 저장 완료!")
 
@@ -861,6 +6447,21 @@ def show_main_app():
 # ============================================
 
 def main():
+    # python app.py worker → Streamlit 없이 백그라운드 워커로 실행
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        run_worker()
+        return
+    
+    # python app.py batch → Batch API로 제출한 작업이 끝날 때까지 확인 후 PDF 생성
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        run_batch_poller()
+        return
+    
+    # python app.py mock-llm [포트] → 부하 테스트용 OpenAI 호환 가짜 서버
+    if len(sys.argv) > 1 and sys.argv[1] == "mock-llm":
+        run_mock_llm_server(int(sys.argv[2]) if len(sys.argv) > 2 else MOCK_LLM_PORT)
+        return
+    
     st.set_page_config(
         page_title="PDF 자동 생성 시스템",
         page_icon="🔮",
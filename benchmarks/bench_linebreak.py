@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+줄바꿈 마이크로 벤치마크
+- 기존 방식: 한 글자씩 줄이며 stringWidth 재계산 (문단당 O(n²))
+- LineBreaker: 글자별 폭 누적합 + 이진 탐색
+두 방식의 줄 결과가 같은지 확인하고 소요 시간을 비교
+
+실행: python benchmarks/bench_linebreak.py [--paragraphs 300] [--length 600]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+
+import app
+
+SAMPLE_WORDS = (
+    "당신은 타고난 기질이 강하며, 주변 사람들에게 신뢰를 받습니다. "
+    "올해는 새로운 기회가 찾아오는 시기입니다. 특히 3월과 9월에는 재물의 흐름이 좋아집니다. "
+    "오행 중 목(木)의 기운이 강하고 금(金)의 기운이 약해 균형을 맞추는 것이 중요합니다. "
+    "대인관계에서는 솔직함이 장점이지만, 때로는 한 걸음 물러서는 여유가 필요합니다."
+).split(" ")
+
+def make_paragraphs(count, length, seed=0):
+    """length자 안팎의 한국어 문단 count개"""
+    rng = random.Random(seed)
+    paragraphs = []
+    for _ in range(count):
+        words = []
+        total = 0
+        while total < length:
+            word = rng.choice(SAMPLE_WORDS)
+            words.append(word)
+            total += len(word) + 1
+        paragraphs.append(" ".join(words).strip())
+    return paragraphs
+
+def naive_break_lines(text, font_name, font_size, max_width):
+    """create_pdf_with_toc의 이전 줄바꿈 루프 (비교 기준)"""
+    lines = []
+    words = text
+    while words:
+        if pdfmetrics.stringWidth(words, font_name, font_size) <= max_width:
+            lines.append(words)
+            break
+        
+        cut = len(words)
+        while cut > 0 and pdfmetrics.stringWidth(words[:cut], font_name, font_size) > max_width:
+            cut -= 1
+        
+        if cut > 10:
+            space = words[:cut].rfind(' ')
+            comma = words[:cut].rfind(',')
+            period = words[:cut].rfind('.')
+            best_cut = max(space, comma, period)
+            if best_cut > cut * 0.5:
+                cut = best_cut + 1
+        
+        lines.append(words[:cut])
+        words = words[cut:].strip()
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="줄바꿈 마이크로 벤치마크")
+    parser.add_argument("--paragraphs", type=int, default=300)
+    parser.add_argument("--length", type=int, default=600, help="문단당 글자 수")
+    args = parser.parse_args()
+    
+    assets = app.get_assets()
+    font_name = assets.font_name()
+    if font_name != app.FONT_NAME:
+        print(f"⚠️ {app.FONT_PATH} 없음 - {font_name}로 측정")
+    
+    font_size = app.PDF_FONT_SIZE
+    max_width = A4[0] - app.PDF_MARGIN * 2
+    paragraphs = make_paragraphs(args.paragraphs, args.length)
+    breaker = assets.line_breaker(font_name)
+    
+    start = time.perf_counter()
+    naive_lines = [naive_break_lines(p, font_name, font_size, max_width) for p in paragraphs]
+    naive_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    fast_lines = [breaker.break_lines(p, font_size, max_width) for p in paragraphs]
+    fast_seconds = time.perf_counter() - start
+    
+    identical = naive_lines == fast_lines
+    total_lines = sum(len(lines) for lines in fast_lines)
+    
+    print(f"폰트: {font_name} {font_size}pt, 문단 {len(paragraphs)}개 × 약 {args.length}자, 총 {total_lines}줄")
+    print(f"기존 방식   : {naive_seconds * 1000:9.1f} ms")
+    print(f"LineBreaker : {fast_seconds * 1000:9.1f} ms")
+    print(f"속도 향상   : {naive_seconds / fast_seconds:9.1f}배")
+    print(f"줄 결과 동일: {'예' if identical else '아니오'}")
+    
+    if not identical:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
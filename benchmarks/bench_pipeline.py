@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+단계별 파이프라인 벤치마크
+- generate: generate_full_content (가짜 LLM 백엔드, 기본은 대기 없음 → 앱 쪽 처리 비용만)
+- wrap    : 챕터 본문 줄바꿈 (layout_text)
+- render  : create_pdf_with_toc (줄바꿈은 미리 해 둔 결과를 넘겨 그리기만 측정)
+- email   : send_email_with_attachment → 로컬 SMTP 싱크 (별도 프로세스)
+
+20/100/300쪽 분량의 한국어 합성 원고로 단계마다 실측 시간, CPU 시간,
+최대 메모리(tracemalloc, 별도 1회), PDF 크기를 재고 JSON 이력에 추가.
+같은 단계/쪽수의 최근 기록 중앙값보다 --threshold 이상 느려지거나 커지면 회귀로 표시
+
+실행: python benchmarks/bench_pipeline.py [--pages 20 100 300] [--stages generate wrap render email]
+      [--repeat 3] [--history benchmarks/history.json] [--threshold 0.2] [--fail-on-regression]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+STAGES = ["generate", "wrap", "render", "email"]
+METRICS = ["wall_seconds", "cpu_seconds", "peak_mb", "pdf_kb"]
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")
+BASELINE_RUNS = 5  # 회귀 판단에 쓰는 최근 기록 수
+NOISE_FLOOR = {"wall_seconds": 0.05, "cpu_seconds": 0.05, "peak_mb": 1.0, "pdf_kb": 1.0}  # 이보다 작은 차이는 측정 잡음으로 봄
+
+# ============================================
+# 합성 원고
+# ============================================
+
+def make_corpus(chapters, total_pages, seed=0):
+    """쪽수 × CHARS_PER_PAGE 글자를 챕터에 나눈 [{title, content}] (소제목 + 문단)"""
+    rng = random.Random(seed)
+    chars_per_chapter = total_pages * app.CHARS_PER_PAGE // max(1, len(chapters))
+    corpus = []
+    for title in chapters:
+        paragraphs = []
+        total = 0
+        while total < chars_per_chapter:
+            if len(paragraphs) % 6 == 0:
+                paragraph = f"**{rng.choice(app.FAKE_SENTENCES)[:14].strip()}**"
+            else:
+                paragraph = " ".join(rng.choice(app.FAKE_SENTENCES) for _ in range(rng.randint(3, 6)))
+            paragraphs.append(paragraph)
+            paragraphs.append("")
+            total += len(paragraph) + 2
+        corpus.append({"title": title, "content": "\n".join(paragraphs).strip()})
+    return corpus
+
+# ============================================
+# 로컬 SMTP 싱크 (받은 메일은 버리고 크기만 셈)
+# ============================================
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+        self.wfile.flush()
+    
+    def handle(self):
+        self.reply("220 bench-sink ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.wfile.write(b"250-bench-sink\r\n250-8BITMIME\r\n250 SIZE 104857600\r\n")
+                self.wfile.flush()
+            elif command.startswith("DATA"):
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                self.reply("250 OK")
+            elif command.startswith("QUIT"):
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+def run_smtp_sink(port_queue):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SmtpSinkHandler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+def start_smtp_sink():
+    """별도 프로세스에서 싱크 실행 (싱크의 CPU 시간이 측정에 섞이지 않도록) → (프로세스, 포트)"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_smtp_sink, args=(port_queue,), daemon=True)
+    process.start()
+    return process, port_queue.get(timeout=30)
+
+# ============================================
+# 단계
+# ============================================
+
+class StageContext:
+    """쪽수 1개에 대한 단계 간 공유 상태 (원고, 줄바꿈 결과, PDF 경로)"""
+    
+    def __init__(self, args, pages, workdir, smtp_port):
+        self.args = args
+        self.pages = pages
+        self.workdir = workdir
+        self.smtp_port = smtp_port
+        guide = app.get_default_guides()[args.service]
+        self.chapters = guide["목차"]
+        self.guide = guide["지침"]
+        self.corpus = make_corpus(self.chapters, pages, args.seed)
+        self.font_name, self.font_size, self.max_width = app.body_layout_params()
+        self.line_breaker = app.get_assets().line_breaker(self.font_name)
+        self.pdf_path = os.path.join(workdir, f"bench_{pages}.pdf")
+    
+    def laid_out_corpus(self):
+        """render 단계용 - 줄바꿈을 미리 끝낸 챕터 (create_pdf_with_toc가 줄바꿈 생략)"""
+        layout_key = (self.font_name, self.font_size, self.max_width)
+        return [
+            {**chapter, "layout_key": layout_key, "layout": app.layout_text(chapter["content"], self.line_breaker, self.font_size, self.max_width)}
+            for chapter in self.corpus
+        ]
+
+def stage_generate(ctx):
+    client = app.FakeLLMClient({
+        "error_rate": 0.0,
+        "rate_limit_rate": 0.0,
+        "time_scale": ctx.args.llm_time_scale,
+        "seed": ctx.args.seed
+    })
+    customer_data = {"이름": "벤치고객", "생년월일": "1990-01-01", "고민": "진로"}
+    def run():
+        app.generate_full_content(
+            client, "gpt-4o-mini", customer_data, ctx.chapters, ctx.pages, ctx.guide, ctx.args.service,
+            max_workers=ctx.args.workers, use_cache=False
+        )
+        return {}
+    return run
+
+def stage_wrap(ctx):
+    def run():
+        for chapter in ctx.corpus:
+            app.layout_text(chapter["content"], ctx.line_breaker, ctx.font_size, ctx.max_width)
+        return {}
+    return run
+
+def stage_render(ctx):
+    chapters_content = ctx.laid_out_corpus()
+    def run():
+        app.create_pdf_with_toc(chapters_content, "벤치고객", ctx.args.service, output_path=ctx.pdf_path)
+        return {"pdf_kb": os.path.getsize(ctx.pdf_path) / 1024}
+    return run
+
+def stage_email(ctx):
+    if not os.path.exists(ctx.pdf_path):
+        app.create_pdf_with_toc(ctx.laid_out_corpus(), "벤치고객", ctx.args.service, output_path=ctx.pdf_path)
+    subject, body = app.make_email_content("벤치고객", ctx.args.service)
+    def run():
+        ok, message = app.send_email_with_attachment(
+            "customer@example.com", subject, body, ctx.pdf_path, os.path.basename(ctx.pdf_path),
+            "bench@example.com", "", smtp_host="127.0.0.1", smtp_port=ctx.smtp_port, smtp_starttls=False
+        )
+        if not ok:
+            raise RuntimeError(f"메일 발송 실패: {message}")
+        return {"pdf_kb": os.path.getsize(ctx.pdf_path) / 1024}
+    return run
+
+STAGE_FUNCS = {
+    "generate": stage_generate,
+    "wrap": stage_wrap,
+    "render": stage_render,
+    "email": stage_email
+}
+
+def measure(run, repeat, track_memory=True):
+    """repeat회 실행한 실측/CPU 시간 중앙값 + tracemalloc을 켠 1회의 최대 메모리"""
+    walls = []
+    cpus = []
+    extra = {}
+    for _ in range(repeat):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        extra = run()
+        cpus.append(time.process_time() - cpu_start)
+        walls.append(time.perf_counter() - wall_start)
+    
+    result = {"wall_seconds": statistics.median(walls), "cpu_seconds": statistics.median(cpus)}
+    if track_memory:
+        # tracemalloc은 느려지므로 시간 측정과 따로 1회
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result["peak_mb"] = peak / (1024 * 1024)
+    result.update(extra)
+    return result
+
+# ============================================
+# 이력 / 회귀 판단
+# ============================================
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_history(path, history):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+def baseline(history, stage, pages, metric):
+    """같은 단계/쪽수의 최근 BASELINE_RUNS개 기록 중앙값 (기록 없으면 None)"""
+    values = []
+    for run in reversed(history):
+        for result in run["results"]:
+            if result["stage"] == stage and result["pages"] == pages and result.get(metric) is not None:
+                values.append(result[metric])
+        if len(values) >= BASELINE_RUNS:
+            break
+    return statistics.median(values[:BASELINE_RUNS]) if values else None
+
+def find_regressions(history, results, threshold):
+    """[(단계, 쪽수, 지표, 기준값, 이번 값)] - 기준보다 threshold 비율 이상 (그리고 잡음 이상) 커진 것"""
+    regressions = []
+    for result in results:
+        for metric in METRICS:
+            value = result.get(metric)
+            base = baseline(history, result["stage"], result["pages"], metric)
+            if value is None or not base:
+                continue
+            if value > base * (1 + threshold) and value - base > NOISE_FLOOR[metric]:
+                regressions.append((result["stage"], result["pages"], metric, base, value))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="단계별 파이프라인 벤치마크")
+    parser.add_argument("--pages", type=int, nargs="+", default=[20, 100, 300])
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--service", default="사주", choices=app.SERVICE_TYPES)
+    parser.add_argument("--repeat", type=int, default=3, help="단계마다 반복 횟수 (중앙값 사용)")
+    parser.add_argument("--workers", type=int, default=4, help="generate 단계 동시 호출 수")
+    parser.add_argument("--llm-time-scale", type=float, default=0.0, help="가짜 LLM 대기 시간 배율 (0이면 대기 없음)")
+    parser.add_argument("--no-memory", action="store_true", help="최대 메모리 측정 생략")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="결과를 추가할 JSON 이력 파일")
+    parser.add_argument("--no-save", action="store_true", help="이력에 저장하지 않고 비교만")
+    parser.add_argument("--threshold", type=float, default=0.2, help="회귀로 볼 증가 비율")
+    parser.add_argument("--fail-on-regression", action="store_true", help="회귀가 있으면 종료 코드 1")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    assets = app.get_assets()
+    font_name = assets.font_name()
+    if font_name != app.FONT_NAME:
+        print(f"⚠️ {app.FONT_PATH} 없음 - {font_name}로 측정")
+    
+    sink = None
+    smtp_port = None
+    if "email" in args.stages:
+        sink, smtp_port = start_smtp_sink()
+    
+    results = []
+    print(f"{'단계':<9} {'쪽수':>5} {'실측(초)':>9} {'CPU(초)':>9} {'메모리(MB)':>10} {'PDF(KB)':>9}")
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # 측정용 호출은 운영 성능 기록/사용량 장부에 남기지 않음
+            app.use_scratch_storage(workdir)
+            for pages in args.pages:
+                ctx = StageContext(args, pages, workdir, smtp_port)
+                for stage in args.stages:
+                    result = {"stage": stage, "pages": pages}
+                    result.update(measure(STAGE_FUNCS[stage](ctx), max(1, args.repeat), not args.no_memory))
+                    results.append(result)
+                    peak = f"{result['peak_mb']:10.1f}" if "peak_mb" in result else f"{'-':>10}"
+                    pdf = f"{result['pdf_kb']:9.0f}" if "pdf_kb" in result else f"{'-':>9}"
+                    print(f"{stage:<9} {pages:>5} {result['wall_seconds']:>9.3f} {result['cpu_seconds']:>9.3f} {peak} {pdf}", flush=True)
+    finally:
+        if sink:
+            sink.terminate()
+    
+    history = load_history(args.history)
+    regressions = find_regressions(history, results, args.threshold)
+    print()
+    if not history:
+        print("이전 기록 없음 - 이번 결과가 기준이 됩니다")
+    elif regressions:
+        print(f"⚠️ 회귀 {len(regressions)}건 (최근 {BASELINE_RUNS}회 중앙값 대비 +{args.threshold:.0%} 초과)")
+        for stage, pages, metric, base, value in regressions:
+            print(f"  {stage} {pages}쪽 {metric}: {base:.3f} → {value:.3f} (+{value / base - 1:.0%})")
+    else:
+        print(f"회귀 없음 (최근 {BASELINE_RUNS}회 중앙값 대비 +{args.threshold:.0%} 이내)")
+    
+    if not args.no_save:
+        history.append({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.node(),
+            "args": {"repeat": args.repeat, "workers": args.workers, "llm_time_scale": args.llm_time_scale, "seed": args.seed},
+            "results": results,
+            "regressions": [
+                {"stage": stage, "pages": pages, "metric": metric, "baseline": base, "value": value}
+                for stage, pages, metric, base, value in regressions
+            ]
+        })
+        save_history(args.history, history)
+        print(f"이력 저장: {args.history}")
+    
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+전체 파이프라인 부하 테스트 (API 비용 없음)
+- 가짜 LLM 백엔드(FakeLLMClient) 또는 OpenAI 호환 대역 서버(--base-url)로
+  BatchScheduler → (선택) PDF 렌더링까지 고객 N명을 처리
+- 동시 호출 수별로 처리량(고객/시간)과 고객 1명 지연 p50/p95를 비교
+
+지연은 --time-scale 배율로 줄여서 기다리고, 결과는 실제 시간으로 환산해 표시
+(PDF 렌더링은 줄이지 않은 실제 측정값)
+
+실행: python benchmarks/loadtest.py [--customers 20] [--pages 20] [--concurrency 4 8 16]
+      [--time-scale 0.02] [--error-rate 0.01] [--rate-limit-rate 0.01] [--pdf]
+      [--base-url http://127.0.0.1:8100/v1]  (python app.py mock-llm 으로 띄운 서버)
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+def percentile(values, q):
+    """정렬한 값에서 선형 보간한 q 분위수 (0~1)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def make_customers(count):
+    return [
+        {"이름": f"고객{i + 1}", "생년월일": f"19{70 + i % 30}-0{1 + i % 9}-1{i % 10}", "고민": ["진로", "재물", "연애", "건강"][i % 4]}
+        for i in range(count)
+    ]
+
+def make_client(args):
+    if args.base_url:
+        # 대역 서버의 지연/오류 설정은 서버 쪽 settings.json(fake_llm)을 따름
+        return app.make_llm_client({"llm_base_url": args.base_url})
+    return app.FakeLLMClient({
+        "latency_dist": args.latency_dist,
+        "latency_median": args.latency_median,
+        "latency_p95": args.latency_p95,
+        "tokens_per_second": args.tokens_per_second,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "output_ratio": args.output_ratio,
+        "time_scale": args.time_scale,
+        "seed": args.seed
+    })
+
+def run_once(args, concurrency, customers, chapters, guide, output_dir):
+    """동시 호출 수 1개 설정으로 고객 전체 처리 → 결과 dict"""
+    scale = args.time_scale if args.time_scale > 0 else 1.0
+    client = make_client(args)
+    # 분당 한도도 줄인 시간 기준으로 맞춤
+    rate_limiter = app.RateLimiter(args.rpm / scale, args.tpm / scale) if args.rpm else None
+    scheduler = app.BatchScheduler(client, args.model, concurrency, rate_limiter, args.max_attempts, None, False, args.stream)
+    
+    start = time.time()
+    for i, customer_data in enumerate(customers):
+        scheduler.submit_customer(f"c{i}", customer_data["이름"], customer_data, chapters, args.pages, guide, args.service)
+    scheduler.start()
+    
+    latencies = []
+    pdf_done = 0.0
+    failed_customers = 0
+    render_seconds = 0.0
+    try:
+        # UI와 같이 생성이 끝난 고객부터 이 스레드에서 PDF 렌더링
+        for job in scheduler.iter_completed(poll_interval=0.05):
+            generated = (job.finished_at - start) / scale
+            render = 0.0
+            if job.failures:
+                failed_customers += 1
+            elif args.pdf:
+                render_start = time.perf_counter()
+                app.create_pdf_with_toc(
+                    job.chapters_content(), job.name, args.service,
+                    output_path=os.path.join(output_dir, f"{job.key}.pdf")
+                )
+                render = time.perf_counter() - render_start
+                render_seconds += render
+            pdf_done = max(generated, pdf_done) + render
+            latencies.append((job.finished_at - job.started_at) / scale + render)
+    finally:
+        scheduler.stop()
+    
+    wall = time.time() - start
+    stats = client.stats() if hasattr(client, "stats") else {}
+    return {
+        "concurrency": concurrency,
+        "customers": len(customers),
+        "parts": scheduler.total_parts,
+        "api_calls": stats.get("calls", scheduler.concurrency.successes + scheduler.concurrency.retries),
+        "retries": scheduler.concurrency.retries,
+        "rate_limited": scheduler.concurrency.rate_limited,
+        "failed_customers": failed_customers,
+        "wall_seconds": wall,
+        "simulated_seconds": pdf_done,
+        "render_seconds": render_seconds,
+        "customers_per_hour": len(customers) / pdf_done * 3600 if pdf_done else 0.0,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="전체 파이프라인 부하 테스트 (가짜 LLM 백엔드)")
+    parser.add_argument("--customers", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--service", default="사주", choices=app.SERVICE_TYPES)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4, 8, 16], help="비교할 동시 호출 수")
+    parser.add_argument("--max-attempts", type=int, default=app.RETRY_MAX_ATTEMPTS)
+    parser.add_argument("--stream", action="store_true", help="스트리밍 생성으로 측정")
+    parser.add_argument("--pdf", action="store_true", help="PDF 렌더링까지 포함")
+    parser.add_argument("--rpm", type=int, default=0, help="분당 요청 한도 (0이면 한도 없음)")
+    parser.add_argument("--tpm", type=int, default=200000, help="분당 토큰 한도 (--rpm과 함께)")
+    parser.add_argument("--base-url", default="", help="OpenAI 호환 대역 서버 주소 (예: http://127.0.0.1:8100/v1)")
+    fake = app.FAKE_LLM_DEFAULTS
+    parser.add_argument("--latency-dist", default=fake["latency_dist"], choices=["lognormal", "uniform", "fixed"])
+    parser.add_argument("--latency-median", type=float, default=fake["latency_median"])
+    parser.add_argument("--latency-p95", type=float, default=fake["latency_p95"])
+    parser.add_argument("--tokens-per-second", type=float, default=fake["tokens_per_second"])
+    parser.add_argument("--error-rate", type=float, default=fake["error_rate"])
+    parser.add_argument("--rate-limit-rate", type=float, default=fake["rate_limit_rate"])
+    parser.add_argument("--output-ratio", type=float, default=fake["output_ratio"])
+    parser.add_argument("--time-scale", type=float, default=0.02, help="대기 시간 배율 (--base-url이면 서버 설정과 같게)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="", help="결과를 JSON 파일로 저장")
+    args = parser.parse_args()
+    
+    guide = app.get_default_guides()[args.service]
+    chapters = guide["목차"]
+    customers = make_customers(args.customers)
+    
+    backend = args.base_url or f"가짜 백엔드 (지연 {args.latency_dist} 중앙값 {args.latency_median}초/p95 {args.latency_p95}초, {args.tokens_per_second:g}토큰/초, 500 {args.error_rate:.0%}, 429 {args.rate_limit_rate:.0%})"
+    print(f"백엔드: {backend}")
+    print(f"고객 {args.customers}명 × {args.pages}쪽 ({len(chapters)}개 챕터), 대기 시간 ×{args.time_scale}, PDF {'포함' if args.pdf else '제외'}")
+    print()
+    print(f"{'동시':>4} {'호출':>6} {'재시도':>6} {'429':>5} {'실패 고객':>8} {'실측(초)':>9} {'환산(초)':>9} {'고객/시간':>9} {'p50(초)':>8} {'p95(초)':>8}")
+    
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        # 부하 테스트 호출은 운영 성능 기록/사용량 장부에 남기지 않음
+        app.use_scratch_storage(output_dir)
+        for concurrency in args.concurrency:
+            result = run_once(args, concurrency, customers, chapters, guide["지침"], output_dir)
+            results.append(result)
+            print(
+                f"{result['concurrency']:>4} {result['api_calls']:>6} {result['retries']:>6} {result['rate_limited']:>5} "
+                f"{result['failed_customers']:>8} {result['wall_seconds']:>9.1f} {result['simulated_seconds']:>9.1f} "
+                f"{result['customers_per_hour']:>9.1f} {result['latency_p50']:>8.1f} {result['latency_p95']:>8.1f}"
+            )
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n결과 저장: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+테스트 공통 설정
+
+app의 저장 경로(DATA_DIR="data")는 현재 폴더 기준이므로 테스트마다 임시 폴더로
+옮겨서 실행하고, 성능 기록/사용량 장부도 그 아래로 돌림 (운영 data/를 건드리지 않음)
+
+실행: python -m pytest -q tests  (pytest, 메일 테스트는 aiosmtpd 필요 - 없으면 건너뜀)
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+@pytest.fixture(autouse=True)
+def scratch_data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app.use_scratch_storage(str(tmp_path))
+    return tmp_path
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Batch API 흐름 테스트 (LocalBatchClient + FakeLLMClient, API 비용 없음)
+- 제출 → 결과 반영 → (보충 라운드) → PDF까지 끝나고
+- 배치 결과의 각 파트가 custom_id가 가리키는 고객/챕터/파트 저널 칸에 들어가는지
+"""
+
+import json
+import os
+
+import app
+
+FAKE_CONFIG = {"time_scale": 0, "error_rate": 0, "rate_limit_rate": 0}
+MODEL = "gpt-4o-mini"
+SERVICE = "사주"
+
+def make_payloads(chapters, guide, total_pages):
+    customers = [
+        {"이름": "김하나", "생년월일": "1990-01-01", "고민": "진로"},
+        {"이름": "이두리", "생년월일": "1985-07-15", "고민": "재물"}
+    ]
+    return [
+        {
+            "batch_id": "test",
+            "customer_name": customer["이름"],
+            "customer_name2": None,
+            "customer_email": None,
+            "customer_data": customer,
+            "service_type": SERVICE,
+            "model": MODEL,
+            "chapters": chapters,
+            "guide": guide,
+            "total_pages": total_pages,
+            "auto_email": False,
+            "use_cache": False
+        }
+        for customer in customers
+    ]
+
+def run_until_finished(client, run_id, settings):
+    store = app.get_batch_store()
+    for _ in range(app.BATCH_MAX_ROUNDS + 1):
+        run = store.get(run_id)
+        if run["status"] in ("done", "failed"):
+            return run
+        app.poll_batch_run(client, store, run, settings)
+    return store.get(run_id)
+
+def test_local_batch_fills_journal_slots(tmp_path):
+    guide = app.get_default_guides()[SERVICE]
+    chapters = guide["목차"][:4]
+    payloads = make_payloads(chapters, guide["지침"], 20)
+    settings = {"file_output": True}
+    client = app.LocalBatchClient(app.FakeLLMClient(FAKE_CONFIG), str(tmp_path / "local"))
+    
+    run_id = app.submit_batch_run(client, payloads, settings, "test", "local")
+    run = run_until_finished(client, run_id, settings)
+    
+    assert run["status"] == "done", run["message"]
+    
+    # 모든 라운드 배치 입력의 custom_id → 요청 본문 (같은 요청이면 FakeLLMClient 답도 같음)
+    requests = {}
+    for name in os.listdir(app.BATCH_DIR):
+        if name.startswith(run_id) and name.endswith(".jsonl"):
+            with open(os.path.join(app.BATCH_DIR, name), encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    requests[record["custom_id"]] = record["body"]
+    
+    reference = app.FakeLLMClient(FAKE_CONFIG)
+    for payload, job in app.batch_jobs(payloads):
+        parts = job.journal.completed_parts()
+        assert job.journal.is_done()
+        for ch_idx in range(len(chapters)):
+            # 본문 파트는 모두 제자리에 있어야 함 (보충 파트는 분량에 따라 0개 이상)
+            for part in range(1, job.parts_per_chapter + 1):
+                assert (ch_idx, part) in parts
+        
+        for (ch_idx, part), content in parts.items():
+            if not content:
+                continue
+            body = requests[f"{job.key}:{ch_idx}:{part}"]
+            # 요청이 이 고객/챕터/파트의 것인지
+            assert payload["customer_data"]["이름"] in body["messages"][0]["content"]
+            assert chapters[ch_idx] in body["messages"][1]["content"]
+            expected = reference.chat.completions.create(**body).choices[0].message.content
+            assert content == expected
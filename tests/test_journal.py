@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+작업 저널(JobJournal) 테스트 (FakeLLMClient, API 비용 없음)
+- 중단된 실행을 다시 돌리면 저널에 남은 파트는 API를 부르지 않고 이어받음
+- PDF까지 끝난(done) 고객은 건너뜀
+- 저널 기록이 실패하면 그 파트만 실패로 끝나고 배치는 멈추지 않음
+"""
+
+import app
+from test_scheduler import FAKE_CONFIG, MODEL, SERVICE, run_scheduler
+
+CUSTOMER = {"이름": "김하나", "생년월일": "1990-01-01"}
+
+class InterruptedClient(app.FakeLLMClient):
+    """limit번 답한 뒤부터는 재시도 안 되는 오류 (실행 중단 흉내)"""
+    
+    def __init__(self, limit):
+        super().__init__(FAKE_CONFIG)
+        self.limit = limit
+    
+    def create(self, *args, **kwargs):
+        if self.calls >= self.limit:
+            raise ValueError("프로세스 중단")
+        return super().create(*args, **kwargs)
+
+class BrokenJournal(app.JobJournal):
+    """파트 기록 때 디스크가 가득 찬 것처럼 실패하는 저널"""
+    
+    def record_part(self, ch_idx, part_num, content):
+        raise OSError(28, "No space left on device")
+
+def customer_journal(tmp_path, pages=20):
+    guide = app.get_default_guides()[SERVICE]
+    return app.JobJournal.for_customer(MODEL, SERVICE, CUSTOMER, guide["목차"][:3], guide["지침"], pages, str(tmp_path / "jobs"))
+
+def test_interrupted_run_resumes_without_calling_finished_parts(tmp_path):
+    finished = 4
+    done, errors = run_scheduler([CUSTOMER], journals=[customer_journal(tmp_path)], max_workers=1, client=InterruptedClient(finished))
+    assert errors == []
+    assert done[0].status == "생성 실패"
+    saved = customer_journal(tmp_path).completed_parts()
+    assert len(saved) == finished
+    
+    client = app.FakeLLMClient(FAKE_CONFIG)
+    done, errors = run_scheduler([CUSTOMER], journals=[customer_journal(tmp_path)], client=client)
+    
+    assert errors == []
+    job = done[0]
+    assert job.status == "생성 완료"
+    assert job.resumed_parts == finished
+    # 남은 파트만 API 호출
+    assert client.calls == job.total_parts - finished
+    for (ch_idx, part), content in saved.items():
+        assert job.results[ch_idx][part - 1] == content
+    assert len(customer_journal(tmp_path).completed_parts()) == job.total_parts
+
+def test_finished_customer_is_skipped(tmp_path):
+    journal = customer_journal(tmp_path)
+    journal.mark_done(pdf="김하나_사주.pdf")
+    client = app.FakeLLMClient(FAKE_CONFIG)
+    
+    done, errors = run_scheduler([CUSTOMER], journals=[customer_journal(tmp_path)], client=client)
+    
+    assert errors == []
+    job = done[0]
+    assert job.skipped
+    assert job.status == "건너뜀"
+    assert client.calls == 0
+
+def test_journal_write_error_fails_customer_without_hanging(tmp_path):
+    customers = [{"이름": "김하나"}, {"이름": "이두리"}]
+    journals = [BrokenJournal("broken", str(tmp_path / "jobs")), app.JobJournal("ok", str(tmp_path / "jobs"))]
+    
+    done, errors = run_scheduler(customers, journals=journals)
+    
+    assert errors == []
+    by_name = {job.name: job for job in done}
+    broken = by_name["김하나"]
+    assert broken.status == "생성 실패"
+    assert broken.failures and all(isinstance(failure.error, OSError) for failure in broken.failures)
+    assert broken.remaining == 0
+    # 다른 고객은 영향 없음
+    assert by_name["이두리"].status == "생성 완료"
+    assert len(journals[1].completed_parts()) == by_name["이두리"].total_parts
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+메일 발송 테스트 (로컬 aiosmtpd 서버)
+- send_message_with_file_attachment: 조각씩 보낸 첨부가 받은 쪽에서 원본과 같은지
+- MailSender: 4xx → 재시도 대기, 5xx → 실패, 발송 한도 → 남은 메일은 대기열에 보관
+- 발송 완료 목록을 정리해도 하루 발송 한도는 그대로
+"""
+
+import os
+import socket
+import time
+from email import message_from_bytes, policy
+
+import pytest
+
+import app
+
+pytest.importorskip("aiosmtpd")
+from aiosmtpd.controller import Controller
+
+SENDER = "sender@example.com"
+
+class RecordingHandler:
+    """받은 메일을 모아 두는 SMTP 서버 핸들러
+    
+    받는 주소 앞부분으로 응답을 고름: busy → 450, nouser → 550, limit → DATA에서 550 5.4.5
+    """
+    
+    def __init__(self):
+        self.messages = []
+    
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("busy"):
+            return "450 4.2.1 Mailbox busy, try again later"
+        if address.startswith("nouser"):
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+    
+    async def handle_DATA(self, server, session, envelope):
+        if any(rcpt.startswith("limit") for rcpt in envelope.rcpt_tos):
+            return "550 5.4.5 Daily user sending limit exceeded"
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    try:
+        yield handler, controller.port
+    finally:
+        controller.stop()
+
+def mail_settings(port, **overrides):
+    return {
+        "smtp_host": "127.0.0.1",
+        "smtp_port": port,
+        "smtp_starttls": False,
+        "gmail_address": SENDER,
+        "gmail_app_password": "",
+        **overrides
+    }
+
+def make_attachment(name, size):
+    path = app.make_output_path("test", name)
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path
+
+def enqueue(outbox, to_email, path):
+    return outbox.enqueue("고객", to_email, "[사주] 감정서", "본문", path, os.path.basename(path))
+
+def test_file_attachment_round_trip(smtp_server):
+    handler, port = smtp_server
+    # 조각 경계가 여러 번 걸치고 마지막 조각이 짧은 크기
+    path = make_attachment("홍길동_사주.pdf", app.EMAIL_CHUNK_BYTES * 3 + 123)
+    with open(path, "rb") as f:
+        original = f.read()
+    
+    ok, message = app.send_email_with_attachment(
+        "customer@example.com", "[사주] 홍길동님의 감정서", "첨부를 확인해주세요.", path, "홍길동_사주.pdf",
+        SENDER, "", "127.0.0.1", port, False
+    )
+    
+    assert ok, message
+    assert len(handler.messages) == 1
+    envelope = handler.messages[0]
+    assert envelope.mail_from == SENDER
+    assert envelope.rcpt_tos == ["customer@example.com"]
+    
+    received = message_from_bytes(envelope.original_content, policy=policy.default)
+    assert received["Subject"] == "[사주] 홍길동님의 감정서"
+    assert received.get_body(("plain",)).get_content().strip() == "첨부를 확인해주세요."
+    attachments = list(received.iter_attachments())
+    assert len(attachments) == 1
+    assert attachments[0].get_filename() == "홍길동_사주.pdf"
+    assert attachments[0].get_payload(decode=True) == original
+
+def test_transient_error_is_retried_later(smtp_server):
+    handler, port = smtp_server
+    outbox = app.get_email_outbox()
+    message_id = enqueue(outbox, "busy@example.com", make_attachment("a.pdf", 1000))
+    mailer = app.MailSender(outbox, mail_settings(port))
+    
+    result = mailer.deliver_pending()
+    mailer.close()
+    
+    assert result["retry"] == 1 and result["sent"] == 0 and result["failed"] == 0
+    row = outbox.get(message_id)
+    assert row["status"] == "queued"
+    assert row["attempts"] == 1
+    assert "450" in row["last_error"]
+    assert row["next_attempt_at"] > time.time()
+    assert handler.messages == []
+
+def test_transient_error_fails_after_max_attempts(smtp_server):
+    _, port = smtp_server
+    outbox = app.get_email_outbox()
+    message_id = enqueue(outbox, "busy@example.com", make_attachment("a.pdf", 1000))
+    mailer = app.MailSender(outbox, mail_settings(port, email_max_attempts=1))
+    
+    result = mailer.deliver_pending()
+    mailer.close()
+    
+    assert result["failed"] == 1
+    assert outbox.get(message_id)["status"] == "failed"
+
+def test_permanent_error_fails_and_next_mail_is_sent(smtp_server):
+    handler, port = smtp_server
+    outbox = app.get_email_outbox()
+    rejected = enqueue(outbox, "nouser@example.com", make_attachment("a.pdf", 1000))
+    accepted = enqueue(outbox, "ok@example.com", make_attachment("b.pdf", 1000))
+    mailer = app.MailSender(outbox, mail_settings(port))
+    
+    result = mailer.deliver_pending()
+    mailer.close()
+    
+    assert result["failed"] == 1 and result["sent"] == 1
+    row = outbox.get(rejected)
+    assert row["status"] == "failed"
+    assert "550" in row["last_error"]
+    assert outbox.get(accepted)["status"] == "sent"
+    # 거절 뒤에도 같은 연결(RSET)로 다음 메일을 보냄
+    assert mailer.connection.connects == 1
+    assert [envelope.rcpt_tos for envelope in handler.messages] == [["ok@example.com"]]
+
+def test_daily_quota_holds_remaining_mail(smtp_server):
+    handler, port = smtp_server
+    outbox = app.get_email_outbox()
+    first = enqueue(outbox, "one@example.com", make_attachment("a.pdf", 1000))
+    second = enqueue(outbox, "two@example.com", make_attachment("b.pdf", 1000))
+    mailer = app.MailSender(outbox, mail_settings(port, email_daily_quota=1))
+    
+    result = mailer.deliver_pending()
+    mailer.close()
+    
+    assert result["sent"] == 1
+    assert "한도" in result["stopped"]
+    assert outbox.get(first)["status"] == "sent"
+    row = outbox.get(second)
+    assert row["status"] == "queued" and row["attempts"] == 0
+    assert len(handler.messages) == 1
+
+def test_clearing_sent_list_keeps_daily_quota(smtp_server):
+    handler, port = smtp_server
+    outbox = app.get_email_outbox()
+    enqueue(outbox, "one@example.com", make_attachment("a.pdf", 1000))
+    mailer = app.MailSender(outbox, mail_settings(port, email_daily_quota=1))
+    assert mailer.deliver_pending()["sent"] == 1
+    
+    # 발송 완료 목록을 지워도 오늘 보낸 수는 그대로
+    outbox.clear_sent()
+    assert outbox.sent_today() == 1
+    assert mailer.quota_left() == 0
+    
+    waiting = enqueue(outbox, "two@example.com", make_attachment("b.pdf", 1000))
+    result = mailer.deliver_pending()
+    mailer.close()
+    
+    assert result["sent"] == 0
+    assert "한도" in result["stopped"]
+    assert outbox.get(waiting)["status"] == "queued"
+    assert len(handler.messages) == 1
+
+def test_sending_limit_reply_stops_and_keeps_mail_queued(smtp_server):
+    handler, port = smtp_server
+    outbox = app.get_email_outbox()
+    limited = enqueue(outbox, "limit@example.com", make_attachment("a.pdf", 1000))
+    waiting = enqueue(outbox, "ok@example.com", make_attachment("b.pdf", 1000))
+    mailer = app.MailSender(outbox, mail_settings(port))
+    
+    result = mailer.deliver_pending()
+    mailer.close()
+    
+    assert "5.4.5" in result["stopped"]
+    assert result["sent"] == 0 and result["failed"] == 0
+    # 시도 횟수를 쓰지 않고 둘 다 대기열로 돌아감 (내일 다시 발송)
+    for message_id in (limited, waiting):
+        row = outbox.get(message_id)
+        assert row["status"] == "queued" and row["attempts"] == 0
+    assert handler.messages == []
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+분량 계획 테스트
+- estimate_tokens: 한글은 모델별 비율, 영문/숫자는 4글자≈1토큰, 공백 제외, 문장부호/줄바꿈 1토큰
+- plan_chapter_parts: 20 / 100 / 300페이지의 챕터당 파트 수와 파트당 글자 수
+- plan_topup_parts: 목표보다 TOPUP_TOLERANCE 넘게 짧을 때부터 보충 호출
+"""
+
+import math
+
+import pytest
+
+import app
+
+CHAPTERS = [f"챕터 {i}" for i in range(1, 11)]
+
+def test_estimate_tokens_hangul_by_model():
+    text = "가" * 100
+    assert app.estimate_tokens(text, "gpt-4o-mini") == 80
+    assert app.estimate_tokens(text, "gpt-4-turbo") == 130
+    # 모르는 모델은 1글자 1토큰
+    assert app.estimate_tokens(text, "unknown-model") == 100
+
+def test_estimate_tokens_mixed_text():
+    assert app.estimate_tokens("abcd efgh") == 2
+    # 한글 3글자(2.4) + 마침표 + 줄바꿈 → 올림
+    assert app.estimate_tokens("가나다.\n", "gpt-4o-mini") == 5
+    assert app.estimate_tokens("") == 0
+
+@pytest.mark.parametrize("pages, parts, chars", [
+    (20, 1, 1600),
+    (100, 4, 2000),
+    (300, 10, 2400)
+])
+def test_plan_chapter_parts(pages, parts, chars):
+    target = app.chapter_target_chars(CHAPTERS, pages)
+    assert target == pages * app.CHARS_PER_PAGE // len(CHAPTERS)
+    assert app.plan_chapter_parts(CHAPTERS, pages) == (parts, chars)
+    # 파트를 다 받으면 목표를 채우고, 한 번에 요청하는 양은 상한 이내
+    assert parts * chars >= target
+    assert chars <= app.MAX_CHARS_PER_CALL
+
+def test_plan_chapter_parts_rounds_up():
+    # 목표 2,501자는 2,500자 1번이 아니라 2번으로 나눔
+    chapters = ["챕터"]
+    pages = 2501 / app.CHARS_PER_PAGE
+    assert app.chapter_target_chars(chapters, pages) == 2501
+    assert app.plan_chapter_parts(chapters, pages) == (2, 1300)
+
+def test_topup_starts_past_tolerance():
+    target = 1000
+    limit = target - int(target * app.TOPUP_TOLERANCE)
+    assert app.plan_topup_parts(limit, target, 1000, 0) == []
+    assert app.plan_topup_parts(limit - 1, target, 1000, 0) == [app.TOPUP_MIN_CHARS]
+    assert app.plan_topup_parts(target, target, 1000, 0) == []
+
+def test_topup_scales_with_yield_and_call_limit():
+    target = 6000
+    # 모델이 요청의 절반만 쓰면 모자란 2,000자를 채우려고 4,000자를 요청
+    assert app.plan_topup_parts(target - 2000, target, 2000, 0, yield_ratio=0.5) == [2000, 2000]
+    # 크게 모자라도 MAX_TOPUP_PARTS번, 1번에 MAX_CHARS_PER_CALL자까지
+    plan = app.plan_topup_parts(0, target * 10, 2000, 0)
+    assert plan == [app.MAX_CHARS_PER_CALL] * app.MAX_TOPUP_PARTS
+    # 보충 호출을 다 쓴 챕터는 더 늘리지 않음
+    assert app.plan_topup_parts(0, target, 2000, app.MAX_TOPUP_PARTS) == []
+    assert len(app.plan_topup_parts(0, target, 2000, app.MAX_TOPUP_PARTS - 1)) == 1
+
+def test_topup_calls_cover_shortfall():
+    shortfall = 3700
+    plan = app.plan_topup_parts(5000 - shortfall, 5000, 2000, 0)
+    assert len(plan) == math.ceil(shortfall / app.MAX_CHARS_PER_CALL)
+    assert sum(plan) >= shortfall
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+BatchScheduler 테스트 (FakeLLMClient, API 비용 없음)
+- 호출 밖에서 난 오류(쪽수 확인 등)는 그 파트의 실패가 되고 배치는 끝까지 진행
+- 워커 스레드가 모두 멈추면 iter_completed가 기다리지 않고 오류
+- 분량이 넘치는 모델이면 챕터의 첫 파트 쪽수를 보고 남은 중간 파트를 건너뜀
+"""
+
+import threading
+
+import pytest
+
+import app
+
+FAKE_CONFIG = {"time_scale": 0, "error_rate": 0, "rate_limit_rate": 0}
+MODEL = "gpt-4o-mini"
+SERVICE = "사주"
+WAIT_SECONDS = 60  # 이 안에 끝나지 않으면 멈춘 것으로 봄
+
+def run_scheduler(customers, pages=20, chapters=None, journals=None, max_workers=4, patch=None, client=None):
+    """고객들을 스케줄러로 처리 → (완료 순서대로 CustomerJob 목록, iter_completed가 낸 오류)"""
+    guide = app.get_default_guides()[SERVICE]
+    chapters = chapters or guide["목차"][:3]
+    scheduler = app.BatchScheduler(client or app.FakeLLMClient(FAKE_CONFIG), MODEL, max_workers)
+    if patch:
+        patch(scheduler)
+    scheduler.start()
+    for i, customer in enumerate(customers):
+        journal = journals[i] if journals else None
+        scheduler.submit_customer(i, customer["이름"], customer, chapters, pages, guide["지침"], SERVICE, journal)
+    
+    done = []
+    errors = []
+    
+    def consume():
+        try:
+            done.extend(scheduler.iter_completed(poll_interval=0.05))
+        except Exception as e:
+            errors.append(e)
+    
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    thread.join(WAIT_SECONDS)
+    assert not thread.is_alive(), "iter_completed가 끝나지 않음"
+    scheduler.stop()
+    return done, errors
+
+def test_error_outside_the_api_call_fails_only_that_part(monkeypatch):
+    original = app.CustomerJob.should_skip
+    
+    def flaky_should_skip(job, ch_idx, part):
+        if ch_idx == 0 and part == 1:
+            raise ValueError("쪽수 확인 실패")
+        return original(job, ch_idx, part)
+    
+    monkeypatch.setattr(app.CustomerJob, "should_skip", flaky_should_skip)
+    done, errors = run_scheduler([{"이름": "김하나"}])
+    
+    assert errors == []
+    job = done[0]
+    assert job.status == "생성 실패"
+    assert [(failure.chapter_title, failure.part_num) for failure in job.failures] == [(job.chapters[0], 1)]
+    # 나머지 파트는 모두 생성됨
+    assert sum(1 for parts in job.results for content in parts if content) > 0
+    assert job.remaining == 0
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_iter_completed_fails_fast_when_workers_die():
+    def break_settle(scheduler):
+        def settle(*args, **kwargs):
+            raise RuntimeError("카운터 갱신 실패")
+        scheduler._settle_part = settle
+    
+    done, errors = run_scheduler([{"이름": "김하나"}], max_workers=2, patch=break_settle)
+    
+    assert done == []
+    assert len(errors) == 1 and "워커 스레드" in str(errors[0])
+    assert "카운터 갱신 실패" in str(errors[0])
+
+def test_chapter_waits_for_first_part_before_other_parts():
+    guide = app.get_default_guides()[SERVICE]
+    chapters = guide["목차"][:3]
+    job = app.CustomerJob(0, "김하나", {"이름": "김하나"}, chapters, 60, guide["지침"], SERVICE, model=MODEL, page_counter=app.PageCounter(), stage_parts=True)
+    
+    assert job.pending_parts() == [(ch_idx, 1) for ch_idx in range(len(chapters))]
+    released = job.complete_part(0, 1, "본문 " * 300)
+    assert released == [(0, part) for part in range(2, job.parts_per_chapter + 1)]
+
+def test_long_output_skips_middle_parts():
+    pages = 60
+    client = app.FakeLLMClient({**FAKE_CONFIG, "output_ratio": 2.0})
+    done, errors = run_scheduler([{"이름": "김하나"}], pages=pages, client=client)
+    
+    assert errors == []
+    job = done[0]
+    assert job.status == "생성 완료"
+    assert job.skipped_parts > 0
+    assert client.calls == job.total_parts - job.skipped_parts
+    # 건너뛰어도 챕터마다 쪽수 예산은 채움
+    for ch_idx, budget in enumerate(job.page_budgets):
+        assert job.chapter_fill(ch_idx)[0] >= budget
+
+def test_normal_output_skips_nothing():
+    client = app.FakeLLMClient({**FAKE_CONFIG, "output_ratio": 1.0})
+    done, errors = run_scheduler([{"이름": "김하나"}], pages=60, client=client)
+    
+    assert errors == []
+    assert done[0].skipped_parts == 0
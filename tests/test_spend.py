@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+비용 추정 / 지출 한도 테스트
+- settings의 model_prices가 UI 예상 비용과 Batch 제출 전 한도 확인에 반영되는지
+"""
+
+import pytest
+
+import app
+
+MODEL = "gpt-4o-mini"
+SERVICE = "사주"
+
+def test_price_override_changes_estimate():
+    guide = app.get_default_guides()[SERVICE]
+    chapters = guide["목차"][:3]
+    default = app.estimate_generation(chapters, 20, MODEL, guide["지침"], SERVICE)
+    doubled = {MODEL: {key: value * 2 for key, value in app.MODEL_PRICES[MODEL].items()}}
+    
+    estimate = app.estimate_generation(chapters, 20, MODEL, guide["지침"], SERVICE, prices=app.price_table({"model_prices": doubled}))
+    
+    assert default["cost"] > 0
+    assert estimate["cost"] == pytest.approx(default["cost"] * 2)
+    # 호출/토큰 수는 가격과 무관
+    assert estimate["calls"] == default["calls"]
+    assert estimate["output_tokens"] == default["output_tokens"]
+
+def test_batch_spend_check_uses_price_override():
+    guide = app.get_default_guides()[SERVICE]
+    payload = {
+        "customer_name": "김하나",
+        "chapters": guide["목차"][:3],
+        "total_pages": 20,
+        "model": MODEL,
+        "guide": guide["지침"],
+        "service_type": SERVICE
+    }
+    estimate = app.estimate_generation(payload["chapters"], 20, MODEL, payload["guide"], SERVICE)
+    # 기본 가격으로는 한도 안쪽
+    settings = {"job_spend_cap_usd": estimate["cost"] * app.BATCH_PRICE_RATIO * 5}
+    app.check_batch_spend([payload], settings)
+    
+    settings["model_prices"] = {MODEL: {key: value * 10 for key, value in app.MODEL_PRICES[MODEL].items()}}
+    with pytest.raises(app.SpendCapExceeded):
+        app.check_batch_spend([payload], settings)